@@ -0,0 +1,90 @@
+import os
+import json
+import math
+import subprocess
+from django.http import HttpResponse
+from rest_framework import exceptions
+from django.utils.translation import gettext_lazy as _
+
+from .tasks import TaskNestedView
+from app.pointcloud_utils import extract_cross_section, CrossSectionTooLargeError
+from webodm import settings
+import logging
+
+logger = logging.getLogger('app.logger')
+
+
+class CrossSection(TaskNestedView):
+    def post(self, request, pk=None, project_pk=None):
+        """
+        Extract the points within a corridor around a polyline
+        (coordinates in the reference system of the point cloud)
+        """
+        task = self.get_and_check_task(request, pk)
+
+        line = request.data.get('line')
+        try:
+            line = [(float(v[0]), float(v[1])) for v in line]
+            width = float(request.data.get('width', 1))
+            resolution = request.data.get('resolution')
+            if resolution is not None:
+                resolution = float(resolution)
+        except (TypeError, ValueError, IndexError):
+            raise exceptions.ValidationError(_("Invalid parameters"))
+
+        if len(line) < 2:
+            raise exceptions.ValidationError(_("A line needs at least 2 points"))
+        length = sum(math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(line[:-1], line[1:]))
+        if length > settings.POINTCLOUD_SECTION_MAX_LENGTH:
+            raise exceptions.ValidationError(_("The line is too long"))
+        if width <= 0 or width > settings.POINTCLOUD_SECTION_MAX_WIDTH:
+            raise exceptions.ValidationError(_("Invalid width"))
+        if resolution is not None and resolution <= 0:
+            raise exceptions.ValidationError(_("Invalid resolution"))
+
+        export_format = request.data.get('format', 'binary')
+        if export_format not in ['binary', 'laz']:
+            raise exceptions.ValidationError(_("Unsupported format"))
+
+        # Only indexed point clouds are used, which are only read where they intersect the corridor
+        # (reading an entire point cloud is too expensive for a web request)
+        input = task.get_check_file_asset_path('georeferenced_model.copc.laz')
+        if input is None and os.path.isfile(task.assets_path(task.EPT_FILE)):
+            input = task.assets_path(task.EPT_FILE)
+
+        if input is None:
+            if task.get_point_cloud() is None:
+                raise exceptions.NotFound(_("Point cloud does not exist"))
+            raise exceptions.ValidationError(_("The point cloud is not ready yet, try again later"))
+
+        if not os.path.exists(settings.MEDIA_TMP):
+            os.makedirs(settings.MEDIA_TMP, exist_ok=True)
+
+        try:
+            data, count, origin, resolution = extract_cross_section(input, line, width, resolution=resolution,
+                                                        export_format=export_format, tmp_dir=settings.MEDIA_TMP,
+                                                        max_points=settings.POINTCLOUD_SECTION_MAX_POINTS,
+                                                        pointcloud_info=task.get_pointcloud_info(),
+                                                        timeout=settings.POINTCLOUD_SECTION_TIMEOUT)
+        except CrossSectionTooLargeError:
+            raise exceptions.ValidationError(_("The section has too many points, increase the point spacing or reduce the width"))
+        except subprocess.TimeoutExpired:
+            logger.warning("Timed out while extracting cross section for {}".format(task))
+            raise exceptions.ValidationError(_("The section took too long to extract, increase the point spacing or reduce the length"))
+        except subprocess.CalledProcessError as e:
+            logger.warning("Cannot extract cross section for {}: {}".format(task, e.stderr))
+            raise exceptions.ValidationError(_("Cannot extract cross section"))
+
+        response = HttpResponse(data, content_type="application/octet-stream")
+        if export_format == 'laz':
+            response['Content-Disposition'] = "attachment; filename=section.laz"
+        else:
+            # float32 (x, y, z, station) tuples, x, y, z relative to X-Origin
+            response['X-Origin'] = json.dumps(origin)
+
+        response['X-Point-Count'] = count
+
+        # Point spacing that was used (null for all points). Can be coarser
+        # than the requested one to stay within POINTCLOUD_SECTION_MAX_POINTS
+        response['X-Resolution'] = json.dumps(resolution)
+        return response
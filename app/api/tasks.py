@@ -1,6 +1,6 @@
 import os
 import re
-import shutil
+import time
 from wsgiref.util import FileWrapper
 
 import mimetypes
@@ -18,8 +18,8 @@ from django.db import transaction
 from django.http import FileResponse
 from django.http import HttpResponse
 from django.http import StreamingHttpResponse
+from django.utils.http import http_date
 from django.contrib.gis.geos import Polygon
-from zipstream.ng import ZipStream
 from rest_framework import status, serializers, viewsets, filters, exceptions, permissions, parsers
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
@@ -34,6 +34,8 @@ from worker import tasks as worker_tasks
 from .common import get_and_check_project, get_asset_download_filename, check_project_perms
 from .tags import TagsField
 from app.security import path_traversal_check
+from app.classes.chunked_upload import ChunkedUpload, ChunkedUploadError
+from app.classes.seekable_zip import SeekableZip
 from django.utils.translation import gettext_lazy as _
 from .fields import PolygonGeometryField
 from app.geoutils import geom_transform_wkt_bbox, get_srs_name_units_from_epsg_or_wkt
@@ -46,6 +48,72 @@ def flatten_files(request_files):
         [keys for keys in request_files])
      for file in filesList]
 
+def get_chunk_info(request, files, owner):
+    """
+    :param owner: identifier of the task (or project) the upload belongs to
+    :return: information about the chunk of a (Dropzone) chunked upload
+        included in the request, or None if this is not a chunked upload
+    """
+    chunk_index = request.data.get('dzchunkindex')
+    uuid = request.data.get('dzuuid')
+    total_chunk_count = request.data.get('dztotalchunkcount', None)
+    if len(files) != 1 or chunk_index is None or uuid is None or total_chunk_count is None:
+        return None
+
+    try:
+        chunk_index = int(chunk_index)
+        byte_offset = int(request.data.get('dzchunkbyteoffset', 0))
+        total_chunk_count = int(total_chunk_count)
+        total_size = request.data.get('dztotalfilesize')
+        total_size = int(total_size) if total_size is not None else None
+        chunk_size = request.data.get('dzchunksize')
+        chunk_size = int(chunk_size) if chunk_size is not None else None
+    except ValueError:
+        raise exceptions.ValidationError(detail="Some parameters are not integers")
+
+    uuid = re.sub('[^0-9a-zA-Z-]+', "", uuid)
+    try:
+        upload = ChunkedUpload(settings.FILE_UPLOAD_TEMP_DIR, uuid, total_chunk_count, total_size, chunk_size, owner)
+        upload.check_chunk(chunk_index, byte_offset)
+    except ChunkedUploadError as e:
+        raise exceptions.ValidationError(detail=str(e))
+
+    return {
+        'uuid': uuid,
+        'chunk_index': chunk_index,
+        'byte_offset': byte_offset,
+        'total_chunk_count': total_chunk_count,
+        'checksum': request.data.get('dzchunkchecksum'),
+        'upload': upload
+    }
+
+def upload_session_response(request, owner):
+    """
+    :param owner: identifier of the task (or project) the upload belongs to
+    :return: response with the chunks of a chunked upload (identified by the dzuuid
+        query parameter) that have been received, so that clients can resume it
+    """
+    uuid = re.sub('[^0-9a-zA-Z-]+', "", request.query_params.get('dzuuid', ''))
+    if not uuid:
+        raise exceptions.ValidationError(detail="dzuuid is required")
+
+    upload = ChunkedUpload.load(settings.FILE_UPLOAD_TEMP_DIR, uuid, owner)
+    if upload is None:
+        raise exceptions.NotFound()
+
+    received_chunks = upload.received_chunks()
+    received = set(received_chunks)
+    return Response({
+        'uuid': uuid,
+        'total_chunk_count': upload.total_chunk_count,
+        'total_size': upload.total_size,
+        'chunk_size': upload.chunk_size,
+        'received_chunks': received_chunks,
+        'received_ranges': upload.received_ranges(),
+        'missing_chunks': [i for i in range(upload.total_chunk_count) if i not in received],
+        'expires_in': max(0, int(upload.last_activity() + settings.UPLOAD_SESSION_TTL - time.time()))
+    }, status=status.HTTP_200_OK)
+
 class TaskIDsSerializer(serializers.BaseSerializer):
     def to_representation(self, obj):
         return obj.id
@@ -60,6 +128,7 @@ class TaskSerializer(serializers.ModelSerializer):
     tags = TagsField(required=False)
     crop = PolygonGeometryField(required=False, allow_null=True)
     srs = serializers.SerializerMethodField()
+    ept_state = serializers.SerializerMethodField()
 
     def get_processing_node_name(self, obj):
         if obj.processing_node is not None:
@@ -95,10 +164,15 @@ class TaskSerializer(serializers.ModelSerializer):
     def get_srs(self, obj):
         return get_srs_name_units_from_epsg_or_wkt(obj.epsg, obj.wkt)
 
+    def get_ept_state(self, obj):
+        if obj.status != status_codes.COMPLETED:
+            return None
+        return obj.get_ept_state()
+
     class Meta:
         model = models.Task
         exclude = ('orthophoto_extent', 'dsm_extent', 'dtm_extent', )
-        read_only_fields = ('processing_time', 'status', 'last_error', 'created_at', 'pending_action', 'available_assets', 'size', )
+        read_only_fields = ('processing_time', 'status', 'last_error', 'created_at', 'pending_action', 'available_assets', 'size', 'processing_stages', 'duplicate_source', )
 
 class TaskViewSet(viewsets.ViewSet):
     """
@@ -186,8 +260,8 @@ class TaskViewSet(viewsets.ViewSet):
         except ValueError:
             raise exceptions.ValidationError("Invalid parameter")
 
-        lines = task.console.output().rstrip().split('\n')
-        count = len(lines)
+        # Trailing blank lines are left out (same as output.rstrip().split('\n'))
+        count = task.console.line_count(rstrip=True)
         line_start = min(line_num, count)
         line_end = None
 
@@ -198,13 +272,16 @@ class TaskViewSet(viewsets.ViewSet):
                 line_start = line_start if count - line_start <= abs(limit) else count - abs(limit) 
                 line_end = None 
 
+        # Only the requested lines are read
+        lines = task.console.lines(line_start, line_end, rstrip=True)
+
         if fmt == 'text':
-            return Response('\n'.join(lines[line_start:line_end]))
+            return Response('\n'.join(lines))
         elif fmt == 'raw':
-            return HttpResponse('\n'.join(lines[line_start:line_end]), content_type="text/plain; charset=utf-8")
+            return HttpResponse('\n'.join(lines), content_type="text/plain; charset=utf-8")
         else:
             return Response({
-                'lines': lines[line_start:line_end],
+                'lines': lines,
                 'count': count
             })
 
@@ -271,22 +348,25 @@ class TaskViewSet(viewsets.ViewSet):
             raise exceptions.NotFound()
 
         task.partial = False
-        task.images_count = len(task.scan_images())
+
+        # Images count and size are updated as files are uploaded
+        if task.images_count < 1:
+            task.reconcile_counters()
 
         if task.images_count < 1:
             raise exceptions.ValidationError(detail=_("You need to upload at least 1 file before commit"))
 
-        task.update_size()
         task.save()
+        task.project.owner.profile.clear_used_quota_cache()
         worker_tasks.process_task.delay(task.id)
 
         serializer = TaskSerializer(task)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get', 'post'])
     def upload(self, request, pk=None, project_pk=None):
         """
-        Add images to a task
+        Add images to a task (GET: query the state of a chunked upload)
         """
         try:
             task = self.queryset.get(pk=pk, project=project_pk)
@@ -294,30 +374,14 @@ class TaskViewSet(viewsets.ViewSet):
         except (ObjectDoesNotExist, ValidationError):
             raise exceptions.NotFound()
 
+        if request.method == 'GET':
+            return upload_session_response(request, "task-%s" % task.id)
+
         files = flatten_files(request.FILES)
         if len(files) == 0:
             raise exceptions.ValidationError(detail=_("No files uploaded"))
 
-        chunk_info = None
-        chunk_index = request.data.get('dzchunkindex')
-        uuid = request.data.get('dzuuid') 
-        total_chunk_count = request.data.get('dztotalchunkcount', None)
-        if len(files) == 1 and chunk_index is not None and uuid is not None and total_chunk_count is not None:
-            byte_offset = request.data.get('dzchunkbyteoffset', 0)
-            try:
-                chunk_index = int(chunk_index)
-                byte_offset = int(byte_offset)
-                total_chunk_count = int(total_chunk_count)
-            except ValueError:
-                raise exceptions.ValidationError(detail="chunkIndex is not an int")
-            
-            chunk_info = {
-                'uuid': re.sub('[^0-9a-zA-Z-]+', "", uuid),
-                'chunk_index': chunk_index,
-                'byte_offset': byte_offset,
-                'total_chunk_count': total_chunk_count,
-                'tmp_upload_file': os.path.join(settings.FILE_UPLOAD_TEMP_DIR, f"{uuid}.upload")
-            }
+        chunk_info = get_chunk_info(request, files, "task-%s" % task.id)
 
         # 50% of the time, raise an exception
         # import random
@@ -327,10 +391,15 @@ class TaskViewSet(viewsets.ViewSet):
         #     return Response('', status=524)
         #     raise exceptions.ValidationError(detail=_("Random upload failure for testing"))
 
-        uploaded = task.handle_images_upload(files, chunk_info)
-        if len(uploaded) > 0:
-            task.images_count = len(task.scan_images())
-            # Update other parameters such as processing node, task name, etc.
+        try:
+            uploaded = task.handle_images_upload(files, chunk_info)
+        except ChunkedUploadError as e:
+            raise exceptions.ValidationError(detail=str(e))
+        # Images count and size have been updated by handle_images_upload.
+        # Update other parameters such as processing node, task name, etc.
+        # (saving the task only if there are any, so that the counters
+        # don't get overwritten by concurrent uploads)
+        if len(uploaded) > 0 and any(k not in request.FILES and not k.startswith('dz') for k in request.data.keys()):
             serializer = TaskSerializer(task, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
             serializer.save()
@@ -391,7 +460,6 @@ class TaskViewSet(viewsets.ViewSet):
                 if align_task is not None:
                     task.set_alignment_file_from(align_task)
                 task.handle_images_upload(files)
-                task.images_count = len(task.scan_images())
 
                 # Update other parameters such as processing node, task name, etc.
                 serializer = TaskSerializer(task, data=request.data, partial=True)
@@ -448,11 +516,84 @@ class TaskNestedView(APIView):
         return task
 
 
+def parse_range_header(value, size):
+    """
+    Parse a HTTP Range header (single range only)
+    :param value: Range header value (e.g. "bytes=0-1023")
+    :param size: total size of the resource
+    :return: (start, end) inclusive byte positions, or None if the header
+        should be ignored (missing, malformed, multiple ranges or
+        syntactically invalid, such as a last byte before the first one)
+    :raises ValueError: if the range cannot be satisfied
+    """
+    if not value:
+        return None
+
+    m = re.match(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", value)
+    if m is None:
+        return None
+
+    start, end = m.group(1), m.group(2)
+    if start == "" and end == "":
+        return None
+
+    if start == "":
+        # Suffix range (last N bytes)
+        length = int(end)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        start = max(0, size - length)
+        end = size - 1
+    else:
+        start = int(start)
+        if end != "" and int(end) < start:
+            # Invalid, must be ignored (RFC 7233 section 2.1)
+            return None
+        if start >= size:
+            raise ValueError("Unsatisfiable range")
+        end = min(int(end), size - 1) if end != "" else size - 1
+
+    return start, end
+
+
+def file_range_iterator(file, start, length, chunk_size=65536):
+    with file:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
 def download_file_response(request, filePath, content_disposition, download_filename=None):
     filename = os.path.basename(filePath)
     if download_filename is None: 
         download_filename = filename
     filesize = os.stat(filePath).st_size
+
+    # Partial content (e.g. point cloud viewers reading octree nodes from COPC files)
+    try:
+        byte_range = parse_range_header(request.META.get('HTTP_RANGE'), filesize)
+    except ValueError:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = "bytes */{}".format(filesize)
+        return response
+
+    if byte_range is not None:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(file_range_iterator(open(filePath, "rb"), start, length),
+                                         status=status.HTTP_206_PARTIAL_CONTENT)
+        response['Content-Type'] = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response['Content-Disposition'] = "{}; filename={}".format(content_disposition, download_filename)
+        response['Content-Range'] = "bytes {}-{}/{}".format(start, end, filesize)
+        response['Content-Length'] = length
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
     file = open(filePath, "rb")
 
     # More than 100mb, normal http response, otherwise stream
@@ -467,6 +608,7 @@ def download_file_response(request, filePath, content_disposition, download_file
     response['Content-Type'] = mimetypes.guess_type(filename)[0] or "application/zip"
     response['Content-Disposition'] = "{}; filename={}".format(content_disposition, download_filename)
     response['Content-Length'] = filesize
+    response['Accept-Ranges'] = 'bytes'
 
     # For testing
     if stream:
@@ -476,15 +618,43 @@ def download_file_response(request, filePath, content_disposition, download_file
 
 
 def download_file_stream(request, stream, content_disposition, download_filename=None):
-    if not isinstance(stream, ZipStream):
+    if not isinstance(stream, SeekableZip):
         # This should never happen, but just in case..
-        raise exceptions.ValidationError("stream not a zipstream instance")
-    
-    response = StreamingHttpResponse(stream, content_type=(mimetypes.guess_type(download_filename)[0] or "application/zip"))
+        raise exceptions.ValidationError("stream not a zip stream instance")
+
+    size = len(stream)
+    etag = stream.etag()
+    last_modified = http_date(stream.last_modified())
+    content_type = mimetypes.guess_type(download_filename)[0] or "application/zip"
+
+    # Resume interrupted downloads, unless the archive has changed since (If-Range)
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range not in [etag, last_modified]:
+        range_header = None
+
+    try:
+        byte_range = parse_range_header(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = "bytes */{}".format(size)
+        return response
+
+    if byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(stream.iter_range(start, end), content_type=content_type,
+                                         status=status.HTTP_206_PARTIAL_CONTENT)
+        response['Content-Range'] = "bytes {}-{}/{}".format(start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Length'] = size
 
-    response['Content-Type'] = mimetypes.guess_type(download_filename)[0] or "application/zip"
+    response['Content-Type'] = content_type
     response['Content-Disposition'] = "{}; filename={}".format(content_disposition, download_filename)
-    response['Content-Length'] = len(stream)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
 
     # For testing
     response['_stream'] = 'yes'
@@ -666,18 +836,28 @@ class TaskBackup(TaskNestedView):
     def get(self, request, pk=None, project_pk=None):
         """
         Downloads a task's backup
+        ?since=<id> downloads only the files that changed since the backup with the given manifest id
         """
         task = self.get_and_check_task(request, pk)
 
         # Check and download
         try:
-            asset_fs = task.get_task_backup_stream()
+            asset_fs, manifest = task.get_task_backup_stream(since=request.GET.get('since'))
         except FileNotFoundError:
             raise exceptions.NotFound(_("Asset does not exist"))
 
         download_filename = request.GET.get('filename', get_asset_download_filename(task, "backup.zip"))
 
-        return download_file_stream(request, asset_fs, 'attachment', download_filename=download_filename)
+        response = download_file_stream(request, asset_fs, 'attachment', download_filename=download_filename)
+
+        # Resumed downloads (partial content) were started by a full request,
+        # which has already kept the manifest
+        if response.status_code == status.HTTP_200_OK:
+            task.save_backup_manifest(manifest)
+
+        # Pass as ?since= to get an incremental backup next time
+        response['Backup-Manifest'] = manifest['id']
+        return response
 
 """
 Task assets import
@@ -686,6 +866,15 @@ class TaskAssetsImport(APIView):
     permission_classes = (permissions.AllowAny,)
     parser_classes = (parsers.MultiPartParser, parsers.JSONParser, parsers.FormParser,)
 
+    def get(self, request, project_pk=None):
+        """
+        Query the state of a chunked import upload
+        """
+        project = get_and_check_project(request, project_pk, ('change_project',))
+
+        # The task is created once the upload completes
+        return upload_session_response(request, "project-%s" % project.id)
+
     def post(self, request, project_pk=None):
         project = get_and_check_project(request, project_pk, ('change_project',))
 
@@ -702,38 +891,16 @@ class TaskAssetsImport(APIView):
             if re.match(r"^https?:\/\/.+$", import_url.lower()) is None:
                 raise exceptions.ValidationError(detail=_("Invalid URL. Did you mean %(hint)s ?") % { 'hint': f'http://{import_url}'})
 
-        chunk_index = request.data.get('dzchunkindex')
-        uuid = request.data.get('dzuuid') 
-        total_chunk_count = request.data.get('dztotalchunkcount', None)
-
         # Chunked upload?
-        tmp_upload_file = None
-        if len(files) > 0 and chunk_index is not None and uuid is not None and total_chunk_count is not None:
-            byte_offset = request.data.get('dzchunkbyteoffset', 0) 
-
+        chunk_info = get_chunk_info(request, files, "project-%s" % project.id)
+        if chunk_info is not None:
             try:
-                chunk_index = int(chunk_index)
-                byte_offset = int(byte_offset)
-                total_chunk_count = int(total_chunk_count)
-            except ValueError:
-                raise exceptions.ValidationError(detail="Some parameters are not integers")
-            uuid = re.sub('[^0-9a-zA-Z-]+', "", uuid)
+                completed = chunk_info['upload'].write_chunk(chunk_info['chunk_index'], chunk_info['byte_offset'],
+                                                             files[0].chunks(), chunk_info['checksum'])
+            except ChunkedUploadError as e:
+                raise exceptions.ValidationError(detail=str(e))
 
-            tmp_upload_file = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, f"{uuid}.upload")
-            if os.path.isfile(tmp_upload_file) and chunk_index == 0:
-                os.unlink(tmp_upload_file)
-            
-            with open(tmp_upload_file, 'ab') as fd:
-                fd.truncate(byte_offset)
-                fd.seek(byte_offset)
-                if isinstance(files[0], InMemoryUploadedFile):
-                    for chunk in files[0].chunks():
-                        fd.write(chunk)
-                else:
-                    with open(files[0].temporary_file_path(), 'rb') as f:
-                        shutil.copyfileobj(f, fd)
-            
-            if chunk_index + 1 < total_chunk_count:
+            if not completed:
                 return Response({'uploaded': True}, status=status.HTTP_200_OK)
 
         # Ready to import
@@ -748,7 +915,7 @@ class TaskAssetsImport(APIView):
             destination_file = task.assets_path("all.zip")
 
             # Non-chunked file import
-            if tmp_upload_file is None and len(files) > 0:
+            if chunk_info is None and len(files) > 0:
                 with open(destination_file, 'wb+') as fd:
                     if isinstance(files[0], InMemoryUploadedFile):
                         for chunk in files[0].chunks():
@@ -756,9 +923,8 @@ class TaskAssetsImport(APIView):
                     else:
                         with open(files[0].temporary_file_path(), 'rb') as file:
                             copyfileobj(file, fd)
-            elif tmp_upload_file is not None:
-                # Move
-                shutil.move(tmp_upload_file, destination_file)
+            elif chunk_info is not None:
+                chunk_info['upload'].finalize(destination_file)
 
             worker_tasks.process_task.delay(task.id)
 
@@ -0,0 +1,257 @@
+"""
+Incremental task backups.
+A backup includes a manifest (data/backup_manifest.json) that lists every file of the task
+with its SHA-256 and size. An incremental backup is made against a previous manifest (its base)
+and includes only the files that are new or have changed since, plus the full manifest,
+so that files removed since the base can be removed on restore.
+
+A task can be restored from a chain archive: a zip containing the base backup followed
+by its incremental backups (each one a zip file), see restore_chain.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+
+logger = logging.getLogger('app.logger')
+
+MANIFEST_FILE = os.path.join("data", "backup_manifest.json")
+MANIFESTS_DIR = os.path.join("data", "backups")
+HASH_CACHE_FILE = os.path.join("data", "backup_hashes.json")
+
+MANIFEST_ID_REGEX = r'^[0-9a-f]{16}$'
+
+
+class BackupError(Exception):
+    pass
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def compute_files(directory, exclude=(), known_digests=None):
+    """
+    List the files of a task directory with their SHA-256 and size.
+    Digests are cached (by size and modification time) in HASH_CACHE_FILE,
+    so that only new or modified files are hashed.
+    :param exclude: paths (relative to directory) of files to leave out
+    :param known_digests: optional dictionary of relative path --> digest of files
+        whose digest is already known (e.g. images in the image store)
+    :return: dictionary of relative path --> {'sha256': digest, 'size': bytes}
+    """
+    exclude = set(exclude) | {HASH_CACHE_FILE, MANIFEST_FILE}
+    known_digests = known_digests or {}
+    cache_file = os.path.join(directory, HASH_CACHE_FILE)
+    cache = read_json(cache_file, {})
+    new_cache = {}
+    files = {}
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        rel_dir = os.path.relpath(dirpath, directory)
+        if rel_dir == MANIFESTS_DIR:
+            continue
+
+        for f in filenames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, f))
+            if rel_path in exclude:
+                continue
+
+            st = os.stat(os.path.join(dirpath, f))
+            cached = cache.get(rel_path)
+            if rel_path in known_digests:
+                digest = known_digests[rel_path]
+            elif cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                digest = cached[2]
+            else:
+                digest = file_digest(os.path.join(dirpath, f))
+
+            new_cache[rel_path] = [st.st_size, st.st_mtime_ns, digest]
+            files[rel_path] = {'sha256': digest, 'size': st.st_size}
+
+    try:
+        write_json(cache_file, new_cache)
+    except OSError as e:
+        logger.warning("Cannot write backup hash cache: %s" % str(e))
+
+    return files
+
+
+def manifest_id(files):
+    """
+    :return: identifier of a set of files (the same files always have the same identifier)
+    """
+    h = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()[0:16]
+
+
+def make_manifest(files, base=None):
+    """
+    :param base: identifier of the manifest this backup is incremental to (or None)
+    :return: manifest of a backup of files
+    """
+    return {
+        'version': 1,
+        'id': manifest_id(files),
+        'base': base,
+        'files': files
+    }
+
+
+def create_manifest(directory, files, base=None, keep=None):
+    """
+    Create a manifest and keep a copy of it in the task directory, so that
+    later backups can be made incremental against it
+    :param base: identifier of the manifest this backup is incremental to (or None)
+    :param keep: number of manifests to keep (the oldest ones are removed)
+    :return: manifest
+    """
+    manifest = make_manifest(files, base)
+    save_manifest(directory, manifest, keep)
+    return manifest
+
+
+def save_manifest(directory, manifest, keep=None):
+    """
+    Keep a copy of a manifest in the task directory
+    :param keep: number of manifests to keep (the oldest ones are removed)
+    """
+    write_json(manifest_path(directory, manifest['id']), manifest)
+
+    if keep is not None:
+        manifests_dir = os.path.join(directory, MANIFESTS_DIR)
+        paths = sorted([os.path.join(manifests_dir, f) for f in os.listdir(manifests_dir)], key=os.path.getmtime, reverse=True)
+        for p in paths[max(1, keep):]:
+            os.remove(p)
+
+
+def manifest_path(directory, mid):
+    if not re.match(MANIFEST_ID_REGEX, mid or ""):
+        raise FileNotFoundError("Invalid backup manifest id")
+    return os.path.join(directory, MANIFESTS_DIR, mid + ".json")
+
+
+def read_manifest(directory, mid):
+    """
+    :return: a manifest previously created for a task
+    :raise FileNotFoundError: if it does not exist
+    """
+    with open(manifest_path(directory, mid), 'r') as f:
+        return json.loads(f.read())
+
+
+def changed_files(files, base_files):
+    """
+    :return: list of relative paths of the files that are new or have changed since base_files
+    """
+    return sorted(p for p, f in files.items() if base_files.get(p, {}).get('sha256') != f['sha256'])
+
+
+def is_chain(zip_path):
+    """
+    :return: True if the zip file is a chain of backups (all entries are zip files)
+    """
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as z:
+            names = [n for n in z.namelist() if not n.endswith("/")]
+            return len(names) > 0 and all(n.lower().endswith(".zip") for n in names)
+    except zipfile.BadZipFile:
+        return False
+
+
+def read_archive_manifest(z):
+    try:
+        return json.loads(z.read(MANIFEST_FILE.replace(os.path.sep, "/")).decode('utf-8'))
+    except (KeyError, ValueError):
+        raise BackupError("Not an incremental backup")
+
+
+def restore_chain(zip_path, destination, tmp_dir=None):
+    """
+    Assemble a backup from a chain archive: extract the full backup, then
+    apply each incremental backup in order. The backups must be stored in the chain
+    in the order they were made. The result in destination is the same
+    as if the last backup had been a full backup.
+    :param tmp_dir: directory where each backup is unpacked from the chain before
+        being extracted (must not be in destination)
+    :raise BackupError: if the chain is incomplete or a file does not match the manifest
+    """
+    tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+    manifest = None
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as chain:
+            for name in chain.namelist():
+                if name.endswith("/"):
+                    continue
+
+                part = os.path.join(tmp_dir, "part.zip")
+                with chain.open(name) as src, open(part, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+
+                with zipfile.ZipFile(part, 'r') as z:
+                    part_manifest = read_archive_manifest(z)
+                    if manifest is None and part_manifest.get('base'):
+                        raise BackupError("A backup chain must start with a full backup")
+                    if manifest is not None and part_manifest.get('base') != manifest['id']:
+                        raise BackupError("%s is not an incremental backup of the previous backup in the chain" % name)
+
+                    z.extractall(destination)
+                    manifest = part_manifest
+                os.remove(part)
+
+                # Remove files that were deleted since the previous backup
+                for dirpath, _, filenames in os.walk(destination):
+                    for f in filenames:
+                        path = os.path.join(dirpath, f)
+                        rel_path = os.path.relpath(path, destination)
+                        if rel_path not in manifest['files'] and rel_path != MANIFEST_FILE and \
+                                os.path.abspath(path) != os.path.abspath(zip_path):
+                            os.remove(path)
+
+        if manifest is None:
+            raise BackupError("Empty backup chain")
+        verify(destination, manifest)
+
+        # The restored files are now a full backup
+        os.remove(os.path.join(destination, MANIFEST_FILE))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def verify(directory, manifest):
+    """
+    Check that the files listed in a manifest are all in directory,
+    with the same size and SHA-256
+    :raise BackupError: otherwise
+    """
+    for rel_path, f in manifest['files'].items():
+        path = os.path.join(directory, rel_path)
+        if not os.path.isfile(path):
+            raise BackupError("%s is missing from the backup" % rel_path)
+        if os.path.getsize(path) != f['size'] or file_digest(path) != f['sha256']:
+            raise BackupError("%s does not match the backup manifest" % rel_path)
@@ -0,0 +1,289 @@
+import os
+import time
+import fcntl
+import struct
+import shutil
+import hashlib
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('app.logger')
+
+# Total size, chunk size (-1 if unknown), number of chunks, owner
+BITMAP_HEADER = struct.Struct('<qqI64s')
+
+UPLOAD_EXTENSION = ".upload"
+BITMAP_EXTENSION = ".chunks"
+
+
+class ChunkedUploadError(Exception):
+    pass
+
+
+class ChunkedUpload:
+    """
+    Receives the chunks of an uploaded file in any order, possibly concurrently.
+    Each chunk is written at its byte offset into <uuid>.upload (preallocated when
+    the total size is known) and is then marked as received in a bitmap persisted
+    to <uuid>.chunks. The bitmap is only read and updated while holding an
+    exclusive lock on it, so that exactly one request sees the upload become complete.
+
+    The bitmap is the state of an upload session: as long as it exists, clients
+    can query which chunks have been received and upload only the missing ones
+    (see load and received_ranges), even after a restart of the client or the server.
+
+    Sessions belong to an owner (e.g. a task), recorded in the bitmap header:
+    they cannot be queried or written to on behalf of another owner.
+    """
+
+    def __init__(self, directory, uuid, total_chunk_count, total_size=None, chunk_size=None, owner=""):
+        self.uuid = uuid
+        self.owner = str(owner)
+        self.path = os.path.join(directory, uuid + UPLOAD_EXTENSION)
+        self.bitmap_path = os.path.join(directory, uuid + BITMAP_EXTENSION)
+        self.total_chunk_count = total_chunk_count
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+
+        if total_chunk_count < 1:
+            raise ChunkedUploadError("Invalid chunk count")
+        if total_size is not None and total_size < 0:
+            raise ChunkedUploadError("Invalid file size")
+        if len(self.owner.encode('utf-8')) > 64:
+            raise ChunkedUploadError("Invalid owner")
+
+    @staticmethod
+    def load(directory, uuid, owner=""):
+        """
+        :return: the upload session with the given uuid, or None if there's none
+            (or if it belongs to another owner)
+        """
+        try:
+            with open(os.path.join(directory, uuid + BITMAP_EXTENSION), 'rb') as f:
+                header = f.read(BITMAP_HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) != BITMAP_HEADER.size:
+            return None
+
+        total_size, chunk_size, total_chunk_count, header_owner = BITMAP_HEADER.unpack(header)
+        try:
+            upload = ChunkedUpload(directory, uuid, total_chunk_count,
+                                   total_size if total_size >= 0 else None,
+                                   chunk_size if chunk_size >= 0 else None,
+                                   owner)
+        except ChunkedUploadError:
+            return None
+
+        if header_owner != upload.owner_bytes():
+            return None
+        return upload
+
+    @contextmanager
+    def locked_bitmap(self):
+        fd = os.open(self.bitmap_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            self.init_bitmap(fd)
+            yield fd
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def owner_bytes(self):
+        return self.owner.encode('utf-8').ljust(64, b"\0")
+
+    def header(self):
+        return BITMAP_HEADER.pack(self.total_size if self.total_size is not None else -1,
+                                  self.chunk_size if self.chunk_size is not None else -1,
+                                  self.total_chunk_count,
+                                  self.owner_bytes())
+
+    def bitmap_size(self):
+        return (self.total_chunk_count + 7) // 8
+
+    def init_bitmap(self, fd):
+        """
+        Start a new upload, unless the bitmap belongs to an upload of the same file.
+        Uploads of other owners are never replaced.
+        """
+        header = self.header()
+        current = os.pread(fd, BITMAP_HEADER.size, 0)
+        if current == header and \
+                os.fstat(fd).st_size == BITMAP_HEADER.size + self.bitmap_size() and \
+                os.path.isfile(self.path):
+            return
+
+        if len(current) == BITMAP_HEADER.size and BITMAP_HEADER.unpack(current)[3] != self.owner_bytes():
+            raise ChunkedUploadError("Upload session %s belongs to another owner" % self.uuid)
+
+        # Preallocate the file
+        with open(self.path, 'wb') as f:
+            if self.total_size:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, self.total_size)
+                except OSError:
+                    # Not supported by the filesystem
+                    f.truncate(self.total_size)
+
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, header + bytes(self.bitmap_size()), 0)
+
+    def read_bitmap(self, fd):
+        return bytearray(os.pread(fd, self.bitmap_size(), BITMAP_HEADER.size).ljust(self.bitmap_size(), b"\0"))
+
+    def is_complete(self, bitmap):
+        return all(bitmap[i // 8] & (1 << (i % 8)) for i in range(self.total_chunk_count))
+
+    def received_chunks(self):
+        """
+        :return: sorted list of the indexes of the chunks that have been received
+        """
+        try:
+            fd = os.open(self.bitmap_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return []
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            if os.pread(fd, BITMAP_HEADER.size, 0) != self.header():
+                return []
+            bitmap = self.read_bitmap(fd)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        return [i for i in range(self.total_chunk_count) if bitmap[i // 8] & (1 << (i % 8))]
+
+    def received_ranges(self):
+        """
+        :return: list of [start, end] inclusive byte ranges that have been received
+            or None if the chunk size is not known
+        """
+        if self.chunk_size is None:
+            return None
+
+        ranges = []
+        for i in self.received_chunks():
+            start = i * self.chunk_size
+            end = start + self.chunk_size - 1
+            if self.total_size is not None:
+                end = min(end, self.total_size - 1)
+            if end < start:
+                continue
+            if len(ranges) > 0 and ranges[-1][1] + 1 == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def last_activity(self):
+        """
+        :return: time at which the last chunk was received (or the session was started)
+        """
+        return os.path.getmtime(self.bitmap_path)
+
+    def check_chunk(self, chunk_index, byte_offset):
+        if chunk_index < 0 or chunk_index >= self.total_chunk_count:
+            raise ChunkedUploadError("Invalid chunk index: %s" % chunk_index)
+        if byte_offset < 0 or (self.total_size is not None and byte_offset > self.total_size):
+            raise ChunkedUploadError("Invalid chunk offset: %s" % byte_offset)
+
+    def expected_length(self, byte_offset):
+        if self.total_size is None or self.chunk_size is None:
+            return None
+        return min(self.chunk_size, self.total_size - byte_offset)
+
+    def write_chunk(self, chunk_index, byte_offset, data, checksum=None):
+        """
+        Write a chunk and mark it as received
+        :param data: iterable of bytes
+        :param checksum: optional SHA-256 (hex) of the chunk, verified before the chunk is marked as received
+        :return: True if this chunk completed the upload (the caller should then finalize it)
+        """
+        self.check_chunk(chunk_index, byte_offset)
+
+        with self.locked_bitmap():
+            pass
+
+        h = hashlib.sha256()
+        length = 0
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            for buf in data:
+                view = memoryview(buf)
+                while len(view) > 0:
+                    written = os.pwrite(fd, view, byte_offset + length)
+                    length += written
+                    view = view[written:]
+                h.update(buf)
+
+            if self.total_size is not None and byte_offset + length > self.total_size:
+                raise ChunkedUploadError("Chunk %s exceeds the file size" % chunk_index)
+            expected = self.expected_length(byte_offset)
+            if expected is not None and length != expected:
+                raise ChunkedUploadError("Chunk %s is %s bytes, expected %s" % (chunk_index, length, expected))
+            if checksum and h.hexdigest() != checksum.lower():
+                raise ChunkedUploadError("Checksum mismatch for chunk %s" % chunk_index)
+
+            # Data must reach the disk before the chunk is marked as received
+            os.fdatasync(fd)
+        finally:
+            os.close(fd)
+
+        with self.locked_bitmap() as fd:
+            bitmap = self.read_bitmap(fd)
+            was_complete = self.is_complete(bitmap)
+            bitmap[chunk_index // 8] |= 1 << (chunk_index % 8)
+            os.pwrite(fd, bytes(bitmap[chunk_index // 8:chunk_index // 8 + 1]), BITMAP_HEADER.size + chunk_index // 8)
+            return not was_complete and self.is_complete(bitmap)
+
+    def finalize(self, dst_path):
+        """
+        Move the completed file to its destination
+        """
+        if self.total_size is not None and os.path.getsize(self.path) != self.total_size:
+            raise ChunkedUploadError("Uploaded file has the wrong size")
+        shutil.move(self.path, dst_path)
+        self.remove()
+
+    def remove(self):
+        for p in [self.path, self.bitmap_path]:
+            if os.path.exists(p):
+                os.remove(p)
+
+
+def is_session_file(directory, filename):
+    """
+    :return: True if filename is the bitmap or the file of an upload session
+    """
+    if filename.endswith(BITMAP_EXTENSION):
+        return True
+    if filename.endswith(UPLOAD_EXTENSION):
+        return os.path.exists(os.path.join(directory, filename[:-len(UPLOAD_EXTENSION)] + BITMAP_EXTENSION))
+    return False
+
+
+def cleanup_sessions(directory, ttl):
+    """
+    Remove the upload sessions that have not received chunks for more than ttl seconds
+    :return: list of uuids of the sessions that were removed
+    """
+    removed = []
+    now = time.time()
+    if not os.path.isdir(directory):
+        return removed
+
+    for f in os.listdir(directory):
+        if not f.endswith(BITMAP_EXTENSION):
+            continue
+
+        uuid = f[:-len(BITMAP_EXTENSION)]
+        try:
+            if os.path.getmtime(os.path.join(directory, f)) < now - ttl:
+                for p in [uuid + UPLOAD_EXTENSION, f]:
+                    if os.path.exists(os.path.join(directory, p)):
+                        os.remove(os.path.join(directory, p))
+                removed.append(uuid)
+        except FileNotFoundError:
+            pass
+
+    return removed
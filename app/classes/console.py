@@ -1,7 +1,14 @@
 import os
+import struct
 import logging
+from array import array
 logger = logging.getLogger('app.logger')
 
+# The index file stores the size and modification time of the console file
+# it was built for, followed by the byte offset after each newline
+INDEX_HEADER = struct.Struct('=QQ')
+INDEX_OFFSET = struct.Struct('=Q')
+
 class Console:
     def __init__(self, file):
         self.file = file
@@ -29,18 +36,253 @@ class Console:
     def output(self):
         return str(self)
 
+    @property
+    def index_file(self):
+        return self.file + ".idx"
+
+    def _stat(self):
+        try:
+            st = os.stat(self.file)
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    def _index_valid(self, stat):
+        try:
+            with open(self.index_file, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+            return len(header) == INDEX_HEADER.size and INDEX_HEADER.unpack(header) == stat
+        except OSError:
+            return False
+
+    def _remove_index(self):
+        try:
+            if os.path.isfile(self.index_file):
+                os.unlink(self.index_file)
+        except OSError:
+            logger.warn("Cannot remove console index: %s" % self.index_file)
+
+    def build_index(self):
+        """
+        Scan the console file and write its line offsets index
+        :return: size of the console file covered by the index, or None
+        """
+        stat = self._stat()
+        if stat is None:
+            self._remove_index()
+            return None
+
+        offsets = array('Q')
+        pos = 0
+        try:
+            with open(self.file, 'rb') as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    i = chunk.find(b'\n')
+                    while i != -1:
+                        offsets.append(pos + i + 1)
+                        i = chunk.find(b'\n', i + 1)
+                    pos += len(chunk)
+
+            # If the file changed while scanning, the index will not validate
+            # and will be built again the next time it's needed
+            tmp_file = "%s.%s.tmp" % (self.index_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                f.write(INDEX_HEADER.pack(pos, stat[1]))
+                offsets.tofile(f)
+            os.replace(tmp_file, self.index_file)
+            return pos
+        except OSError:
+            logger.warn("Cannot build console index: %s" % self.index_file)
+            return None
+
+    def _read_offset(self, f, i):
+        f.seek(INDEX_HEADER.size + i * INDEX_OFFSET.size)
+        return INDEX_OFFSET.unpack(f.read(INDEX_OFFSET.size))[0]
+
+    def _counts(self):
+        """
+        :return: (number of newlines, file size, offset after the last newline)
+        """
+        stat = self._stat()
+        if stat is None or stat[0] == 0:
+            return 0, 0, 0
+
+        size = stat[0]
+        if not self._index_valid(stat):
+            size = self.build_index()
+            if size is None:
+                return 0, 0, 0
+
+        try:
+            with open(self.index_file, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                newlines = (f.tell() - INDEX_HEADER.size) // INDEX_OFFSET.size
+                last_offset = self._read_offset(f, newlines - 1) if newlines > 0 else 0
+            return newlines, size, last_offset
+        except (OSError, struct.error):
+            return 0, 0, 0
+
+    def _content_end(self, size):
+        """
+        :return: offset after the last non-whitespace byte of the console file
+        """
+        try:
+            with open(self.file, 'rb') as f:
+                end = size
+                while end > 0:
+                    chunk_start = max(0, end - 65536)
+                    f.seek(chunk_start)
+                    chunk = f.read(end - chunk_start).rstrip()
+                    if chunk:
+                        return chunk_start + len(chunk)
+                    end = chunk_start
+        except OSError:
+            logger.warn("Cannot read console file: %s" % self.file)
+        return 0
+
+    def _rstrip_counts(self):
+        """
+        Same as _counts, for the console output without its trailing whitespace
+        (trailing blank lines included)
+        """
+        newlines, size, last_offset = self._counts()
+        size = self._content_end(size)
+        if size == 0:
+            return 0, 0, 0
+
+        try:
+            with open(self.index_file, 'rb') as f:
+                # Newlines before the end of the content (offsets are sorted)
+                lo, hi = 0, newlines
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self._read_offset(f, mid) <= size:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                last_offset = self._read_offset(f, lo - 1) if lo > 0 else 0
+            return lo, size, last_offset
+        except (OSError, struct.error):
+            return 0, 0, 0
+
+    def line_count(self, rstrip=False):
+        """
+        :param rstrip: count the lines of the output without its trailing whitespace,
+            same as len(output().rstrip().split("\n"))
+        :return: number of lines (a trailing newline does not start a new line)
+        """
+        if rstrip:
+            newlines, size, last_offset = self._rstrip_counts()
+            return newlines + 1
+
+        newlines, size, last_offset = self._counts()
+        return newlines + (1 if last_offset < size else 0)
+
+    def split_line_count(self):
+        """
+        :return: same as len(output().split("\n")), or 0 if there's no output
+        """
+        newlines, size, last_offset = self._counts()
+        return newlines + 1 if size > 0 else 0
+
+    def ends_with_newline(self):
+        newlines, size, last_offset = self._counts()
+        return size > 0 and last_offset == size
+
+    def lines(self, start=0, end=None, rstrip=False):
+        """
+        Read a range of lines without reading the entire console file
+        :param start: index of the first line
+        :param end: index after the last line (None for all remaining lines)
+        :param rstrip: read the lines of the output without its trailing whitespace,
+            same as output().rstrip().split("\n")[start:end]
+        :return: list of lines
+        """
+        if rstrip:
+            newlines, size, last_offset = self._rstrip_counts()
+            if size == 0:
+                return [""] if start == 0 and (end is None or end > 0) else []
+        else:
+            newlines, size, last_offset = self._counts()
+        count = newlines + (1 if last_offset < size else 0)
+        start = max(0, min(start, count))
+        end = count if end is None else max(start, min(end, count))
+        if start == end:
+            return []
+
+        try:
+            with open(self.index_file, 'rb') as idx:
+                byte_start = self._read_offset(idx, start - 1) if start > 0 else 0
+                byte_end = self._read_offset(idx, end - 1) if end <= newlines else size
+
+            with open(self.file, 'rb') as f:
+                f.seek(byte_start)
+                text = f.read(byte_end - byte_start).decode('utf-8', errors='replace')
+        except (OSError, struct.error):
+            logger.warn("Cannot read console file: %s" % self.file)
+            return []
+
+        if text.endswith("\n"):
+            text = text[:-1]
+        return text.split("\n")
+
     def append(self, text):
         if os.path.isdir(self.parent_dir):
             try:
                 # Write
                 if not os.path.isdir(self.base_dir):
                     os.makedirs(self.base_dir, exist_ok=True)
-                
-                with open(self.file, "a", encoding="utf-8") as f:
-                    f.write(text)
+
+                before = self._stat()
+                data = text.encode("utf-8")
+
+                with open(self.file, "ab") as f:
+                    f.write(data)
+
+                self._update_index(before, data)
             except IOError:
                 logger.warn("Cannot append to console file: %s" % self.file)
 
+    def _update_index(self, before, data):
+        """
+        Add the newlines of appended data to the index,
+        or drop the index if it does not match the file as it was
+        before the append (it will be built again when needed)
+        :param before: (size, mtime) of the console file before appending, or None
+        """
+        base = before[0] if before is not None else 0
+        after = self._stat()
+        if after is None or after[0] != base + len(data):
+            self._remove_index()
+            return
+
+        offsets = array('Q')
+        i = data.find(b'\n')
+        while i != -1:
+            offsets.append(base + i + 1)
+            i = data.find(b'\n', i + 1)
+
+        try:
+            if before is None:
+                with open(self.index_file, 'wb') as f:
+                    f.write(INDEX_HEADER.pack(*after))
+                    offsets.tofile(f)
+                return
+
+            with open(self.index_file, 'r+b') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size or INDEX_HEADER.unpack(header) != before:
+                    raise OSError("Stale index")
+                f.seek(0, os.SEEK_END)
+                offsets.tofile(f)
+                f.seek(0)
+                f.write(INDEX_HEADER.pack(*after))
+        except OSError:
+            self._remove_index()
+
     def reset(self, text = ""):
         if os.path.isdir(self.parent_dir):
             try:
@@ -49,6 +291,7 @@ class Console:
 
                 if os.path.isfile(self.file):
                     os.unlink(self.file)
+                self._remove_index()
                 
                 with open(self.file, "w", encoding="utf-8") as f:
                     f.write(text)
@@ -51,6 +51,30 @@ class GCPFile:
     def exists(self):
         return bool(self.gcp_path and os.path.exists(self.gcp_path))
 
+    def resize_image_entries(self, filename, ratio):
+        """
+        Scales the pixel coordinates of the entries of a single image
+        :param filename name of the image
+        :param ratio resize ratio of the image
+        """
+        filename = filename.lower()
+        for i, entry in enumerate(self.iter_entries()):
+            if entry.filename.lower() == filename:
+                entry.px *= ratio
+                entry.py *= ratio
+                self.entries[i] = str(entry)
+
+    def write(self, gcp_file_output):
+        """
+        Writes the GCP entries to a file. If one already exists, it will be replaced.
+        :param gcp_file_output output path of the GCP file
+        :return path to the GCP file
+        """
+        with open(gcp_file_output, 'w') as f:
+            f.write('\n'.join([self.raw_srs] + [str(entry) for entry in self.iter_entries()]) + '\n')
+
+        return gcp_file_output
+
     def create_resized_copy(self, gcp_file_output, image_ratios):
         """
         Creates a new resized GCP file from an existing GCP file. If one already exists, it will be removed.
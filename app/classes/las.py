@@ -0,0 +1,156 @@
+import struct
+
+class LASHeaderError(Exception):
+    pass
+
+# GeoTIFF keys
+GEOKEY_DIRECTORY_RECORD = 34735
+OGC_MATH_TRANSFORM_WKT_RECORD = 2111
+OGC_COORDINATE_SYSTEM_WKT_RECORD = 2112
+PROJECTED_CS_TYPE_GEOKEY = 3072
+GEOGRAPHIC_TYPE_GEOKEY = 2048
+USER_DEFINED_GEOKEY = 32767
+
+class LASHeader:
+    """
+    Minimal LAS/LAZ header reader. It only reads the public header block,
+    the variable length records (VLRs) and the extended VLRs (LAS 1.4),
+    so it runs in constant time regardless of the number of points.
+    LAZ files share the same uncompressed header and VLRs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.point_format = None
+        self.point_record_length = None
+        self.point_data_offset = None
+        self.point_count = 0
+        self.scale = None
+        self.offset = None
+        self.bounds = None
+        self.compressed = False
+        self.wkt = None
+        self.geokeys = {}
+        self.has_projection_vlrs = False
+
+        with open(path, 'rb') as f:
+            self.read(f)
+
+    def read(self, f):
+        header = f.read(227)
+        if len(header) < 227 or header[0:4] != b'LASF':
+            raise LASHeaderError("%s is not a LAS/LAZ file" % self.path)
+
+        major, minor = struct.unpack_from('<BB', header, 24)
+        self.version = (major, minor)
+        header_size, point_data_offset, num_vlrs, point_format, record_length, legacy_point_count = struct.unpack_from('<HIIBHI', header, 94)
+
+        self.compressed = bool(point_format & 0x80)
+        self.point_format = point_format & 0x3F
+        self.point_record_length = record_length
+        self.point_data_offset = point_data_offset
+        self.point_count = legacy_point_count
+        self.scale = struct.unpack_from('<3d', header, 131)
+        self.offset = struct.unpack_from('<3d', header, 155)
+        maxx, minx, maxy, miny, maxz, minz = struct.unpack_from('<6d', header, 179)
+        self.bounds = [minx, miny, minz, maxx, maxy, maxz]
+
+        evlr_offset = 0
+        num_evlrs = 0
+        if (major, minor) >= (1, 4) and header_size >= 375:
+            f.seek(235)
+            ext = f.read(20)
+            if len(ext) < 20:
+                raise LASHeaderError("Truncated LAS 1.4 header")
+            evlr_offset, num_evlrs, point_count = struct.unpack('<QIQ', ext)
+            if point_count > 0:
+                self.point_count = point_count
+
+        # VLRs
+        f.seek(header_size)
+        for _ in range(num_vlrs):
+            vlr = f.read(54)
+            if len(vlr) < 54:
+                raise LASHeaderError("Truncated VLR")
+            user_id, record_id, length = struct.unpack_from('<16sHH', vlr, 2)
+            self.read_record(f, user_id, record_id, length)
+
+        # EVLRs
+        if evlr_offset > 0 and num_evlrs > 0:
+            f.seek(evlr_offset)
+            for _ in range(num_evlrs):
+                evlr = f.read(60)
+                if len(evlr) < 60:
+                    raise LASHeaderError("Truncated EVLR")
+                user_id, record_id, length = struct.unpack_from('<16sHQ', evlr, 2)
+                self.read_record(f, user_id, record_id, length)
+
+    def read_record(self, f, user_id, record_id, length):
+        user_id = user_id.rstrip(b'\x00').decode('ascii', errors='ignore')
+
+        if user_id == 'LASF_Projection' and record_id in [OGC_MATH_TRANSFORM_WKT_RECORD, OGC_COORDINATE_SYSTEM_WKT_RECORD, GEOKEY_DIRECTORY_RECORD]:
+            self.has_projection_vlrs = True
+            data = f.read(length)
+            if len(data) < length:
+                raise LASHeaderError("Truncated record")
+
+            if record_id == GEOKEY_DIRECTORY_RECORD:
+                self.geokeys = self.parse_geokeys(data)
+            elif record_id == OGC_COORDINATE_SYSTEM_WKT_RECORD or self.wkt is None:
+                wkt = data.rstrip(b'\x00').decode('utf-8', errors='ignore').strip()
+                if wkt != "":
+                    self.wkt = wkt
+        else:
+            f.seek(length, 1)
+
+    def parse_geokeys(self, data):
+        """
+        :return: dictionary of GeoKey IDs --> short values
+            (keys stored in other tags are ignored)
+        """
+        if len(data) < 8:
+            return {}
+        _, _, _, num_keys = struct.unpack_from('<4H', data, 0)
+        keys = {}
+        for i in range(num_keys):
+            off = 8 + i * 8
+            if off + 8 > len(data):
+                break
+            key_id, location, count, value = struct.unpack_from('<4H', data, off)
+            if location == 0:
+                keys[key_id] = value
+        return keys
+
+    def epsg(self):
+        """
+        :return: EPSG code from the GeoTIFF keys, or None
+        """
+        for key in [PROJECTED_CS_TYPE_GEOKEY, GEOGRAPHIC_TYPE_GEOKEY]:
+            code = self.geokeys.get(key)
+            if code is not None and code != USER_DEFINED_GEOKEY and code > 0:
+                return code
+        return None
+
+    def is_georeferenced(self):
+        """
+        :return: True if the header has a spatial reference, False if it does not
+            and None when it cannot be decided from the header alone
+        """
+        if self.wkt is not None or self.epsg() is not None:
+            return True
+        if not self.has_projection_vlrs:
+            return False
+        return None
+
+    def to_dict(self):
+        return {
+            'version': "%s.%s" % self.version,
+            'point_format': self.point_format,
+            'points': self.point_count,
+            'bounds': self.bounds,
+            'compressed': self.compressed,
+            'wkt': self.wkt,
+            'epsg': self.epsg(),
+            'georeferenced': self.is_georeferenced(),
+        }
@@ -0,0 +1,101 @@
+import time
+
+
+class ProgressTracker:
+    """
+    Keeps track of the progress of a long running job (0-100),
+    split into named stages, and reports throughput and ETA
+    information to a callback at most once every interval seconds.
+
+    The callback is invoked as callback(status, progress, **meta)
+    """
+
+    def __init__(self, callback=None, interval=1):
+        self.callback = callback
+        self.interval = interval
+        self.started = time.time()
+        self.last_update = 0
+        self.status = ""
+        self.progress = 0.0
+        self.stage = None
+        self.stage_started = None
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.windows = 0
+
+    def start_stage(self, name):
+        now = time.time()
+        self.end_stage(now)
+        self.stage = name
+        self.stage_started = now
+        self.stages.setdefault(name, 0.0)
+
+    def end_stage(self, now=None):
+        if self.stage is not None:
+            if now is None:
+                now = time.time()
+            self.stages[self.stage] += now - self.stage_started
+            self.stage = None
+            self.stage_started = None
+
+    def add(self, perc=0, bytes_read=0, bytes_written=0, windows=0):
+        self.progress = min(100.0, self.progress + perc)
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        self.windows += windows
+
+    def set(self, progress):
+        self.progress = max(0.0, min(100.0, progress))
+
+    def update(self, status, perc=0, force=False, **counters):
+        """
+        Add progress and counters (bytes_read, bytes_written, windows)
+        and notify the callback if enough time has elapsed
+        """
+        self.status = status
+        self.add(perc, **counters)
+        self.notify(force)
+
+    def notify(self, force=False):
+        t = time.time()
+        if force or t - self.last_update >= self.interval:
+            if self.callback is not None:
+                self.callback(self.status, self.progress, **self.meta(t))
+            self.last_update = t
+
+    def elapsed(self, now=None):
+        return (now if now is not None else time.time()) - self.started
+
+    def eta(self, now=None):
+        """
+        :return: estimated number of seconds remaining, or None if unknown
+        """
+        if self.progress <= 0:
+            return None
+        elapsed = self.elapsed(now)
+        return max(0.0, elapsed * (100.0 - self.progress) / self.progress)
+
+    def meta(self, now=None):
+        if now is None:
+            now = time.time()
+
+        elapsed = max(self.elapsed(now), 1e-6)
+        stages = dict(self.stages)
+        if self.stage is not None:
+            stages[self.stage] += now - self.stage_started
+
+        eta = self.eta(now)
+
+        return {
+            'stage': self.stage,
+            'stages': {k: round(v, 2) for k, v in stages.items()},
+            'elapsed': round(elapsed, 2),
+            'eta': round(eta, 2) if eta is not None else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'read_rate': round(self.bytes_read / elapsed, 2),
+            'write_rate': round(self.bytes_written / elapsed, 2),
+            'windows': self.windows,
+            'windows_per_sec': round(self.windows / elapsed, 2),
+        }
@@ -0,0 +1,356 @@
+import io
+import os
+import json
+import struct
+import logging
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('app.logger')
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+class RemoteZipError(Exception):
+    """
+    The archive cannot be extracted remotely (e.g. unsupported compression
+    method or encryption) and should be downloaded instead
+    """
+    pass
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object backed by range requests.
+    Used to let zipfile read the central directory of a remote archive.
+    """
+
+    def __init__(self, fetch, size):
+        self.fetch = fetch
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        self.pos = max(0, self.pos)
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size or len(b) == 0:
+            return 0
+        end = min(self.pos + len(b), self.size) - 1
+        data = b"".join(self.fetch(self.pos, end))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+def safe_arcname(filename):
+    """
+    :return: the relative path where an archive member should be extracted
+        (same sanitization as zipfile.ZipFile.extract), or "" if there's none
+    """
+    arcname = filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid = ('', os.path.curdir, os.path.pardir)
+    return os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid)
+
+
+class RemoteZipExtractor:
+    """
+    Extracts a zip archive that can be read with range requests into a directory,
+    without storing the archive on disk. The central directory is read first,
+    then the entries are downloaded, decompressed and written concurrently as their
+    bytes arrive. Each entry is checked against its CRC and an entry that fails
+    the check is downloaded again (only its byte range).
+
+    fetch(start, end) must return an iterable of bytes for the inclusive byte range [start, end]
+    progress_callback is invoked with the download progress percentage (0-100)
+
+    If a state_file is given, the entries that have been extracted are recorded in it,
+    so that an interrupted extraction of the same archive (identified by key and size)
+    continues where it left off. Partially downloaded stored entries are also continued.
+    """
+
+    def __init__(self, fetch, size, destination, max_workers=4, retries=3, progress_callback=None, retry_on=(), state_file=None, key=None):
+        self.fetch = fetch
+        self.size = size
+        self.destination = destination
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.progress_callback = progress_callback
+        self.retry_on = (zipfile.BadZipFile, zlib.error) + tuple(retry_on)
+        self.state_file = state_file
+        self.key = key
+
+        self.total_bytes = 0
+        self.downloaded_bytes = 0
+        self.lock = threading.Lock()
+
+    def read_entries(self):
+        """
+        Read the central directory of the archive
+        :return: list of (ZipInfo, start, end) tuples, where [start, end] is
+            the byte range of each entry (local header, data and data descriptor)
+        """
+        with zipfile.ZipFile(RangeReader(self.fetch, self.size)) as z:
+            infos = z.infolist()
+            start_dir = z.start_dir
+
+        for info in infos:
+            if info.flag_bits & 0x1:
+                raise RemoteZipError("%s is encrypted" % info.filename)
+            if info.compress_type not in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]:
+                raise RemoteZipError("%s uses an unsupported compression method" % info.filename)
+
+        offsets = sorted(set([i.header_offset for i in infos] + [start_dir]))
+        next_offset = {offsets[i]: offsets[i + 1] for i in range(len(offsets) - 1)}
+
+        return [(i, i.header_offset, next_offset[i.header_offset] - 1) for i in infos]
+
+    def extract(self):
+        entries = self.read_entries()
+        self.total_bytes = max(1, sum(end - start + 1 for _, start, end in entries))
+
+        os.makedirs(self.destination, exist_ok=True)
+
+        completed = self.load_state(entries)
+        if len(completed) > 0:
+            logger.info("Resuming extraction, %s of %s entries already extracted" % (len(completed), len(entries)))
+        self.write_state(entries, completed)
+
+        # Largest entries first, so that they don't end up being the last ones
+        entries.sort(key=lambda e: e[2] - e[1], reverse=True)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for info, start, end in entries:
+                if self.entry_key(info) in completed:
+                    self.add_progress(end - start + 1)
+                else:
+                    futures.append(executor.submit(self.extract_entry, info, start, end))
+
+            for future in futures:
+                future.result()
+
+        if self.state_file is not None and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+        if self.progress_callback is not None:
+            self.progress_callback(100.0)
+
+        return [e[0].filename for e in entries]
+
+    def entry_key(self, info):
+        return (info.filename, info.header_offset, info.compress_size, info.file_size, info.CRC)
+
+    def load_state(self, entries):
+        """
+        Read the entries that have been extracted by a previous (interrupted) extraction
+        of the same archive. The state file has a header line followed by one line per
+        extracted entry (appended as soon as an entry is extracted).
+        :return: set of entry keys that do not need to be extracted again
+        """
+        completed = set()
+        if self.state_file is None or not os.path.isfile(self.state_file):
+            return completed
+
+        with open(self.state_file, 'r') as f:
+            lines = f.read().split("\n")
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return completed
+        if header.get('key') != self.key or header.get('size') != self.size:
+            return completed
+
+        infos = {self.entry_key(e[0]): e[0] for e in entries}
+        for line in lines[1:]:
+            try:
+                entry_key = tuple(json.loads(line))
+            except ValueError:
+                # Truncated by an interruption
+                continue
+
+            info = infos.get(entry_key)
+            if info is not None:
+                target = os.path.join(self.destination, safe_arcname(info.filename))
+                if info.is_dir() or (os.path.isfile(target) and os.path.getsize(target) == info.file_size):
+                    completed.add(entry_key)
+
+        return completed
+
+    def write_state(self, entries, completed):
+        if self.state_file is None:
+            return
+
+        keys = [self.entry_key(e[0]) for e in entries]
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps({'key': self.key, 'size': self.size}) + "\n")
+            for entry_key in keys:
+                if entry_key in completed:
+                    f.write(json.dumps(entry_key) + "\n")
+        os.replace(tmp_file, self.state_file)
+
+    def mark_completed(self, info):
+        if self.state_file is None:
+            return
+
+        with self.lock:
+            with open(self.state_file, 'a') as f:
+                f.write(json.dumps(self.entry_key(info)) + "\n")
+
+    def extract_entry(self, info, start, end):
+        arcname = safe_arcname(info.filename)
+        if arcname == "":
+            return
+
+        target = os.path.join(self.destination, arcname)
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            self.add_progress(end - start + 1)
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        for attempt in range(self.retries + 1):
+            received = [0]
+            try:
+                self.extract_file(info, start, end, target, received)
+                self.mark_completed(info)
+                return
+            except self.retry_on as e:
+                self.add_progress(-received[0])
+                if attempt >= self.retries:
+                    if isinstance(e, zlib.error):
+                        raise zipfile.BadZipFile(str(e))
+                    raise
+                logger.warning("Cannot extract %s (%s), downloading it again" % (info.filename, str(e)))
+
+    def read_local_header(self, buf, info):
+        """
+        :return: offset of the entry's data from the start of its local header
+        """
+        header = LOCAL_HEADER.unpack_from(buf)
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile("Bad local header for %s" % info.filename)
+        return LOCAL_HEADER.size + header[9] + header[10]
+
+    def extract_file(self, info, start, end, target, received):
+        tmp_path = target + ".part"
+        decompressor = zlib.decompressobj(-15) if info.compress_type == zipfile.ZIP_DEFLATED else None
+        crc = 0
+        written = 0
+
+        # Stored entries can continue from a previous partial download
+        if decompressor is None and os.path.isfile(tmp_path) and os.path.getsize(tmp_path) <= info.file_size:
+            with open(tmp_path, 'rb') as f:
+                for data in iter(lambda: f.read(1024 * 1024), b""):
+                    crc = zlib.crc32(data, crc)
+                    written += len(data)
+        elif os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+        def next_chunk():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                received[0] += len(chunk)
+                self.add_progress(len(chunk))
+            return chunk
+
+        buf = b""
+        chunks = iter(())
+
+        try:
+            if written > 0:
+                data_start = self.read_local_header(b"".join(self.fetch(start, start + LOCAL_HEADER.size - 1)), info)
+                received[0] += data_start + written
+                self.add_progress(data_start + written)
+                chunks = iter(self.fetch(start + data_start + written, end))
+                data_start = 0
+            else:
+                chunks = iter(self.fetch(start, end))
+
+                # Local file header
+                while len(buf) < LOCAL_HEADER.size:
+                    chunk = next_chunk()
+                    if chunk is None:
+                        raise zipfile.BadZipFile("Truncated local header for %s" % info.filename)
+                    buf += chunk
+
+                data_start = self.read_local_header(buf, info)
+
+                while len(buf) < data_start:
+                    chunk = next_chunk()
+                    if chunk is None:
+                        raise zipfile.BadZipFile("Truncated local header for %s" % info.filename)
+                    buf += chunk
+
+            remaining = info.compress_size - written
+
+            with open(tmp_path, 'ab') as f:
+                chunk = buf[data_start:]
+                while remaining > 0:
+                    if len(chunk) > 0:
+                        # Anything past the compressed data is a data descriptor
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                        data = decompressor.decompress(chunk) if decompressor is not None else chunk
+                        crc = zlib.crc32(data, crc)
+                        written += f.write(data)
+
+                    if remaining > 0:
+                        chunk = next_chunk()
+                        if chunk is None:
+                            raise zipfile.BadZipFile("Truncated data for %s" % info.filename)
+
+                if decompressor is not None:
+                    data = decompressor.flush()
+                    crc = zlib.crc32(data, crc)
+                    written += f.write(data)
+
+            if written != info.file_size or crc != info.CRC:
+                raise zipfile.BadZipFile("Bad CRC-32 for %s" % info.filename)
+
+            os.replace(tmp_path, target)
+        except (zipfile.BadZipFile, zlib.error):
+            # Corrupted, start over
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except Exception:
+            # Interrupted, keep what has been downloaded so far
+            # only if it can be continued
+            if decompressor is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def add_progress(self, num_bytes):
+        with self.lock:
+            self.downloaded_bytes += num_bytes
+            if self.progress_callback is not None and num_bytes > 0:
+                self.progress_callback(min(100.0, 100.0 * self.downloaded_bytes / self.total_bytes))
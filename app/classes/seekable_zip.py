@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+import zipfile
+
+logger = logging.getLogger('app.logger')
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+DATA_DESCRIPTOR = struct.Struct('<4sIII')
+DATA_DESCRIPTOR64 = struct.Struct('<4sIQQ')
+CENTRAL_DIR_HEADER = struct.Struct('<4sBBBBHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<4sHHHHIIH')
+END_RECORD64 = struct.Struct('<4sQHHIIQQQQ')
+END_LOCATOR64 = struct.Struct('<4sIQI')
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+
+# Unix
+CREATE_SYSTEM = 3
+
+# Formats that are already compressed and are stored as-is in archives
+INCOMPRESSIBLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.tif', '.tiff',
+                             '.glb', '.b3dm', '.i3dm', '.pnts', '.cmpt', '.laz', '.zip',
+                             '.gz', '.tgz', '.bz2', '.xz', '.7z', '.mp4', '.kmz', '.pdf')
+
+
+def compress_type_for(filename):
+    """
+    :return: ZIP_STORED for files that are already compressed, ZIP_DEFLATED otherwise
+    """
+    if filename.lower().endswith(INCOMPRESSIBLE_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def write_archive(directory, archive_path, exclude=()):
+    """
+    Compress a directory into a zip file, choosing the compression method
+    of each file (see compress_type_for). The archive is written
+    to a temporary file first, so that it's never seen incomplete.
+    :param exclude: names of files to leave out
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), suffix=".zip.tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', allowZip64=True) as z:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    if name in exclude or os.path.abspath(path) == os.path.abspath(tmp_path):
+                        continue
+                    z.write(path, os.path.relpath(path, directory), compress_type=compress_type_for(name))
+        os.replace(tmp_path, archive_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((min(t.tm_year, 2107) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class Entry:
+    def __init__(self, arcname, size, mtime, path=None, data=None, mode=0o100644, key=None):
+        self.arcname = arcname.replace(os.path.sep, "/").lstrip("/")
+        try:
+            self.filename = self.arcname.encode('ascii')
+            self.flags = FLAG_DATA_DESCRIPTOR
+        except UnicodeEncodeError:
+            self.filename = self.arcname.encode('utf-8')
+            self.flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+
+        self.size = size
+        self.mtime = mtime
+        self.path = path
+        self.data = data
+        self.mode = mode
+        self.key = key
+        self.crc = zlib.crc32(data) & 0xFFFFFFFF if data is not None else None
+        self.zip64 = size > zipfile.ZIP64_LIMIT
+        self.header_offset = 0
+
+    def local_header(self):
+        dostime, dosdate = dos_datetime(self.mtime)
+        extra = b""
+        size = 0
+        if self.zip64:
+            # Sizes are in the data descriptor
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size = 0xFFFFFFFF
+        return LOCAL_HEADER.pack(b'PK\x03\x04', ZIP64_VERSION if self.zip64 else ZIP_VERSION,
+                                 self.flags, zipfile.ZIP_STORED, dostime, dosdate, 0, size, size,
+                                 len(self.filename), len(extra)) + self.filename + extra
+
+    def local_header_size(self):
+        return LOCAL_HEADER.size + len(self.filename) + (20 if self.zip64 else 0)
+
+    def data_descriptor(self):
+        if self.zip64:
+            return DATA_DESCRIPTOR64.pack(b'PK\x07\x08', self.crc, self.size, self.size)
+        return DATA_DESCRIPTOR.pack(b'PK\x07\x08', self.crc, self.size, self.size)
+
+    def data_descriptor_size(self):
+        return DATA_DESCRIPTOR64.size if self.zip64 else DATA_DESCRIPTOR.size
+
+    def central_dir_header(self):
+        dostime, dosdate = dos_datetime(self.mtime)
+        extra = []
+        size = self.size
+        header_offset = self.header_offset
+        if self.size > zipfile.ZIP64_LIMIT:
+            extra += [self.size, self.size]
+            size = 0xFFFFFFFF
+        if self.header_offset > zipfile.ZIP64_LIMIT:
+            extra.append(self.header_offset)
+            header_offset = 0xFFFFFFFF
+        extra_data = struct.pack('<HH' + 'Q' * len(extra), 1, 8 * len(extra), *extra) if extra else b""
+        version = ZIP64_VERSION if extra or self.zip64 else ZIP_VERSION
+
+        return CENTRAL_DIR_HEADER.pack(b'PK\x01\x02', version, CREATE_SYSTEM, version, 0,
+                                       self.flags, zipfile.ZIP_STORED, dostime, dosdate, self.crc,
+                                       size, size, len(self.filename), len(extra_data), 0, 0, 0,
+                                       (self.mode & 0xFFFF) << 16, header_offset) + self.filename + extra_data
+
+    def central_dir_header_size(self):
+        extra = (16 if self.size > zipfile.ZIP64_LIMIT else 0) + (8 if self.header_offset > zipfile.ZIP64_LIMIT else 0)
+        return CENTRAL_DIR_HEADER.size + len(self.filename) + (4 + extra if extra else 0)
+
+
+class SeekableZip:
+    """
+    Store-only zip archive generated on the fly from files on disk.
+    Since nothing is compressed, the offset of every entry (and the size of the archive)
+    is known before any file is read, so that any byte range of the archive can be
+    generated without reading the files that precede it. This allows Content-Length
+    and range requests (resumable downloads).
+
+    The CRC-32 of each file is written in a data descriptor after its data, computed
+    while the file is streamed. The CRCs are also needed for the central directory (at the end
+    of the archive): if a crc_cache file is given, the CRCs computed while streaming are
+    saved to it (by path, size and modification time), so that resuming an interrupted
+    download does not need to read the files that were already downloaded.
+    """
+
+    def __init__(self, crc_cache=None, comment=""):
+        self.crc_cache = crc_cache
+        self.comment = comment
+        self.entries = []
+        self.cache = None
+        self.cache_changed = False
+        self.layout = None
+
+    def add_path(self, path, arcname):
+        st = os.stat(path)
+        self.entries.append(Entry(arcname, st.st_size, st.st_mtime, path=path, mode=st.st_mode,
+                                  key=[st.st_size, st.st_mtime_ns]))
+        self.layout = None
+
+    def add(self, data, arcname, mtime=None):
+        """
+        Add an entry from memory
+        :param mtime: modification time of the entry (defaults to now). Pass a fixed value
+            to generate the same archive (and ETag) every time
+        """
+        self.entries.append(Entry(arcname, len(data), mtime if mtime is not None else time.time(), data=data))
+        self.layout = None
+
+    def is_empty(self):
+        return len(self.entries) == 0
+
+    def get_layout(self):
+        """
+        :return: list of (offset, length, kind, entry) segments of the archive
+        """
+        if self.layout is not None:
+            return self.layout
+
+        layout = []
+        offset = 0
+        for e in self.entries:
+            e.header_offset = offset
+            for kind, length in [('header', e.local_header_size()), ('data', e.size), ('descriptor', e.data_descriptor_size())]:
+                layout.append((offset, length, kind, e))
+                offset += length
+
+        self.central_dir_offset = offset
+        self.central_dir_size = sum(e.central_dir_header_size() for e in self.entries)
+        layout.append((offset, self.central_dir_size, 'central_dir', None))
+        offset += self.central_dir_size
+
+        self.zip64 = len(self.entries) >= zipfile.ZIP_FILECOUNT_LIMIT or \
+            self.central_dir_offset > zipfile.ZIP64_LIMIT or self.central_dir_size > zipfile.ZIP64_LIMIT
+        end_size = END_RECORD.size + len(self.comment.encode('utf-8')[0:0xFFFF])
+        if self.zip64:
+            end_size += END_RECORD64.size + END_LOCATOR64.size
+        layout.append((offset, end_size, 'end', None))
+
+        self.layout = layout
+        return layout
+
+    def __len__(self):
+        offset, length, _, _ = self.get_layout()[-1]
+        return offset + length
+
+    def __iter__(self):
+        return self.iter_range(0, len(self) - 1)
+
+    def etag(self):
+        """
+        :return: identifier of the content of the archive
+        """
+        h = hashlib.sha1()
+        for e in self.entries:
+            h.update(json.dumps([e.arcname, e.size, dos_datetime(e.mtime), e.key if e.key is not None else e.crc]).encode('utf-8'))
+        return '"%s"' % h.hexdigest()
+
+    def last_modified(self):
+        return max([e.mtime for e in self.entries] + [0])
+
+    def iter_range(self, start, end):
+        """
+        Generate the bytes of the archive in the inclusive range [start, end]
+        """
+        try:
+            for offset, length, kind, e in self.get_layout():
+                if offset + length <= start or length == 0:
+                    continue
+                if offset > end:
+                    break
+
+                skip = max(0, start - offset)
+                count = min(length, end - offset + 1) - skip
+
+                if kind == 'data':
+                    yield from self.read_data(e, skip, count)
+                else:
+                    if kind == 'header':
+                        buf = e.local_header()
+                    elif kind == 'descriptor':
+                        self.entry_crc(e)
+                        buf = e.data_descriptor()
+                    elif kind == 'central_dir':
+                        buf = self.central_dir()
+                    else:
+                        buf = self.end_record()
+                    yield buf[skip:skip + count]
+        finally:
+            self.save_cache()
+
+    def read_data(self, e, skip, count, chunk_size=1024 * 1024):
+        if e.data is not None:
+            yield e.data[skip:skip + count]
+            return
+
+        # CRC can be computed while reading if the entire file is read
+        crc = 0 if skip == 0 and e.crc is None else None
+
+        with open(e.path, 'rb') as f:
+            f.seek(skip)
+            remaining = count
+            while remaining > 0:
+                buf = f.read(min(chunk_size, remaining))
+                if not buf:
+                    raise IOError("%s changed while generating the archive" % e.path)
+                remaining -= len(buf)
+                if crc is not None:
+                    crc = zlib.crc32(buf, crc)
+                yield buf
+
+        if crc is not None and count == e.size:
+            self.set_crc(e, crc & 0xFFFFFFFF)
+
+    def entry_crc(self, e):
+        """
+        :return: CRC-32 of an entry, from the cache or computed by reading the file
+        """
+        if e.crc is None:
+            cached = self.get_cache().get(e.path)
+            if cached is not None and cached[0:2] == e.key:
+                e.crc = cached[2]
+            else:
+                crc = 0
+                with open(e.path, 'rb') as f:
+                    for buf in iter(lambda: f.read(1024 * 1024), b""):
+                        crc = zlib.crc32(buf, crc)
+                self.set_crc(e, crc & 0xFFFFFFFF)
+        return e.crc
+
+    def set_crc(self, e, crc):
+        e.crc = crc
+        if self.crc_cache is not None:
+            self.get_cache()[e.path] = e.key + [crc]
+            self.cache_changed = True
+
+    def get_cache(self):
+        if self.cache is None:
+            self.cache = {}
+            if self.crc_cache is not None:
+                try:
+                    with open(self.crc_cache, 'r') as f:
+                        self.cache = json.loads(f.read())
+                except (FileNotFoundError, ValueError):
+                    pass
+        return self.cache
+
+    def save_cache(self):
+        if not self.cache_changed:
+            return
+        self.cache_changed = False
+
+        # Keep only the entries of files that still exist
+        cache = {p: v for p, v in self.get_cache().items() if os.path.exists(p)}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.crc_cache))
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(cache))
+            os.replace(tmp_path, self.crc_cache)
+        except OSError as e:
+            logger.warning("Cannot write zip CRC cache: %s" % str(e))
+
+    def central_dir(self):
+        for e in self.entries:
+            self.entry_crc(e)
+        return b"".join(e.central_dir_header() for e in self.entries)
+
+    def end_record(self):
+        count = len(self.entries)
+        size = self.central_dir_size
+        offset = self.central_dir_offset
+        comment = self.comment.encode('utf-8')[0:0xFFFF]
+        buf = b""
+        if self.zip64:
+            buf += END_RECORD64.pack(b'PK\x06\x06', END_RECORD64.size - 12, ZIP64_VERSION, ZIP64_VERSION,
+                                     0, 0, count, count, size, offset)
+            buf += END_LOCATOR64.pack(b'PK\x06\x07', 0, offset + size, 1)
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            offset = min(offset, 0xFFFFFFFF)
+        buf += END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, size, offset, len(comment)) + comment
+        return buf
@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger('app.logger')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), retries=0, required=True):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.retries = retries
+        self.required = required
+        self.status = PENDING
+        self.attempts = 0
+        self.duration = None
+        self.error = None
+
+    def to_dict(self):
+        d = {
+            'status': self.status,
+            'attempts': self.attempts,
+            'duration': round(self.duration, 3) if self.duration is not None else None,
+        }
+        if self.error is not None:
+            d['error'] = self.error
+        return d
+
+
+class StageRunner:
+    """
+    Runs a set of stages (functions) concurrently, as soon as the stages
+    they depend on have completed. A stage that raises an exception is retried
+    up to its number of retries, after which the stages that depend on it are skipped.
+    Failures of required stages are raised (after all other stages have run),
+    failures of optional stages are only logged.
+
+    on_change(runner) is invoked every time stages start or end
+    (always from the thread that called run)
+    """
+
+    def __init__(self, max_workers=4, on_change=None):
+        self.max_workers = max(1, max_workers)
+        self.on_change = on_change
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=(), retries=0, required=True):
+        if name in self.stages:
+            raise ValueError("Stage %s already exists" % name)
+        for d in deps:
+            if d not in self.stages:
+                raise ValueError("Stage %s depends on unknown stage %s" % (name, d))
+        self.stages[name] = Stage(name, func, deps, retries, required)
+        return name
+
+    def progress(self):
+        """
+        :return: fraction (0..1) of stages that have ended
+        """
+        if len(self.stages) == 0:
+            return 1.0
+        ended = [s for s in self.stages.values() if s.status in [DONE, FAILED, SKIPPED]]
+        return len(ended) / len(self.stages)
+
+    def to_dict(self):
+        with self.lock:
+            return {name: s.to_dict() for name, s in self.stages.items()}
+
+    def is_done(self, *names):
+        """
+        :return: True if all the named stages have completed successfully
+        """
+        return all(self.stages[n].status == DONE for n in names)
+
+    def notify(self):
+        if self.on_change is not None:
+            try:
+                self.on_change(self)
+            except Exception as e:
+                logger.warning("Cannot report stage progress: %s" % str(e))
+
+    def run_stage(self, stage):
+        start = time.time()
+        while True:
+            stage.attempts += 1
+            try:
+                stage.func()
+                stage.error = None
+                status = DONE
+                break
+            except Exception as e:
+                stage.error = str(e)
+                if stage.attempts > stage.retries:
+                    status = FAILED
+                    logger.warning("Stage %s failed: %s" % (stage.name, str(e)))
+                    error = e
+                    break
+                logger.warning("Stage %s failed (%s), retrying" % (stage.name, str(e)))
+
+        with self.lock:
+            stage.duration = time.time() - start
+            stage.status = status
+
+        if status == FAILED:
+            raise error
+
+    def run(self):
+        """
+        Run all stages
+        :return: dictionary with the status, number of attempts and duration of each stage
+        """
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+
+            while True:
+                # Skip stages whose dependencies did not complete
+                for s in self.stages.values():
+                    if s.status == PENDING and any(self.stages[d].status in [FAILED, SKIPPED] for d in s.deps):
+                        s.status = SKIPPED
+
+                for s in self.stages.values():
+                    if s.status == PENDING and all(self.stages[d].status == DONE for d in s.deps):
+                        s.status = RUNNING
+                        running[executor.submit(self.run_stage, s)] = s
+
+                if len(running) == 0:
+                    break
+
+                self.notify()
+                completed, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in completed:
+                    s = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        if s.required:
+                            errors.append(e)
+
+        self.notify()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        return self.to_dict()
@@ -0,0 +1,128 @@
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger('app.logger')
+
+
+class UploadPipeline:
+    """
+    Uploads files while they are being produced (e.g. resized).
+    Files are handed over with put() to a bounded queue, consumed
+    by a pool of upload threads. put() blocks while the queue is full.
+
+    upload(path) is invoked for each file and is retried up to max_retries
+    times if it raises one of the retry_on exceptions. Any other error stops the pipeline
+    and is raised by the next call to put() or finish().
+    """
+
+    def __init__(self, upload, parallel_uploads=4, queue_size=16, max_retries=5, retry_timeout=5, retry_on=()):
+        self.upload = upload
+        self.parallel_uploads = max(1, parallel_uploads)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.max_retries = max_retries
+        self.retry_timeout = retry_timeout
+        self.retry_on = tuple(retry_on)
+
+        self.uploaded = 0
+        self.submitted = 0
+        self.error = None
+        self.aborted = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for _ in range(self.parallel_uploads):
+            t = threading.Thread(target=self.worker, daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def worker(self):
+        while True:
+            path = self.queue.get()
+            try:
+                if path is None:
+                    break
+                if not self.aborted.is_set():
+                    self.upload_file(path)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                self.aborted.set()
+            finally:
+                self.queue.task_done()
+
+    def upload_file(self, path):
+        retries = 0
+        while True:
+            try:
+                self.upload(path)
+                with self.lock:
+                    self.uploaded += 1
+                return
+            except self.retry_on as e:
+                if retries >= self.max_retries or self.aborted.is_set():
+                    raise
+                retries += 1
+                logger.warning("Cannot upload %s (%s), retrying" % (path, str(e)))
+                if self.aborted.wait(retries * self.retry_timeout):
+                    raise
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, path):
+        """
+        Queue a file for upload (blocks while the queue is full)
+        """
+        while True:
+            self.check()
+            try:
+                self.queue.put(path, timeout=0.5)
+                self.submitted += 1
+                return
+            except queue.Full:
+                pass
+
+    def progress(self):
+        """
+        :return: fraction (0..1) of the queued files that have been uploaded
+        """
+        return self.uploaded / self.submitted if self.submitted > 0 else 0.0
+
+    def finish(self, callback=None, interval=2):
+        """
+        Wait for all queued files to be uploaded and stop the upload threads
+        :param callback: optional function invoked every interval seconds while waiting
+            (it can raise an exception to abort the uploads)
+        """
+        last_callback = time.time()
+        try:
+            while self.uploaded < self.submitted:
+                self.check()
+                if callback is not None and time.time() - last_callback >= interval:
+                    callback()
+                    last_callback = time.time()
+                self.aborted.wait(0.1)
+            self.check()
+        except Exception:
+            self.abort()
+            raise
+
+        self.stop()
+
+    def abort(self):
+        # Queued files are skipped
+        self.aborted.set()
+        self.stop()
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
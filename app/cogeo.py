@@ -5,21 +5,24 @@ import shutil
 import rasterio
 import re
 import subprocess
+from functools import lru_cache
 from pipes import quote
 from rio_tiler.utils import has_alpha_band
 from webodm import settings
 
 logger = logging.getLogger('app.logger')
 
-def valid_cogeo(src_path):
+def valid_cogeo(src_path, full_check=False):
     """
     Validate a Cloud Optimized GeoTIFF
     :param src_path: path to GeoTIFF
+    :param full_check: also check the leader/trailer bytes of every tile
+        (reads the whole file). By default only the IFD layout is checked.
     :return: true if the GeoTIFF is a cogeo, false otherwise
     """
     try:
         from app.vendor.validate_cloud_optimized_geotiff import validate
-        warnings, errors, details = validate(src_path, full_check=True)
+        warnings, errors, details = validate(src_path, full_check=full_check)
         return not errors and not warnings
     except ModuleNotFoundError:
         logger.warning("Using legacy cog_validate (osgeo.gdal package not found)")
@@ -32,12 +35,13 @@ def valid_cogeo(src_path):
         return cog_validate(src_path, strict=True)
 
 
-def assure_cogeo(src_path):
+def assure_cogeo(src_path, threads=None):
     """
     Guarantee that the .tif passed as an argument is a Cloud Optimized GeoTIFF (cogeo)
     If the path is not a cogeo, it is destructively converted into a cogeo.
     If the file cannot be converted, the function does not change the file
     :param src_path: path to GeoTIFF (cogeo or not)
+    :param threads: number of threads to use for the conversion (defaults to all CPUs)
     :return: None
     """
 
@@ -70,10 +74,11 @@ def assure_cogeo(src_path):
         
     if use_legacy:
         logger.warning("Using legacy implementation (GDAL >= 3.1 not found)")
-        return make_cogeo_legacy(src_path)
+        return make_cogeo_legacy(src_path, threads)
     else:
-        return make_cogeo_gdal(src_path)
+        return make_cogeo_gdal(src_path, threads)
 
+@lru_cache(maxsize=None)
 def get_gdal_version():
     # Bit of a hack without installing 
     # python bindings
@@ -91,11 +96,12 @@ def get_gdal_version():
     return tuple(map(int, m.groups()))
 
 
-def make_cogeo_gdal(src_path):
+def make_cogeo_gdal(src_path, threads=None):
     """
     Make src_path a Cloud Optimized GeoTIFF.
     Requires GDAL >= 3.1
     """
+    num_threads = str(threads) if threads else "ALL_CPUS"
 
     tmpfile = tempfile.mktemp('_cogeo.tif', dir=settings.MEDIA_TMP)
     swapfile = tempfile.mktemp('_cogeo_swap.tif', dir=settings.MEDIA_TMP)
@@ -104,10 +110,10 @@ def make_cogeo_gdal(src_path):
         subprocess.run(["gdal_translate", "-of", "COG",
                         "-co", "BLOCKSIZE=256",
                         "-co", "COMPRESS=deflate",
-                        "-co", "NUM_THREADS=ALL_CPUS",
+                        "-co", "NUM_THREADS=%s" % num_threads,
                         "-co", "BIGTIFF=IF_SAFER",
                         "-co", "RESAMPLING=NEAREST",
-                        "--config", "GDAL_NUM_THREADS", "ALL_CPUS",
+                        "--config", "GDAL_NUM_THREADS", num_threads,
                         quote(src_path), quote(tmpfile)])
     except Exception as e:
         logger.warning("Cannot create Cloud Optimized GeoTIFF: %s" % str(e))
@@ -129,7 +135,7 @@ def make_cogeo_gdal(src_path):
     else:
         return False
 
-def make_cogeo_legacy(src_path):
+def make_cogeo_legacy(src_path, threads=None):
     """
     Make src_path a Cloud Optimized GeoTIFF
     This implementation does not require GDAL >= 3.1
@@ -156,7 +162,7 @@ def make_cogeo_legacy(src_path):
 
         # Dataset Open option (see gdalwarp `-oo` option)
         config = dict(
-            GDAL_NUM_THREADS="ALL_CPUS",
+            GDAL_NUM_THREADS=str(threads) if threads else "ALL_CPUS",
             GDAL_TIFF_INTERNAL_MASK=True,
             GDAL_TIFF_OVR_BLOCKSIZE="128",
         )
@@ -0,0 +1,33 @@
+import os
+import multiprocessing
+
+def get_available_cores():
+    """
+    :return: number of CPU cores available to this process
+    """
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+def get_threads_per_job(jobs, budget=None, max_threads=None):
+    """
+    Split a budget of CPU cores between a number of concurrent jobs
+    :param jobs: number of jobs running concurrently
+    :param budget: number of cores to share (defaults to all available cores)
+    :param max_threads: optional upper bound for the number of threads of a single job
+    :return: number of threads that each job should use (at least 1)
+    """
+    if budget is None:
+        budget = get_available_cores()
+    threads = max(1, budget // max(1, jobs))
+    if max_threads is not None:
+        threads = min(threads, max(1, max_threads))
+    return threads
+
+def can_spawn_processes():
+    """
+    :return: True if this process can start child processes
+        (daemon processes are not allowed to)
+    """
+    return not multiprocessing.current_process().daemon
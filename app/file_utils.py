@@ -0,0 +1,133 @@
+import os
+import fcntl
+import shutil
+import logging
+
+logger = logging.getLogger('app.logger')
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+COPY = 'copy'
+LINK = 'link'
+
+
+def reflink(src, dst):
+    """
+    Create dst as a copy-on-write clone of src (btrfs, XFS, etc.)
+    :raise OSError: if the filesystem does not support it
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def copy_range(src, dst, chunk_size=64 * 1024 * 1024):
+    """
+    Copy src to dst within the kernel with copy_file_range
+    (which can also share extents on some filesystems)
+    :raise OSError: if not supported
+    """
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError("copy_file_range is not available")
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(remaining, chunk_size))
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def clone_file(src, dst, methods=None):
+    """
+    Copy a file with the cheapest method available
+    (reflink, then copy_file_range, then a regular copy)
+    :param methods: list of methods to try, updated in place by
+        removing the ones that turn out not to be supported,
+        so that they are not attempted for the next files
+    :return: method that was used
+    """
+    if methods is None:
+        methods = [REFLINK, COPY_FILE_RANGE]
+
+    for method in list(methods):
+        try:
+            if method == REFLINK:
+                reflink(src, dst)
+            elif method == COPY_FILE_RANGE:
+                copy_range(src, dst)
+            else:
+                continue
+            shutil.copystat(src, dst)
+            return method
+        except OSError as e:
+            logger.debug("Cannot %s %s: %s" % (method, src, str(e)))
+            if method in methods:
+                methods.remove(method)
+
+    shutil.copy2(src, dst)
+    return COPY
+
+
+def clone_tree(src, dst, link=None, progress_callback=None):
+    """
+    Copy a directory tree, cloning files with clone_file. Unlike hard links,
+    clones can be modified in place without affecting the original files.
+    :param link: optional set of paths (relative to src) of files that are never
+        modified in place and can be hard linked instead
+    :param progress_callback: optional function invoked with the fraction (0..1) of bytes copied
+    :return: dictionary of method --> number of files copied with it
+    """
+    link = link or set()
+    files = []
+    total_bytes = 0
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel_dir = os.path.relpath(dirpath, src)
+        os.makedirs(os.path.join(dst, rel_dir), exist_ok=True)
+
+        # os.walk does not follow symlinks to directories
+        for d in dirnames:
+            if os.path.islink(os.path.join(dirpath, d)):
+                filenames.append(d)
+
+        for f in filenames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, f))
+            src_path = os.path.join(src, rel_path)
+            size = os.lstat(src_path).st_size
+            files.append((rel_path, size))
+            total_bytes += size
+
+    methods = [REFLINK, COPY_FILE_RANGE]
+    stats = {}
+    copied_bytes = 0
+
+    for rel_path, size in files:
+        src_path = os.path.join(src, rel_path)
+        dst_path = os.path.join(dst, rel_path)
+        if os.path.lexists(dst_path):
+            os.unlink(dst_path)
+
+        method = None
+        if os.path.islink(src_path):
+            os.symlink(os.readlink(src_path), dst_path)
+            method = LINK
+        elif rel_path in link:
+            try:
+                os.link(src_path, dst_path)
+                method = LINK
+            except OSError:
+                pass
+
+        if method is None:
+            method = clone_file(src_path, dst_path, methods)
+
+        stats[method] = stats.get(method, 0) + 1
+        copied_bytes += size
+        if progress_callback is not None:
+            progress_callback(copied_bytes / total_bytes if total_bytes > 0 else 1.0)
+
+    return stats
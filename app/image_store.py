@@ -0,0 +1,179 @@
+"""
+Content-addressed store for task images.
+Each image is stored once as a blob named after the SHA-256 of its content
+and task directories hard link to the blobs. The number of tasks referencing
+a blob is the link count of the blob (minus the link from the store itself), so
+removing the last task file that references a blob makes it eligible for removal.
+Each task keeps a manifest (filename --> digest) of the images it links from the store.
+"""
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import tempfile
+from webodm import settings
+
+logger = logging.getLogger('app.logger')
+
+MANIFEST_FILE = "image_store.json"
+
+# Only images are stored (other files, such as GCP files, can be modified in place)
+IMAGE_REGEX = r'.*\.(jpe?g|tiff?|png|dng)$'
+
+
+def get_store_dir(store_dir=None):
+    return store_dir if store_dir is not None else settings.IMAGE_STORE_DIR
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def blob_path(digest, store_dir=None):
+    return os.path.join(get_store_dir(store_dir), digest[0:2], digest[2:4], digest)
+
+
+def add_file(path, store_dir=None):
+    """
+    Move a file into the store (or replace it with a link to an identical blob
+    that is already stored)
+    :param path: path to a file in a task directory
+    :return: digest of the file, or None if the file could not be linked to the store
+    """
+    digest = file_digest(path)
+    blob = blob_path(digest, store_dir)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+    for _ in range(2):
+        try:
+            if os.path.isfile(blob):
+                # Replace the file with a link to the existing blob
+                tmp_path = path + ".link"
+                if os.path.lexists(tmp_path):
+                    os.unlink(tmp_path)
+                os.link(blob, tmp_path)
+                os.replace(tmp_path, path)
+            else:
+                os.link(path, blob)
+            return digest
+        except FileNotFoundError:
+            # Blob released while we were linking it, try again
+            continue
+        except FileExistsError:
+            # Same file being added concurrently
+            continue
+        except OSError as e:
+            logger.warning("Cannot add %s to the image store: %s" % (path, str(e)))
+            return None
+
+    return None
+
+
+def is_linked(path, digest, store_dir=None):
+    """
+    :return: True if path is (still) a link to the blob with digest
+    """
+    try:
+        return os.path.samefile(path, blob_path(digest, store_dir))
+    except OSError:
+        return False
+
+
+def release(digests, store_dir=None):
+    """
+    Remove the blobs that are no longer referenced by any task
+    :param digests: digests of blobs that might be unreferenced
+    :return: number of blobs removed
+    """
+    removed = 0
+    for digest in set(digests):
+        blob = blob_path(digest, store_dir)
+        try:
+            if os.stat(blob).st_nlink <= 1:
+                os.unlink(blob)
+                removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Cannot release %s: %s" % (blob, str(e)))
+    return removed
+
+
+def collect_garbage(store_dir=None):
+    """
+    Remove all unreferenced blobs from the store
+    :return: number of blobs removed
+    """
+    store_dir = get_store_dir(store_dir)
+    if not os.path.isdir(store_dir):
+        return 0
+
+    digests = []
+    for dirpath, _, filenames in os.walk(store_dir):
+        digests += [f for f in filenames if len(f) == 64]
+    return release(digests, store_dir)
+
+
+def shared_size(path, digest, store_dir=None):
+    """
+    :return: size of a stored file divided by the number of
+        task files that reference the same blob
+    """
+    st = os.stat(path)
+    if is_linked(path, digest, store_dir):
+        return st.st_size / max(1, st.st_nlink - 1)
+    return st.st_size
+
+
+def manifest_path(directory):
+    return os.path.join(directory, "data", MANIFEST_FILE)
+
+
+def read_manifest(directory):
+    """
+    :param directory: task directory
+    :return: dictionary of filename --> digest
+    """
+    try:
+        with open(manifest_path(directory), 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def update_manifest(directory, entries=None, remove=None):
+    """
+    Atomically add and/or remove entries from a task's manifest
+    :param entries: dictionary of filename --> digest to add
+    :param remove: list of filenames to remove (or True to remove all)
+    :return: updated manifest
+    """
+    path = manifest_path(directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Lock the data directory while updating
+    lock = os.open(os.path.dirname(path), os.O_RDONLY)
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        manifest = read_manifest(directory)
+        if remove is True:
+            manifest = {}
+        elif remove:
+            for name in remove:
+                manifest.pop(name, None)
+        if entries:
+            manifest.update(entries)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(manifest))
+        os.replace(tmp_path, path)
+        return manifest
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        os.close(lock)
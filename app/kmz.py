@@ -0,0 +1,259 @@
+import io
+import math
+import logging
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from PIL import Image
+from webodm import settings
+
+logger = logging.getLogger('app.logger')
+
+TILE_SIZE = 256
+
+def _region_xml(north, south, east, west, min_lod=128, max_lod=-1):
+    return """<Region>
+      <LatLonAltBox>
+        <north>{}</north>
+        <south>{}</south>
+        <east>{}</east>
+        <west>{}</west>
+      </LatLonAltBox>
+      <Lod>
+        <minLodPixels>{}</minLodPixels>
+        <maxLodPixels>{}</maxLodPixels>
+      </Lod>
+    </Region>""".format(north, south, east, west, min_lod, max_lod)
+
+
+def _kml_document(name, body):
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>{}</name>
+    {}
+  </Document>
+</kml>
+""".format(escape(name), body)
+
+
+def _network_link(name, href, bounds, min_lod=128):
+    north, south, east, west = bounds
+    return """<NetworkLink>
+      <name>{}</name>
+      {}
+      <Link>
+        <href>{}</href>
+        <viewRefreshMode>onRegion</viewRefreshMode>
+      </Link>
+    </NetworkLink>""".format(escape(name), _region_xml(north, south, east, west, min_lod), href)
+
+
+def encode_tile(arr, jpeg_quality=90):
+    """
+    Encode a RGBA tile as JPEG (fully opaque) or PNG (has transparency)
+    :param arr: (4, height, width) uint8 array
+    :return: (bytes, extension) or (None, None) if the tile is empty
+    """
+    alpha = arr[3]
+    if not alpha.any():
+        return None, None
+
+    img = Image.fromarray(np.ascontiguousarray(np.moveaxis(arr, 0, -1)), 'RGBA')
+    buf = io.BytesIO()
+    if alpha.min() == 255:
+        img.convert('RGB').save(buf, format='JPEG', quality=jpeg_quality)
+        ext = 'jpg'
+    else:
+        img.save(buf, format='PNG')
+        ext = 'png'
+
+    return buf.getvalue(), ext
+
+
+def downsample_tile(arr):
+    """
+    Halve the resolution of a RGBA tile using an alpha weighted 2x2 box filter
+    :param arr: (4, height, width) uint8 array
+    :return: (4, ceil(height/2), ceil(width/2)) uint8 array
+    """
+    _, h, w = arr.shape
+    ph, pw = h + h % 2, w + w % 2
+    if ph != h or pw != w:
+        padded = np.zeros((4, ph, pw), dtype=np.uint8)
+        padded[:, :h, :w] = arr
+        arr = padded
+
+    blocks = arr.reshape(4, ph // 2, 2, pw // 2, 2).astype(np.float32)
+    alpha = blocks[3]
+    alpha_sum = alpha.sum(axis=(1, 3))
+    out = np.zeros((4, ph // 2, pw // 2), dtype=np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for b in range(3):
+            out[b] = (blocks[b] * alpha).sum(axis=(1, 3)) / alpha_sum
+    out[3] = alpha_sum / 4.0
+    out[np.isnan(out)] = 0
+
+    return np.clip(np.round(out), 0, 255).astype(np.uint8)
+
+
+def write_kmz(input, output, name="raster", resampling="nearest", progress_callback=None, max_workers=None):
+    """
+    Write a KML super-overlay (KMZ) directly from a RGB(A) raster.
+    Tiles of the highest zoom level are read from the raster (warped to EPSG:4326),
+    lower zoom levels are built by downsampling the previously computed level.
+    Tiles are encoded in parallel and streamed into the archive as they complete.
+    :param input: path to a 8bit RGB or RGBA raster
+    :param output: path to the .kmz file to write
+    :param name: name of the overlay
+    :param resampling: resampling method used to warp the raster to EPSG:4326
+    :param progress_callback: optional function (done_tiles, total_tiles)
+    :param max_workers: number of threads used to encode tiles
+    """
+    if max_workers is None:
+        max_workers = settings.WORKERS_MAX_THREADS
+    max_workers = max(1, max_workers)
+
+    with rasterio.open(input) as src, \
+         WarpedVRT(src, crs=CRS.from_epsg(4326), resampling=Resampling[resampling]) as vrt, \
+         zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as kmz:
+
+        width, height = vrt.width, vrt.height
+        transform = vrt.transform
+        max_zoom = max(0, int(math.ceil(math.log2(max(width, height) / TILE_SIZE))))
+
+        if src.count >= 4:
+            indexes = (1, 2, 3, 4)
+        elif src.count == 3:
+            indexes = (1, 2, 3)
+        else:
+            indexes = (1, 1, 1)
+
+        base_tiles_x = int(math.ceil(width / TILE_SIZE))
+        base_tiles_y = int(math.ceil(height / TILE_SIZE))
+        total_base_tiles = base_tiles_x * base_tiles_y
+        done_base_tiles = 0
+
+        def tile_region(z, x, y):
+            span = TILE_SIZE * (2 ** (max_zoom - z))
+            col, row = x * span, y * span
+            return col, row, min(span, width - col), min(span, height - row)
+
+        def tile_exists(z, x, y):
+            col, row, _, _ = tile_region(z, x, y)
+            return col < width and row < height
+
+        def tile_bounds(z, x, y):
+            col, row, w, h = tile_region(z, x, y)
+            west, north = transform * (col, row)
+            east, south = transform * (col + w, row + h)
+            return north, south, east, west
+
+        def read_base_tile(x, y):
+            col, row, w, h = tile_region(max_zoom, x, y)
+            data = vrt.read(indexes=indexes, window=Window(col, row, w, h))
+            if data.dtype != np.uint8:
+                data = np.clip(data, 0, 255).astype(np.uint8)
+
+            if data.shape[0] == 3:
+                # No alpha band, treat nodata (black) areas outside of the raster as transparent
+                mask = vrt.read_masks(1, window=Window(col, row, w, h))
+                data = np.concatenate([data, mask[np.newaxis, :, :]])
+            return data
+
+        def make_tile_kml(z, x, y, ext, children):
+            north, south, east, west = tile_bounds(z, x, y)
+            body = [_region_xml(north, south, east, west)]
+
+            # Tiles that are transparent at this zoom level only link to their children
+            if ext is not None:
+                body.append("""<GroundOverlay>
+      <drawOrder>{}</drawOrder>
+      <Icon>
+        <href>{}.{}</href>
+      </Icon>
+      <LatLonBox>
+        <north>{}</north>
+        <south>{}</south>
+        <east>{}</east>
+        <west>{}</west>
+      </LatLonBox>
+    </GroundOverlay>""".format(z, y, ext, north, south, east, west))
+
+            for cz, cx, cy in children:
+                body.append(_network_link("{}/{}/{}.kml".format(cz, cx, cy),
+                                          "../../{}/{}/{}.kml".format(cz, cx, cy),
+                                          tile_bounds(cz, cx, cy)))
+
+            return _kml_document("{}/{}/{}.kml".format(z, x, y), "\n    ".join(body))
+
+        def encode_job(z, x, y, arr, children):
+            img, ext = encode_tile(arr)
+            return z, x, y, img, ext, make_tile_kml(z, x, y, ext, children)
+
+        # Google Earth expects doc.kml to be the first entry
+        kmz.writestr("doc.kml", _kml_document(name, _network_link(name, "0/0/0.kml", tile_bounds(0, 0, 0), min_lod=0)))
+
+        pending = deque()
+
+        def write_completed(limit=None):
+            while pending and (pending[0].done() or (limit is not None and len(pending) > limit)):
+                z, x, y, img, ext, kml = pending.popleft().result()
+                if img is not None:
+                    kmz.writestr("{}/{}/{}.{}".format(z, x, y, ext), img, compress_type=zipfile.ZIP_STORED)
+                kmz.writestr("{}/{}/{}.kml".format(z, x, y), kml)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            def build(z, x, y):
+                nonlocal done_base_tiles
+
+                if z == max_zoom:
+                    arr = read_base_tile(x, y)
+                    children = []
+
+                    done_base_tiles += 1
+                    if progress_callback is not None:
+                        progress_callback(done_base_tiles, total_base_tiles)
+                else:
+                    _, _, w, h = tile_region(z, x, y)
+                    scale = 2 ** (max_zoom - z)
+                    canvas = np.zeros((4, TILE_SIZE * 2, TILE_SIZE * 2), dtype=np.uint8)
+                    children = []
+
+                    for j in (0, 1):
+                        for i in (0, 1):
+                            c = (z + 1, x * 2 + i, y * 2 + j)
+                            if not tile_exists(*c):
+                                continue
+                            child = build(*c)
+                            if child is None:
+                                continue
+                            children.append(c)
+                            _, ch, cw = child.shape
+                            canvas[:, j * TILE_SIZE:j * TILE_SIZE + ch, i * TILE_SIZE:i * TILE_SIZE + cw] = child
+
+                    arr = downsample_tile(canvas)[:, :int(math.ceil(h / scale)), :int(math.ceil(w / scale))]
+
+                # Parents are written whenever they have children, even if
+                # their downsampled alpha rounds to 0, so that links to them are valid
+                if not arr[3].any() and not children:
+                    return None
+
+                pending.append(executor.submit(encode_job, z, x, y, arr, children))
+
+                # Bound the number of tiles held in memory
+                write_completed(limit=max_workers * 4)
+                return arr
+
+            build(0, 0, 0)
+            write_completed(limit=0)
+
+    logger.info("Wrote KMZ super-overlay {} ({} zoom levels)".format(output, max_zoom + 1))
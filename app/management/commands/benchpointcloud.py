@@ -0,0 +1,41 @@
+import os
+import time
+import tempfile
+import shutil
+from django.core.management.base import BaseCommand
+from app.pointcloud_utils import export_pointcloud
+from webodm import settings
+
+class Command(BaseCommand):
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", type=str, help="Path to a LAS/LAZ point cloud")
+        parser.add_argument("--format", type=str, required=False, default="laz", choices=['laz', 'las', 'ply', 'csv'], help="Export format")
+        parser.add_argument("--epsg", type=int, required=False, default=None, help="Reproject to this EPSG code")
+        parser.add_argument("--resample", type=float, required=False, default=0, help="Resample radius")
+
+        super(Command, self).add_arguments(parser)
+
+    def handle(self, **options):
+        input = os.path.abspath(options.get('input'))
+        if not os.path.isfile(input):
+            print("%s does not exist" % input)
+            exit(1)
+
+        tmpdir = tempfile.mkdtemp('_bench', dir=settings.MEDIA_TMP)
+        opts = {
+            'format': options.get('format'),
+            'epsg': options.get('epsg'),
+            'resample': options.get('resample'),
+        }
+
+        try:
+            for streaming in [False, True]:
+                output = os.path.join(tmpdir, "%s.%s" % ("stream" if streaming else "translate", opts['format']))
+                start = time.time()
+                export_pointcloud(input, output, streaming=streaming, **opts)
+                elapsed = time.time() - start
+                print("%s: %.2fs (%s bytes)" % ("streaming pipeline" if streaming else "pdal translate", elapsed, os.path.getsize(output)))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
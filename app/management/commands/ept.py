@@ -1,6 +1,8 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.core.management.base import BaseCommand
 from app.models import Task
+from app.cpu_utils import get_available_cores, get_threads_per_job
 
 class Command(BaseCommand):
     requires_system_checks = []
@@ -8,7 +10,9 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--all", action="store_true", required=False, default=False, help="Confirm that you want to check all tasks")
         parser.add_argument("--user", required=False, default=None, help="Check tasks belonging to this username")
-        parser.add_argument("--threads", type=int, required=False, default=1, help="Number of threads to use for generating EPT data")
+        parser.add_argument("--cores", type=int, required=False, default=None, help="Total number of cores to use across all EPT builds (default: all available cores)")
+        parser.add_argument("--concurrency", type=int, required=False, default=None, help="Number of EPT builds to run at the same time (default: cores / threads)")
+        parser.add_argument("--threads", type=int, required=False, default=None, help="Number of threads to use for each EPT build (default: cores / concurrency)")
 
         super(Command, self).add_arguments(parser)
 
@@ -20,15 +24,34 @@ class Command(BaseCommand):
         else:
             print("Specify either --user <username> or --all")
             exit(1)
-        
+
         print("Checking %s tasks" % tasks.count())
 
+        tasks = [t for t in tasks if t.needs_ept()]
+        if len(tasks) == 0:
+            print("Built 0 EPT")
+            return
+
+        cores = max(1, options.get('cores') or get_available_cores())
+        concurrency = options.get('concurrency')
+        threads = options.get('threads')
+
+        if concurrency is None:
+            concurrency = max(1, cores // threads) if threads else min(cores, len(tasks))
+        concurrency = max(1, min(concurrency, len(tasks)))
+        if threads is None:
+            threads = get_threads_per_job(concurrency, budget=cores)
+
+        print("Building %s EPT (%s at a time, %s threads each)" % (len(tasks), concurrency, threads))
+
         count = 0
-        for t in tasks:
-            if t.check_ept(threads=options.get('threads')):
-                t.update_size(commit=True)
-                print(str(t))
-                count += 1
-        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(t.check_ept, threads=threads): t for t in tasks}
+            for future in as_completed(futures):
+                t = futures[future]
+                if future.result():
+                    t.update_ept_fields()
+                    print(str(t))
+                    count += 1
+
         print("Built %s EPT" % count)
-            
\ No newline at end of file
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.27 on 2026-10-19 09:12
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0047_task_wkt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='pointcloud_info',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, help_text='Point cloud header information (point count, bounds, spatial reference)', verbose_name='Point Cloud Info'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.27 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0048_task_pointcloud_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the status of this task should be checked next on the processing node', null=True, verbose_name='Next Check At'),
+        ),
+    ]
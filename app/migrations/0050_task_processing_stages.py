@@ -0,0 +1,19 @@
+# Generated by Django 2.2.27 on 2026-10-19 15:02
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0049_task_next_check_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='processing_stages',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, help_text='Status, number of attempts and duration (in seconds) of the stages run after the results have been downloaded', verbose_name='Processing Stages'),
+        ),
+    ]
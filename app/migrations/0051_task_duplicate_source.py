@@ -0,0 +1,24 @@
+# Generated by Django 2.2.27 on 2026-10-19 17:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0050_task_processing_stages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='duplicate_source',
+            field=models.ForeignKey(blank=True, help_text='Task whose files are being copied to this task (while duplicating)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Task', verbose_name='Duplicate Source'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='pending_action',
+            field=models.IntegerField(blank=True, choices=[(1, 'CANCEL'), (2, 'REMOVE'), (3, 'RESTART'), (4, 'RESIZE'), (5, 'IMPORT'), (6, 'COMPACT'), (7, 'DUPLICATE')], db_index=True, help_text='A requested action to be performed on the task. The selected action will be performed by the worker at the next iteration.', null=True, verbose_name='Pending Action'),
+        ),
+    ]
@@ -102,6 +102,7 @@ class Project(models.Model):
         }
 
     def duplicate(self, new_owner=None):
+        project = None
         try:
             with transaction.atomic():
                 project = Project.objects.get(pk=self.pk)
@@ -116,18 +117,17 @@ class Project(models.Model):
                 project.save()
                 project.refresh_from_db()
 
-                for task in self.task_set.all():
-                    new_task = task.duplicate(set_new_name=False)
-                    if not new_task:
-                        raise Exception("Failed to duplicate {}".format(new_task))
-                    
-                    # Move/Assign to new duplicate
-                    new_task.project = project
-                    new_task.save()
-                    
+            # Tasks are created right away and copied in the background
+            for task in self.task_set.all():
+                new_task = task.duplicate(set_new_name=False, project=project)
+                if not new_task:
+                    raise Exception("Failed to duplicate {}".format(task))
+
             return project
         except Exception as e:
             logger.warning("Cannot duplicate project: {}".format(str(e)))
+            if project is not None and project.pk is not None:
+                project.delete()
         
         return False
 
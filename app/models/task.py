@@ -5,15 +5,13 @@ import time
 import struct
 import zlib
 import tempfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid as uuid_module
-from zipstream.ng import ZipStream
 
 import json
 import redis
 from shlex import quote
-from concurrent.futures import ThreadPoolExecutor
-import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 import errno
 import re
@@ -30,6 +28,8 @@ from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.exceptions import ValidationError, SuspiciousFileOperation
 from django.db import models
 from django.db import transaction
+from django.db.models import signals, F
+from django.dispatch import receiver
 from django.db import connection
 from django.utils import timezone
 from urllib3.exceptions import ReadTimeoutError
@@ -38,13 +38,16 @@ from app import pending_actions
 from django.contrib.gis.db.models.fields import GeometryField
 
 from app.cogeo import assure_cogeo
-from app.pointcloud_utils import is_pointcloud_georeferenced
+from app import image_store
+from app import backup
+from app.cpu_utils import get_threads_per_job, get_available_cores, can_spawn_processes
+from app.pointcloud_utils import is_pointcloud_georeferenced, read_pointcloud_info, build_copc
 from app.testwatch import testWatch
 from app.security import path_traversal_check
 from app.geoutils import geom_transform, epsg_from_wkt, get_raster_bounds_wkt, get_srs_name_units_from_epsg_or_wkt
 from nodeodm import status_codes
 from nodeodm.models import ProcessingNode
-from pyodm.exceptions import NodeResponseError, NodeConnectionError, NodeServerError, OdmError
+from pyodm.exceptions import NodeResponseError, NodeConnectionError, NodeServerError, OdmError, RangeNotAvailableError
 from webodm import settings
 from app.classes.gcp import GCPFile
 from .project import Project
@@ -53,6 +56,11 @@ from django.utils.translation import gettext_lazy as _, gettext
 from functools import partial
 import subprocess
 from app.classes.console import Console
+from app.classes.seekable_zip import SeekableZip, write_archive
+from app.classes.remote_zip import RemoteZipExtractor, RemoteZipError
+from app.file_utils import clone_tree
+from app.classes.stages import StageRunner
+from app.classes.upload_pipeline import UploadPipeline
 
 logger = logging.getLogger('app.logger')
 redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
@@ -122,6 +130,11 @@ def resize_image(image_path, resize_to, done=None):
             xmp = im.info.get("xmp")
             exif = im.info.get("exif")
 
+            if is_jpeg:
+                # Decode at the smallest DCT scale (1/2, 1/4, 1/8)
+                # that is still larger than the target size
+                im.draft(im.mode, (resized_width, resized_height))
+
             resized = im.resize((resized_width, resized_height), Image.LANCZOS)
             params = {}
             if is_jpeg:
@@ -168,6 +181,11 @@ def resize_image(image_path, resize_to, done=None):
     return retval
 
 class Task(models.Model):
+    # EPT data for the point cloud viewer (built after completion, not a downloadable asset)
+    EPT_FILE = os.path.join('entwine_pointcloud', 'ept.json')
+    EPT_ERROR_FILE = "ept_error.txt"
+    EPT_QUEUED_FILE = "ept_queued.txt"
+
     ASSETS_MAP = {
             'all.zip': {
                 'deferred_path': 'all.zip',
@@ -182,6 +200,7 @@ class Task(models.Model):
             'georeferenced_model.laz': os.path.join('odm_georeferencing', 'odm_georeferenced_model.laz'),
             'georeferenced_model.ply': os.path.join('odm_georeferencing', 'odm_georeferenced_model.ply'),
             'georeferenced_model.csv': os.path.join('odm_georeferencing', 'odm_georeferenced_model.csv'),
+            'georeferenced_model.copc.laz': os.path.join('odm_georeferencing', 'odm_georeferenced_model.copc.laz'),
             'textured_model.zip': {
                 'deferred_path': 'textured_model.zip',
                 'deferred_compress_dir': 'odm_texturing',
@@ -231,6 +250,7 @@ class Task(models.Model):
         (pending_actions.RESIZE, 'RESIZE'),
         (pending_actions.IMPORT, 'IMPORT'),
         (pending_actions.COMPACT, 'COMPACT'),
+        (pending_actions.DUPLICATE, 'DUPLICATE'),
     )
 
     TASK_PROGRESS_LAST_VALUE = 0.85
@@ -284,6 +304,10 @@ class Task(models.Model):
     size = models.FloatField(default=0.0, blank=True, help_text=_("Size of the task on disk in megabytes"), verbose_name=_("Size"))
     compacted = models.BooleanField(default=False, help_text=_("A flag indicating whether this task was compacted"), verbose_name=_("Compact"))
     crop = GeometryField(null=True, blank=True, srid=4326, help_text=_("Polygon defining the crop area of this task"), verbose_name=_("Crop Polygon"))
+    duplicate_source = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', help_text=_("Task whose files are being copied to this task (while duplicating)"), verbose_name=_("Duplicate Source"))
+    pointcloud_info = fields.JSONField(default=dict, blank=True, help_text=_("Point cloud header information (point count, bounds, spatial reference)"), verbose_name=_("Point Cloud Info"))
+    processing_stages = fields.JSONField(default=dict, blank=True, help_text=_("Status, number of attempts and duration (in seconds) of the stages run after the results have been downloaded"), verbose_name=_("Processing Stages"))
+    next_check_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text=_("When the status of this task should be checked next on the processing node"), verbose_name=_("Next Check At"))
 
     
     class Meta:
@@ -458,33 +482,34 @@ class Task(models.Model):
         else:
             return {}
 
-    def duplicate(self, set_new_name=True):
+    def duplicate(self, set_new_name=True, project=None):
+        """
+        Create a copy of this task. The new task is created right away
+        (with a DUPLICATE pending action) and its files are copied by a worker
+        :param project: project to create the copy in (defaults to this task's project)
+        :return: the new task, or False if it could not be created
+        """
         try:
             with transaction.atomic():
                 task = Task.objects.get(pk=self.pk)
                 task.pk = None
                 if set_new_name:
                     task.name = gettext('Copy of %(task)s') % {'task': self.name}
+                if project is not None:
+                    task.project = project
+                    # Files are copied directly into the new project
+                    task.__original_project_id = project.id
                 task.created_at = timezone.now()
+                task.duplicate_source = self
+                task.pending_action = pending_actions.DUPLICATE
+                task.running_progress = 0
                 task.save()
                 task.refresh_from_db()
 
                 logger.info("Duplicating {} to {}".format(self, task))
 
-                if os.path.isdir(self.task_path()):
-                    try:
-                        # Try to use hard links first
-                        shutil.copytree(self.task_path(), task.task_path(), copy_function=os.link)
-                    except Exception as e:
-                        logger.warning("Cannot duplicate task using hard links, will use normal copy instead: {}".format(str(e)))
-                        shutil.copytree(self.task_path(), task.task_path())
-                else:
-                    logger.warning("Task {} doesn't have folder, will skip copying".format(self))
-
-                self.project.owner.profile.clear_used_quota_cache()
-
-                from app.plugins import signals as plugin_signals
-                plugin_signals.task_duplicated.send_robust(sender=self.__class__, task_id=task.id)
+            from worker import tasks as worker_tasks
+            worker_tasks.process_task.delay(task.id)
 
             return task
         except Exception as e:
@@ -492,20 +517,81 @@ class Task(models.Model):
         
         return False
 
+    def handle_duplicate(self):
+        """
+        Copy the files of the task this task is a duplicate of. Files are cloned
+        (reflink / copy_file_range) when the filesystem supports it, so that the copy
+        is fast and takes no space until either task modifies them.
+        Images linked from the image store are hard linked.
+        """
+        source = self.duplicate_source
+        if source is None:
+            raise NodeServerError(gettext("Cannot duplicate task, the original task no longer exists"))
+
+        src_dir = source.task_path()
+        dst_dir = self.task_path()
+
+        try:
+            # Start over if a previous attempt was interrupted
+            if os.path.isdir(dst_dir):
+                shutil.rmtree(dst_dir)
+
+            if os.path.isdir(src_dir):
+                manifest = image_store.read_manifest(src_dir)
+                link = set(name for name, digest in manifest.items() if image_store.is_linked(os.path.join(src_dir, name), digest))
+                last_update = [time.time()]
+
+                def progress(p):
+                    if time.time() - last_update[0] >= 2:
+                        self.check_if_canceled()
+                        Task.objects.filter(pk=self.id).update(running_progress=p)
+                        last_update[0] = time.time()
+
+                stats = clone_tree(src_dir, dst_dir, link=link, progress_callback=progress)
+                logger.info("Duplicated {} to {} ({})".format(source, self, ", ".join("%s: %s" % (k, v) for k, v in stats.items())))
+            else:
+                logger.warning("Task {} doesn't have folder, will skip copying".format(source))
+        except (OSError, shutil.Error) as e:
+            raise NodeServerError(gettext("Cannot duplicate task: %(error)s") % {'error': str(e)})
+
+        self.pending_action = None
+        self.duplicate_source = None
+        self.running_progress = source.running_progress
+        self.save()
+
+        self.project.owner.profile.clear_used_quota_cache()
+
+        from app.plugins import signals as plugin_signals
+        plugin_signals.task_duplicated.send_robust(sender=self.__class__, task_id=self.id)
+
     def write_backup_file(self):
-        """Dump this tasks's fields to a backup file"""
-        with open(self.data_path("backup.json"), "w") as f:
-            f.write(json.dumps({
-                'name': self.name,
-                'processing_time': self.processing_time,
-                'options': self.options,
-                'created_at': self.created_at.astimezone(timezone.utc).timestamp(),
-                'public': self.public,
-                'resize_to': self.resize_to,
-                'potree_scene': self.potree_scene,
-                'tags': self.tags,
-                'crop': json.loads(self.crop.geojson) if self.crop is not None else None,
-            }))
+        """
+        Dump this tasks's fields to a backup file. The file is only written
+        if its content changes, so that repeated backups of the same task
+        are identical (and can be resumed)
+        """
+        content = json.dumps({
+            'name': self.name,
+            'processing_time': self.processing_time,
+            'options': self.options,
+            'created_at': self.created_at.astimezone(timezone.utc).timestamp(),
+            'public': self.public,
+            'resize_to': self.resize_to,
+            'potree_scene': self.potree_scene,
+            'tags': self.tags,
+            'crop': json.loads(self.crop.geojson) if self.crop is not None else None,
+        })
+        backup_file = self.data_path("backup.json")
+
+        try:
+            with open(backup_file, "r") as f:
+                if f.read() == content:
+                    return
+        except FileNotFoundError:
+            pass
+
+        with open(backup_file, "w") as f:
+            f.write(content)
     
     def read_backup_file(self):
         """Set this tasks fields based on the backup file (but don't save)"""
@@ -531,11 +617,65 @@ class Task(models.Model):
             except Exception as e:
                 logger.warning("Cannot read backup file: %s" % str(e))
 
-    def get_task_backup_stream(self):
+    def compute_backup_files(self):
+        """
+        List the files of this task that go in a backup, with their SHA-256 and size.
+        Digests are cached, so only files that are new or have changed since
+        the last call are hashed (see update_backup_digests)
+        :return: dictionary of relative path --> {'sha256': digest, 'size': bytes}
+        """
         self.write_backup_file()
-        zip_dir = self.task_path("")
-        paths = [{'n': os.path.relpath(os.path.join(dp, f), zip_dir), 'fs': os.path.join(dp, f)} for dp, dn, filenames in os.walk(zip_dir) for f in filenames]
-        return self.zip_stream(paths)
+        task_dir = self.task_path("")
+
+        # Images in the image store have a known digest
+        stored_images = image_store.read_manifest(task_dir)
+        known_digests = {name: digest for name, digest in stored_images.items()
+                         if image_store.is_linked(os.path.join(task_dir, name), digest)}
+
+        # The console index is rebuilt when needed
+        return backup.compute_files(task_dir, exclude=[os.path.relpath(self.console.index_file, task_dir),
+                                                       os.path.relpath(self.zip_crc_cache_path(), task_dir),
+                                                       os.path.relpath(self.data_path(self.EPT_QUEUED_FILE), task_dir)],
+                                    known_digests=known_digests)
+
+    def update_backup_digests(self):
+        """
+        Queue the hashing of this task's files on a worker, so that
+        backup requests don't need to hash them
+        """
+        from worker.tasks import update_backup_digests
+        update_backup_digests.delay(self.id)
+
+    def get_task_backup_stream(self, since=None):
+        """
+        Get a stream to a backup of this task. Backups include a manifest
+        of all files, so that later backups can be made incremental
+        (once the manifest is saved with save_backup_manifest)
+        :param since: id of the manifest of a previous backup. If set, only
+            the files that are new or have changed since that backup are included
+        :return: (stream, manifest)
+        :raise FileNotFoundError: if the manifest of the previous backup does not exist
+        """
+        task_dir = self.task_path("")
+        files = self.compute_backup_files()
+
+        base_files = {}
+        if since is not None:
+            base_files = backup.read_manifest(task_dir, since)['files']
+
+        manifest = backup.make_manifest(files, base=since)
+        paths = [{'n': p, 'fs': os.path.join(task_dir, p)} for p in backup.changed_files(files, base_files)]
+
+        # The manifest entry only changes when the files do
+        zs = self.zip_stream(paths, allow_empty=True)
+        zs.add(json.dumps(manifest, sort_keys=True).encode('utf-8'), backup.MANIFEST_FILE, mtime=zs.last_modified())
+        return zs, manifest
+
+    def save_backup_manifest(self, manifest):
+        """
+        Keep the manifest of a backup, so that later backups can be made incremental against it
+        """
+        backup.save_manifest(self.task_path(""), manifest, keep=settings.TASK_BACKUP_MANIFESTS)
     
     def get_asset_file_or_stream(self, asset):
         """
@@ -563,17 +703,19 @@ class Task(models.Model):
         else:
             raise FileNotFoundError("{} is not a valid asset".format(asset))
 
-    def zip_stream(self, paths):
-        if len(paths) == 0:
+    def zip_stream(self, paths, allow_empty=False):
+        if len(paths) == 0 and not allow_empty:
             raise FileNotFoundError("No files available for download")
 
-        zs = ZipStream(sized=True)
-        zs.comment = "Generated by WebODM"
+        zs = SeekableZip(crc_cache=self.zip_crc_cache_path(), comment="Generated by WebODM")
         for p in paths:
             zs.add_path(p['fs'], p['n'])
         
         return zs
 
+    def zip_crc_cache_path(self):
+        return self.data_path("zip_crc_cache.json")
+
     def get_asset_download_path(self, asset):
         """
         Get the path to an asset download
@@ -672,29 +814,28 @@ class Task(models.Model):
         ready to be processed execute some logic. This could be communication
         with a processing node or executing a pending action.
         """
+        # Saves made while processing do not need to schedule the task again
+        self._processing = True
 
         try:
+            if self.pending_action == pending_actions.DUPLICATE:
+                self.handle_duplicate()
+                return
+
             if self.pending_action == pending_actions.IMPORT:
                 self.handle_import()
 
             if self.pending_action == pending_actions.RESIZE:
-                resized_images = self.resize_images()
-                self.refresh_from_db()
-                self.resize_gcp(resized_images)
-                self.pending_action = None
-                self.save()
+                if not self.resize_and_upload_images():
+                    self.resize_images()
+                    self.refresh_from_db()
+                    self.pending_action = None
+                    self.save()
 
             if self.auto_processing_node and not self.status in [status_codes.FAILED, status_codes.CANCELED]:
                 # No processing node assigned and need to auto assign
                 if self.processing_node is None:
-                    # Assign first online node with lowest queue count
-                    self.processing_node = ProcessingNode.find_best_available_node(self.project.owner)
-                    if self.processing_node:
-                        self.processing_node.queue_count += 1 # Doesn't have to be accurate, it will get overridden later
-                        self.processing_node.save()
-
-                        logger.info("Automatically assigned processing node {} to {}".format(self.processing_node, self))
-                        self.save()
+                    self.auto_assign_processing_node()
 
                 # Processing node assigned, but is offline and no errors
                 if self.processing_node and not self.processing_node.is_online():
@@ -817,11 +958,14 @@ class Task(models.Model):
                             self.upload_progress = 0
 
                         self.console.reset()
+                        if os.path.isfile(self.assets_download_state_path()):
+                            os.remove(self.assets_download_state_path())
                         self.processing_time = -1
                         self.status = None
                         self.last_error = None
                         self.pending_action = None
                         self.running_progress = 0
+                        self.next_check_at = None
                         self.save()
                     else:
                         raise NodeServerError(gettext("Cannot restart a task that has no processing node"))
@@ -855,24 +999,8 @@ class Task(models.Model):
                 # Need to update status (first time, queued or running?)
                 if self.uuid and self.status in [None, status_codes.QUEUED, status_codes.RUNNING]:
                     # Update task info from processing node
-                    if not self.console.output():
-                        current_lines_count = 0
-                    else:
-                        current_lines_count = len(self.console.output().split("\n"))
-
-                    info = self.processing_node.get_task_info(self.uuid, current_lines_count)
-
-                    self.processing_time = info.processing_time
-                    self.status = info.status.value
-
-                    if len(info.output) > 0:
-                        self.console += "\n".join(info.output) + '\n'
-
-                    # Update running progress
-                    self.running_progress = (info.progress / 100.0) * self.TASK_PROGRESS_LAST_VALUE
-
-                    if info.last_error != "":
-                        self.last_error = info.last_error
+                    info = self.processing_node.get_task_info(self.uuid, self.get_console_lines_count())
+                    self.update_from_task_info(info)
 
                     # Has the task just been canceled, failed, or completed?
                     if self.status in [status_codes.FAILED, status_codes.COMPLETED, status_codes.CANCELED]:
@@ -882,11 +1010,12 @@ class Task(models.Model):
                             assets_dir = self.assets_path("")
 
                             # Remove previous assets directory
-                            if os.path.exists(assets_dir):
+                            # (unless we can continue a previous download of the results)
+                            if os.path.exists(assets_dir) and not os.path.isfile(self.assets_download_state_path()):
                                 logger.info("Removing old assets directory: {} for {}".format(assets_dir, self))
                                 shutil.rmtree(assets_dir)
 
-                            os.makedirs(assets_dir)
+                            os.makedirs(assets_dir, exist_ok=True)
 
                             # Download and try to extract results up to 4 times
                             # (~5% of the times, on large downloads, the archive could be corrupted)
@@ -906,25 +1035,30 @@ class Task(models.Model):
 
                             while not extracted:
                                 last_update = 0
-                                logger.info("Downloading all.zip for {}".format(self))
+                                all_zip_path = self.assets_path("all.zip")
 
-                                # Download all assets
-                                zip_path = self.processing_node.download_task_assets(self.uuid, assets_dir, progress_callback=callback, parallel_downloads=max(1, int(16 / (2 ** retry_num))))
+                                try:
+                                    if self.stream_extract_assets(progress_callback=callback, max_workers=max(1, int(settings.TASK_STREAMING_EXTRACT_MAX_WORKERS / (2 ** retry_num)))):
+                                        self.extract_assets_and_complete(from_zip=False)
+                                    else:
+                                        logger.info("Downloading all.zip for {}".format(self))
 
-                                # Rename to all.zip
-                                all_zip_path = self.assets_path("all.zip")
-                                os.rename(zip_path, all_zip_path)
+                                        # Download all assets
+                                        zip_path = self.processing_node.download_task_assets(self.uuid, assets_dir, progress_callback=callback, parallel_downloads=max(1, int(16 / (2 ** retry_num))))
 
-                                logger.info("Extracting all.zip for {}".format(self))
+                                        # Rename to all.zip
+                                        os.rename(zip_path, all_zip_path)
+
+                                        logger.info("Extracting all.zip for {}".format(self))
+                                        self.extract_assets_and_complete()
 
-                                try:
-                                    self.extract_assets_and_complete()
                                     extracted = True
                                 except zipfile.BadZipFile:
                                     if retry_num < 5:
-                                        logger.warning("{} seems corrupted. Retrying...".format(all_zip_path))
+                                        logger.warning("Results of {} seem corrupted. Retrying...".format(self))
                                         retry_num += 1
-                                        os.remove(all_zip_path)
+                                        if os.path.exists(all_zip_path):
+                                            os.remove(all_zip_path)
                                     else:
                                         raise NodeServerError(gettext("Invalid zip file"))
                         else:
@@ -946,32 +1080,253 @@ class Task(models.Model):
         except TaskInterruptedException as e:
             # Task was interrupted during image resize / upload
             logger.warning("{} interrupted: {}".format(self, str(e)))
+        finally:
+            self._processing = False
 
-    def extract_assets_and_complete(self):
+    def auto_assign_processing_node(self):
+        """
+        Assign the first online node with lowest queue count to this task
+        :return: the assigned processing node or None
+        """
+        self.processing_node = ProcessingNode.find_best_available_node(self.project.owner)
+        if self.processing_node:
+            self.processing_node.queue_count += 1 # Doesn't have to be accurate, it will get overridden later
+            self.processing_node.save()
+
+            logger.info("Automatically assigned processing node {} to {}".format(self.processing_node, self))
+            self.save()
+
+        return self.processing_node
+
+    def resize_and_upload_images(self):
+        """
+        Resize this task's images and upload them to the processing node at the same time
+        (each image is uploaded as soon as it has been resized). The task starts processing
+        once all of its files (including the resized GCP file) have been uploaded.
+        :return: True if the task has been sent to the processing node, False if this is not possible
+            (the images should be resized first and uploaded afterwards)
+        """
+        if not settings.TASK_PIPELINED_UPLOAD or self.uuid or self.status is not None:
+            return False
+
+        if self.processing_node is None and self.auto_processing_node:
+            self.auto_assign_processing_node()
+
+        node = self.processing_node
+        if node is None or not node.is_online():
+            return False
+
+        api_client = node.api_client()
+        try:
+            if not node.supports_staged_upload(api_client):
+                return False
+            uuid = node.init_task(self.name, self.options, api_client=api_client)
+        except NodeConnectionError as e:
+            raise NodeServerError(gettext('Connection error: %(error)s') % {'error': str(e)})
+
+        logger.info("Resizing and uploading images of {} to {}".format(self, node))
+
+        files = [self.task_path(f) for f in self.scan_images()]
+        queued = set()
+        pipeline = UploadPipeline(partial(node.upload_task_file, uuid, api_client=api_client),
+                                  parallel_uploads=settings.TASK_PARALLEL_UPLOADS,
+                                  queue_size=settings.TASK_PARALLEL_UPLOADS * 2,
+                                  retry_on=(NodeConnectionError, NodeServerError)).start()
+
+        def upload(path):
+            queued.add(path)
+            pipeline.put(path)
+
+        def upload_progress():
+            return dict(upload_progress=float(pipeline.uploaded) / float(max(1, len(files))))
+
+        def wait_callback():
+            testWatch.manual_log_call("Task.process.callback")
+            self.check_if_canceled()
+            Task.objects.filter(pk=self.id).update(**upload_progress())
+
+        try:
+            self.resize_images(on_resized=upload, progress_updates=upload_progress)
+            self.refresh_from_db()
+
+            # Files that are not resized (GCP file, geo.txt, etc.)
+            for f in files:
+                if f not in queued:
+                    upload(f)
+
+            pipeline.finish(wait_callback)
+            uuid = node.commit_task(uuid, api_client=api_client)
+        except Exception as e:
+            pipeline.abort()
+
+            # Don't leave a partially uploaded task on the node
+            try:
+                node.remove_task(uuid)
+            except Exception as re:
+                logger.warning("Cannot remove partially uploaded task {} from {}: {}".format(uuid, node, str(re)))
+
+            if isinstance(e, NodeConnectionError):
+                raise NodeServerError(gettext('Connection error: %(error)s') % {'error': str(e)})
+            raise
+
+        # Refresh task object before committing change
+        self.refresh_from_db()
+        self.pending_action = None
+        self.upload_progress = 1.0
+        self.uuid = uuid
+        self.save()
+
+        return True
+
+    def get_console_lines_count(self):
+        # Same as len(output.split("\n")), without reading the console output
+        return self.console.split_line_count()
+
+    def update_from_task_info(self, info, append_output=True):
+        """
+        Apply the status information reported by the processing node
+        (status, processing time, progress, new console output)
+        and schedule the next status check. Does not save the model.
+        :param info: pyodm TaskInfo
+        :param append_output: whether to append the new console output
+            (otherwise the caller should call append_console_output once the model is saved)
+        """
+        prev_state = (self.status, self.running_progress)
+        self.processing_time = info.processing_time
+        self.status = info.status.value
+
+        if append_output:
+            self.append_console_output(info.output)
+
+        # Update running progress
+        self.running_progress = (info.progress / 100.0) * self.TASK_PROGRESS_LAST_VALUE
+
+        if info.last_error != "":
+            self.last_error = info.last_error
+
+        self.schedule_next_check(changed=len(info.output) > 0 or prev_state != (self.status, self.running_progress))
+
+    def append_console_output(self, lines):
+        if len(lines) > 0:
+            self.console += "\n".join(lines) + '\n'
+
+    def schedule_next_check(self, changed=True):
+        """
+        Set the time at which the status of this task should be checked next
+        on the processing node. The interval doubles (up to TASK_POLL_MAX_INTERVAL)
+        each time the status is found unchanged and resets when it changes.
+        :param changed: whether the last status check reported any change
+        """
+        if self.status not in [None, status_codes.QUEUED, status_codes.RUNNING]:
+            self.next_check_at = None
+            return
+
+        min_interval = settings.TASK_POLL_MIN_INTERVAL
+        max_interval = settings.TASK_POLL_MAX_INTERVAL
+
+        key = 'task_poll_interval_{}'.format(self.id)
+        interval = min_interval
+
+        try:
+            if not changed:
+                prev_interval = redis_client.get(key)
+                if prev_interval is not None:
+                    interval = min(max_interval, max(interval, float(prev_interval) * 2))
+            redis_client.set(key, interval, ex=max(60, int(max_interval * 2)))
+        except redis.exceptions.RedisError:
+            pass
+
+        self.next_check_at = timezone.now() + timedelta(seconds=interval)
+
+    def assets_download_state_path(self):
+        return self.assets_path(".download.json")
+
+    def stream_extract_assets(self, progress_callback=None, max_workers=8):
+        """
+        Extract the results of this task from the processing node while they download,
+        one archive entry at a time (with range requests), without storing all.zip on disk.
+        Corrupted entries are downloaded again. The download state is kept in the
+        assets directory, so an interrupted download continues where it left off.
+        :param progress_callback: invoked with the download progress percentage
+        :param max_workers: maximum number of entries to download at the same time
+        :return: True if the assets have been extracted, False if they
+            should be downloaded as an archive instead
+        """
+        if not settings.TASK_STREAMING_EXTRACT:
+            return False
+
+        assets_dir = self.assets_path("")
+        api_client = self.processing_node.api_client()
+        size = self.processing_node.get_task_assets_size(self.uuid, api_client=api_client)
+        if size is None:
+            logger.info("{} does not support range requests, downloading all.zip for {}".format(self.processing_node, self))
+            return False
+
+        logger.info("Downloading and extracting all.zip for {}".format(self))
+        extractor = RemoteZipExtractor(partial(self.processing_node.fetch_task_assets_range, self.uuid, api_client=api_client),
+                                       size, assets_dir,
+                                       max_workers=max_workers,
+                                       progress_callback=progress_callback,
+                                       retry_on=(NodeConnectionError, ),
+                                       state_file=self.assets_download_state_path(),
+                                       key=self.uuid)
+        try:
+            extractor.extract()
+        except (RemoteZipError, RangeNotAvailableError) as e:
+            logger.info("Cannot extract all.zip while downloading for {} ({}), downloading all.zip instead".format(self, str(e)))
+            shutil.rmtree(assets_dir)
+            os.makedirs(assets_dir)
+            return False
+
+        logger.info("Extracted all.zip for {}".format(self))
+        return True
+
+    def extract_assets_and_complete(self, from_zip=True):
         """
         Extracts assets/all.zip, populates task fields where required and assure COGs
         It will raise a zipfile.BadZipFile exception if the archive is corrupted.
+        :param from_zip: whether assets/all.zip needs to be extracted (False if the assets
+            have already been extracted in the assets directory)
         :return:
         """
         assets_dir = self.assets_path("")
         zip_path = self.assets_path("all.zip")
 
-        # Extract from zip
-        try:
-            with zipfile.ZipFile(zip_path, "r") as zip_h:
-                zip_h.extractall(assets_dir)
-        except zlib.error as e:
-            raise zipfile.BadZipFile(str(e))
+        if from_zip:
+            # Extract from zip
+            try:
+                if backup.is_chain(zip_path):
+                    # Full backup followed by incremental backups
+                    backup.restore_chain(zip_path, assets_dir, tmp_dir=settings.FILE_UPLOAD_TEMP_DIR)
+                else:
+                    with zipfile.ZipFile(zip_path, "r") as zip_h:
+                        zip_h.extractall(assets_dir)
+            except zlib.error as e:
+                raise zipfile.BadZipFile(str(e))
+            except backup.BackupError as e:
+                logger.warning("Cannot restore from backup: %s" % str(e))
+                raise NodeServerError(str(e))
 
-        logger.info("Extracted all.zip for {}".format(self))
-        
-        os.remove(zip_path)
+            logger.info("Extracted all.zip for {}".format(self))
+
+            os.remove(zip_path)
 
         # Check if this looks like a backup file, in which case we need to move the files
         # a directory level higher
         is_backup = os.path.isfile(self.assets_path("data", "backup.json")) and os.path.isdir(self.assets_path("assets"))
         if is_backup:
             logger.info("Restoring from backup")
+
+            manifest = backup.read_json(self.assets_path(backup.MANIFEST_FILE), None)
+            if manifest is not None:
+                if manifest.get('base'):
+                    raise NodeServerError("This is an incremental backup: import it together with its base backup")
+                try:
+                    backup.verify(assets_dir, manifest)
+                except backup.BackupError as e:
+                    logger.warning("Cannot restore from backup: %s" % str(e))
+                    raise NodeServerError(str(e))
+
             try:
                 tmp_dir = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, f"{self.id}.backup")
                 
@@ -994,32 +1349,71 @@ class Task(models.Model):
                     shutil.rmtree(top_level[0])
 
 
-        # Populate *_extent fields
-        extent_fields = self.get_extent_fields()
+        # Post-processing stages (run concurrently where dependencies allow)
+        runner = StageRunner(max_workers=settings.TASK_STAGES_MAX_WORKERS)
+        extent_fields = [(raster_path, field) for raster_path, field in self.get_extent_fields() if os.path.exists(raster_path)]
+        threads = get_threads_per_job(max(1, len(extent_fields)))
 
+        cogeo_stages = []
+        extent_stages = []
         for raster_path, field in extent_fields:
-            if os.path.exists(raster_path):
-                # Make sure this is a Cloud Optimized GeoTIFF
-                # if not, it will be created
-                try:
-                    assure_cogeo(raster_path)
-                except IOError as e:
-                    logger.warning("Cannot create Cloud Optimized GeoTIFF for %s (%s). This will result in degraded visualization performance." % (raster_path, str(e)))
-
-                # Read extent
-                extent_wkt = get_raster_bounds_wkt(raster_path)
-                if extent_wkt is not None:
-                    extent = GEOSGeometry(extent_wkt, srid=4326)
-                    setattr(self, field, extent)
-                    logger.info("Populated extent field with {} for {}".format(raster_path, self))
-                else:
-                    logger.warning("Cannot populate extent field with {} for {}, not georeferenced".format(raster_path, self))
-        
-        self.check_ept()
-        self.update_available_assets_field()
-        self.update_georef_fields()
-        self.update_orthophoto_bands_field()
-        self.update_size()
+            name = field.replace("_extent", "")
+            cogeo_stages.append(runner.add("cogeo_" + name, partial(self.assure_cogeo_asset, raster_path, threads), retries=1))
+            extent_stages.append(runner.add(field, partial(self.populate_extent_field, raster_path, field), deps=[cogeo_stages[-1]]))
+
+        # All rasters share the same CRS, so georeferencing only needs
+        # to read the first one (and can run while the others are converted)
+        georef_stages = cogeo_stages[:1]
+        georef_assets = [c.replace("cogeo_", "") + ".tif" for c in georef_stages]
+
+        # COG conversions replace rasters in place, so the stages that
+        # open or look for every raster wait for all of them
+        stages_2d = extent_stages + [
+            runner.add("georef", partial(self.update_georef_fields, assets=georef_assets), deps=georef_stages),
+            runner.add("orthophoto_bands", self.update_orthophoto_bands_field, deps=[c for c in cogeo_stages if c == "cogeo_orthophoto"]),
+            runner.add("available_assets", self.update_available_assets_field, deps=cogeo_stages),
+        ]
+        runner.add("size", self.compute_size, deps=cogeo_stages, required=False)
+
+        # Imported tasks are only completed once all stages have run
+        is_import = bool(self.import_url) or is_backup
+        published = False
+
+        def on_stages_change(r):
+            nonlocal published
+            progress = self.TASK_PROGRESS_LAST_VALUE + 0.1 + r.progress() * (0.99 - self.TASK_PROGRESS_LAST_VALUE - 0.1)
+            update = dict(processing_stages=r.to_dict(), running_progress=progress)
+
+            # The task can be viewed as soon as the 2D stages are done,
+            # without waiting for the optional ones
+            if not published and not is_import and r.is_done(*stages_2d):
+                update.update(status=status_codes.COMPLETED,
+                              available_assets=self.available_assets,
+                              orthophoto_extent=self.orthophoto_extent,
+                              dsm_extent=self.dsm_extent,
+                              dtm_extent=self.dtm_extent,
+                              epsg=self.epsg,
+                              wkt=self.wkt,
+                              orthophoto_bands=self.orthophoto_bands,
+                              potree_scene={},
+                              crop=None)
+                self.clear_task_assets_cache()
+                published = True
+                logger.info("2D assets of {} are available".format(self))
+
+            Task.objects.filter(pk=self.id).update(**update)
+
+        runner.on_change = on_stages_change
+        try:
+            runner.run()
+        finally:
+            self.processing_stages = runner.to_dict()
+
+        try:
+            self.project.owner.profile.clear_used_quota_cache()
+        except Exception as e:
+            logger.warning("Cannot clear used quota cache for {}: {}".format(self, str(e)))
+
         self.clear_task_assets_cache()
         self.potree_scene = {}
         self.running_progress = 1.0
@@ -1042,23 +1436,117 @@ class Task(models.Model):
         from app.plugins import signals as plugin_signals
         plugin_signals.task_completed.send_robust(sender=self.__class__, task_id=self.id)
 
-    def check_ept(self, threads=1):
-        # Make sure that the entwine_pointcloud/ept.json file exists
-        # and generate it otherwise
-        ept_file = self.assets_path("entwine_pointcloud", "ept.json")
+        # The point cloud viewer becomes available once EPT is built
+        self.schedule_ept()
+
+        self.update_backup_digests()
+
+    def assure_cogeo_asset(self, raster_path, threads=None):
+        try:
+            assure_cogeo(raster_path, threads=threads)
+        except IOError as e:
+            logger.warning("Cannot create Cloud Optimized GeoTIFF for %s (%s). This will result in degraded visualization performance." % (raster_path, str(e)))
+
+    def populate_extent_field(self, raster_path, field):
+        extent_wkt = get_raster_bounds_wkt(raster_path)
+        if extent_wkt is not None:
+            extent = GEOSGeometry(extent_wkt, srid=4326)
+            setattr(self, field, extent)
+            logger.info("Populated extent field with {} for {}".format(raster_path, self))
+        else:
+            logger.warning("Cannot populate extent field with {} for {}, not georeferenced".format(raster_path, self))
+
+    def needs_ept(self):
+        return self.get_point_cloud() is not None and \
+               not os.path.isfile(self.assets_path(self.EPT_FILE))
+
+    def get_ept_state(self):
+        """
+        :return: state of the EPT data used by the point cloud viewer:
+            "ready", "building" (a build has been queued), "failed" or None
+            if the task has no point cloud or no build is queued
+        """
+        if os.path.isfile(self.assets_path(self.EPT_FILE)):
+            return "ready"
+        if self.get_point_cloud() is None:
+            return None
+        if os.path.isfile(self.data_path(self.EPT_ERROR_FILE)):
+            return "failed"
+
+        # Builds that were lost (e.g. a worker was killed) don't count
+        queued_file = self.data_path(self.EPT_QUEUED_FILE)
+        if os.path.isfile(queued_file) and os.path.getmtime(queued_file) > time.time() - settings.EPT_TIME_LIMIT * 2:
+            return "building"
+        return None
+
+    def set_ept_queued(self, queued):
+        """
+        Record (or clear, if queued is False) that an EPT build has been queued
+        """
+        queued_file = self.data_path(self.EPT_QUEUED_FILE)
+        if queued:
+            os.makedirs(os.path.dirname(queued_file), exist_ok=True)
+            with open(queued_file, "w") as f:
+                f.write(str(time.time()))
+        elif os.path.isfile(queued_file):
+            os.remove(queued_file)
+
+    def set_ept_error(self, error):
+        """
+        Record (or clear, if error is None) the reason why EPT data could not be built
+        """
+        error_file = self.data_path(self.EPT_ERROR_FILE)
+        if error is None:
+            if os.path.isfile(error_file):
+                os.remove(error_file)
+        else:
+            logger.warning("Cannot create EPT for %s (%s). 3D point cloud will not display properly." % (self, error))
+            os.makedirs(os.path.dirname(error_file), exist_ok=True)
+            with open(error_file, "w") as f:
+                f.write(error)
+
+    def needs_copc(self):
+        return settings.POINTCLOUD_COPC and self.get_point_cloud() is not None and \
+               not os.path.isfile(self.assets_path(self.ASSETS_MAP["georeferenced_model.copc.laz"]))
+
+    def schedule_ept(self):
+        """
+        Queue the generation of EPT (and COPC) data on the EPT worker queue, if needed
+        :return: True if a build was queued
+        """
+        if not (self.needs_ept() or self.needs_copc()):
+            return False
+
+        from worker.tasks import build_ept
+        self.set_ept_queued(True)
+        build_ept.delay(self.id)
+        return True
+
+    def check_ept(self, threads=None):
+        """
+        Make sure that the entwine_pointcloud/ept.json file exists
+        and generate it otherwise
+        :param threads: number of threads to use (defaults to the available cores, capped by EPT_MAX_THREADS)
+        :return: True if EPT data was built
+        """
+        ept_file = self.assets_path(self.EPT_FILE)
         if os.path.isfile(ept_file):
             return
         
         point_cloud = self.get_point_cloud()
         if point_cloud is None:
             return
+
+        if threads is None:
+            threads = get_threads_per_job(1, max_threads=settings.EPT_MAX_THREADS)
         
         # We have the point cloud, but no EPT. Generate EPT.
         entwine = shutil.which('entwine')
         if not entwine:
-            logger.warning("Cannot create EPT, entwine program is missing")
+            self.set_ept_error("entwine program is missing")
             return None
         
+        self.set_ept_error(None)
         ept_dir = self.assets_path("entwine_pointcloud")
         try:
             if not os.path.exists(settings.MEDIA_TMP):
@@ -1070,13 +1558,46 @@ class Task(models.Model):
                 "-i", quote(point_cloud),
                 "-o", quote(ept_dir)]
             
-            subprocess.run(params, timeout=12*60*60)
+            subprocess.run(params, timeout=settings.EPT_TIME_LIMIT)
 
             if os.path.isdir(tmp_ept_path):
                 shutil.rmtree(tmp_ept_path)
+
+            if not os.path.isfile(ept_file):
+                self.set_ept_error("entwine did not create {}".format(self.EPT_FILE))
+                return False
             return True
         except Exception as e:
-            logger.warning("Cannot create EPT for %s (%s). 3D point cloud will not display properly." % (point_cloud, str(e)))
+            self.set_ept_error(str(e))
+
+    def check_copc(self, threads=None):
+        """
+        Make sure that a Cloud Optimized Point Cloud exists (if enabled)
+        and generate it otherwise
+        :param threads: number of threads to use (defaults to the available cores, capped by EPT_MAX_THREADS)
+        :return: True if COPC data was built
+        """
+        if not self.needs_copc():
+            return
+
+        if threads is None:
+            threads = get_threads_per_job(1, max_threads=settings.EPT_MAX_THREADS)
+
+        point_cloud = self.get_point_cloud()
+        try:
+            return build_copc(point_cloud, self.assets_path(self.ASSETS_MAP["georeferenced_model.copc.laz"]), threads=threads)
+        except Exception as e:
+            logger.warning("Cannot create COPC for %s (%s)" % (point_cloud, str(e)))
+
+    def update_ept_fields(self):
+        """
+        Refresh the available_assets and size fields after an EPT build.
+        Only these fields are written, so that a build running
+        on another worker doesn't overwrite concurrent changes to the task
+        """
+        self.update_available_assets_field()
+        self.update_size()
+        Task.objects.filter(pk=self.id).update(available_assets=self.available_assets, size=self.size)
 
 
     def get_extent_fields(self):
@@ -1100,6 +1621,26 @@ class Task(models.Model):
         if os.path.isfile(f):
             return f
 
+    def get_pointcloud_info(self, commit=False):
+        """
+        Point cloud header information, cached in the pointcloud_info field
+        and refreshed only when the point cloud file changes
+        :param commit: when True also saves the model if the information was refreshed
+        :return: dict (empty if there's no point cloud)
+        """
+        point_cloud = self.get_point_cloud()
+        if point_cloud is None:
+            return {}
+
+        st = os.stat(point_cloud)
+        info = self.pointcloud_info
+        if isinstance(info, dict) and info.get('size') == st.st_size and info.get('mtime') == st.st_mtime:
+            return info
+
+        self.pointcloud_info = read_pointcloud_info(point_cloud)
+        if commit: self.save()
+        return self.pointcloud_info
+
     def get_tile_path(self, tile_type, z, x, y):
         return self.assets_path("{}_tiles".format(tile_type), z, x, "{}.png".format(y))
 
@@ -1180,7 +1721,7 @@ class Task(models.Model):
             raise FileNotFoundError("{} does not exist".format(directory_path))
 
         if not os.path.exists(archive_path):
-            shutil.make_archive(os.path.splitext(archive_path)[0], 'zip', directory_path)
+            write_archive(directory_path, archive_path)
 
         return archive_path
 
@@ -1194,15 +1735,19 @@ class Task(models.Model):
         if commit: self.save()
 
     
-    def update_georef_fields(self, commit=False):
+    def update_georef_fields(self, commit=False, assets=None):
         """
         Updates the epsg and wkt field with the correct values
         :param commit: when True also saves the model, otherwise the user should manually call save()
+        :param assets: rasters to read the CRS from (defaults to orthophoto, DSM and DTM)
         """
         epsg = None
         wkt = None
 
-        for asset in ['orthophoto.tif', 'dsm.tif', 'dtm.tif']:
+        if assets is None:
+            assets = ['orthophoto.tif', 'dsm.tif', 'dtm.tif']
+
+        for asset in assets:
             asset_path = self.assets_path(self.ASSETS_MAP[asset])
             if os.path.isfile(asset_path):
                 try:
@@ -1227,7 +1772,8 @@ class Task(models.Model):
         # (2D assets might be using pseudo-georeferencing)
         point_cloud = self.assets_path(self.ASSETS_MAP['georeferenced_model.laz'])
         if (epsg is not None or wkt is not None) and os.path.isfile(point_cloud):
-            if not is_pointcloud_georeferenced(point_cloud):
+            # (the result is cached in pointcloud_info, saved along with the epsg field)
+            if not is_pointcloud_georeferenced(point_cloud, self.get_pointcloud_info()):
                 logger.info("{} is not georeferenced".format(self))
                 epsg = None
                 wkt = None
@@ -1269,6 +1815,7 @@ class Task(models.Model):
         directory_to_delete = os.path.join(settings.MEDIA_ROOT,
                                            task_directory_path(self.id, self.project.id))
         self.clear_task_assets_cache()
+        stored_images = image_store.read_manifest(directory_to_delete)
 
         super(Task, self).delete(using, keep_parents)
 
@@ -1278,10 +1825,25 @@ class Task(models.Model):
         except FileNotFoundError as e:
             logger.warning(e)
 
+        # Remove images that are no longer used by other tasks
+        image_store.release(stored_images.values())
+
         self.project.owner.profile.clear_used_quota_cache()
 
         plugin_signals.task_removed.send_robust(sender=self.__class__, task_id=task_id)
 
+    def release_stored_images(self):
+        """
+        Remove the entries of the image store manifest that this task no longer links to
+        (e.g. images that have been removed or resized) and release their blobs
+        """
+        task_path = self.task_path()
+        manifest = image_store.read_manifest(task_path)
+        unlinked = [name for name, digest in manifest.items() if not image_store.is_linked(os.path.join(task_path, name), digest)]
+        if len(unlinked) > 0:
+            image_store.update_manifest(task_path, remove=unlinked)
+            image_store.release([manifest[name] for name in unlinked])
+
     def compact(self):
         # Remove all images
         images_path = self.task_path()
@@ -1292,6 +1854,7 @@ class Task(models.Model):
             except Exception as e:
                 logger.warning(e)
 
+        self.release_stored_images()
         self.compacted = True
         self.update_size(commit=True)
 
@@ -1324,11 +1887,16 @@ class Task(models.Model):
                                                                                   pending_actions.COMPACT]:
             raise TaskInterruptedException()
 
-    def resize_images(self):
+    def resize_images(self, on_resized=None, progress_updates=None):
         """
         Destructively resize this task's JPG images while retaining EXIF tags.
         Resulting images are always converted to JPG.
+        The GCP file (if any) is updated with the resize ratio of each image.
         TODO: add support for tiff files
+        :param on_resized: optional function invoked with the path of each image
+            as soon as it has been processed (resized or not)
+        :param progress_updates: optional function returning additional fields
+            to update along with the resize progress
         :return list containing paths of resized images and resize ratios
         """
         if self.resize_to < 0:
@@ -1341,55 +1909,80 @@ class Task(models.Model):
 
         images_path = self.find_all_files_matching(r'.*\.(jpe?g|tiff?|png)$')
         total_images = len(images_path)
+        if total_images == 0:
+            Task.objects.filter(pk=self.id).update(resize_progress=1.0)
+            return []
+
+        max_workers = min(settings.IMAGE_RESIZE_MAX_WORKERS or get_available_cores(), total_images)
+
+        # Daemon processes (e.g. multiprocessing workers) cannot have children
+        if can_spawn_processes():
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        gcp_file = None
+        gcp_path = self.find_gcp_file()
+        if gcp_path is not None:
+            try:
+                gcp_file = GCPFile(gcp_path)
+                list(gcp_file.iter_entries()) # Validate entries
+            except Exception as e:
+                logger.warning("Could not resize GCP file {}: {}".format(gcp_path, str(e)))
+                gcp_file = None
+
+        resized_images = []
         resized_images_count = 0
         last_update = 0
-        lock = threading.Lock()
-
-        def callback(retval=None):
-            nonlocal last_update
-            nonlocal resized_images_count
-            nonlocal total_images
-
-            resized_images_count += 1
-            if time.time() - last_update >= 2:
-                with lock:
-                    if settings.TESTING:
-                        # In testing, django is unable to find the Task object, so we skip this
-                        return
-                    
-                    # Update progress
-                    Task.objects.filter(pk=self.id).update(resize_progress=(float(resized_images_count) / float(total_images)))
-                    self.check_if_canceled()
-                    last_update = time.time()
 
-        max_workers = min(settings.WORKERS_MAX_THREADS, len(images_path))
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for image_path in images_path:
-                f = executor.submit(resize_image, image_path, self.resize_to, callback)
-                futures.append(f)
-            
-            resized_images = []
-            for f in futures:
-                try:
-                    resized_images.append(f.result())
-                except Exception as e:
-                    logger.warning(f"Error resizing image: {str(e)}")
-        
+        with executor:
+            futures = {executor.submit(resize_image, image_path, self.resize_to): image_path for image_path in images_path}
+
+            try:
+                for f in as_completed(futures):
+                    try:
+                        resized_image = f.result()
+                        resized_images.append(resized_image)
+                        if gcp_file is not None and resized_image['resize_ratio'] != 1:
+                            gcp_file.resize_image_entries(os.path.basename(resized_image['path']), resized_image['resize_ratio'])
+                    except Exception as e:
+                        logger.warning(f"Error resizing image: {str(e)}")
+
+                    resized_images_count += 1
+                    if on_resized is not None:
+                        on_resized(futures[f])
+
+                    # In testing, django is unable to find the Task object, so we skip this
+                    if time.time() - last_update >= 2 and not settings.TESTING:
+                        # Update progress
+                        update = dict(resize_progress=(float(resized_images_count) / float(total_images)))
+                        if progress_updates is not None:
+                            update.update(progress_updates())
+                        Task.objects.filter(pk=self.id).update(**update)
+                        self.check_if_canceled()
+                        last_update = time.time()
+            except Exception:
+                for f in futures:
+                    f.cancel()
+                raise
+
+        if gcp_file is not None:
+            try:
+                gcp_file.write(gcp_path)
+                logger.info("Resized GCP file {}".format(gcp_path))
+            except Exception as e:
+                logger.warning("Could not resize GCP file {}: {}".format(gcp_path, str(e)))
+
         resized_images = [im for im in resized_images if im is not None]
+        self.release_stored_images()
         
         Task.objects.filter(pk=self.id).update(resize_progress=1.0)
 
         return resized_images
 
-    def resize_gcp(self, resized_images):
+    def find_gcp_file(self):
         """
-        Destructively change this task's GCP file (if any)
-        by resizing the location of GCP entries.
-        :param resized_images: list of objects having "path" and "resize_ratio" keys
-            for example [{'path': 'path/to/DJI_0018.jpg', 'resize_ratio': 0.25}, ...]
-        :return: path to changed GCP file or None if no GCP file was found/changed
+        :return: path to this task's GCP file or None if there is no GCP file
         """
         gcp_path = self.find_all_files_matching(r'.*\.txt$')
 
@@ -1398,20 +1991,7 @@ class Task(models.Model):
         if len(gcp_path) == 0: return None
 
         # Assume we only have a single GCP file per task
-        gcp_path = gcp_path[0]
-
-        image_ratios = {}
-        for ri in resized_images:
-            image_ratios[os.path.basename(ri['path']).lower()] = ri['resize_ratio']
-
-        try:
-            gcpFile = GCPFile(gcp_path)
-            gcpFile.create_resized_copy(gcp_path, image_ratios)
-            logger.info("Resized GCP file {}".format(gcp_path))
-            return gcp_path
-        except Exception as e:
-            logger.warning("Could not resize GCP file {}: {}".format(gcp_path, str(e)))
-
+        return gcp_path[0]
 
     def create_task_directories(self):
         """
@@ -1446,6 +2026,7 @@ class Task(models.Model):
         dst_file = self.task_path("align.laz")
 
         if os.path.exists(dst_file):
+            self.add_to_counters(-1, -os.path.getsize(dst_file))
             os.unlink(dst_file)
 
         if os.path.exists(alignment_file):
@@ -1453,6 +2034,7 @@ class Task(models.Model):
                 os.link(alignment_file, dst_file)
             except:
                 shutil.copy(alignment_file, dst_file)
+            self.add_to_counters(1, os.path.getsize(dst_file))
         else:
             logger.warn("Cannot set alignment file for {}, {} does not exist".format(self, alignment_file))
     
@@ -1462,7 +2044,15 @@ class Task(models.Model):
             return file
 
     def handle_images_upload(self, files, chunk_info=None):
+        """
+        Write uploaded files (or chunks of a file) to the task directory
+        and update the images count and size of the task
+        :return: dictionary of filename --> size of the files that have been completed
+        """
         uploaded = {}
+        stored = {}
+        added_count = 0
+        added_bytes = 0
         for file in files:
             name = file.name
             if name is None:
@@ -1473,26 +2063,23 @@ class Task(models.Model):
                 os.makedirs(tp, exist_ok=True)
 
             if chunk_info is not None:
-                if os.path.isfile(chunk_info['tmp_upload_file']) and chunk_info['chunk_index'] == 0:
-                    os.unlink(chunk_info['tmp_upload_file'])
-                
-                with open(chunk_info['tmp_upload_file'], 'ab') as fd:
-                    fd.seek(chunk_info['byte_offset'])
-                    if isinstance(file, InMemoryUploadedFile):
-                        for chunk in file.chunks():
-                            fd.write(chunk)
-                    else:
-                        with open(file.temporary_file_path(), 'rb') as f:
-                            shutil.copyfileobj(f, fd)
-                
-                if chunk_info['chunk_index'] + 1 < chunk_info['total_chunk_count']:
-                    continue # will wait for next chunk
+                # Chunks can arrive in any order
+                if not chunk_info['upload'].write_chunk(chunk_info['chunk_index'], chunk_info['byte_offset'],
+                                                        file.chunks(), chunk_info.get('checksum')):
+                    continue # will wait for other chunks
 
             dst_path = self.get_image_path(name)
 
+            # Don't write into a file that might be hard linked
+            # from other tasks or from the image store
+            if os.path.lexists(dst_path):
+                added_bytes -= os.path.getsize(dst_path) if os.path.isfile(dst_path) else 0
+                os.unlink(dst_path)
+            else:
+                added_count += 1
+
             if chunk_info is not None:
-                if chunk_info['tmp_upload_file'] is not None and os.path.isfile(chunk_info['tmp_upload_file']):
-                    shutil.move(chunk_info['tmp_upload_file'], dst_path)
+                chunk_info['upload'].finalize(dst_path)
             else:
                 with open(dst_path, 'wb+') as fd:
                     if isinstance(file, InMemoryUploadedFile):
@@ -1503,17 +2090,90 @@ class Task(models.Model):
                             shutil.copyfileobj(f, fd)
             
             uploaded[name] = os.path.getsize(dst_path)
+            file_bytes = uploaded[name]
+
+            if settings.IMAGE_STORE and re.match(image_store.IMAGE_REGEX, name, re.IGNORECASE):
+                digest = image_store.add_file(dst_path)
+                if digest is not None:
+                    stored[name] = digest
+                    file_bytes = image_store.shared_size(dst_path, digest)
+
+            added_bytes += file_bytes
+
+        if len(stored) > 0:
+            image_store.update_manifest(self.task_path(), stored)
+
+        if len(uploaded) > 0:
+            self.add_to_counters(added_count, added_bytes)
+
         return uploaded
 
-    def update_size(self, commit=False):
+    def add_to_counters(self, images_count=0, size_bytes=0):
+        """
+        Atomically add to the images count and size of the task, so that
+        concurrent uploads don't need to list the task directory
+        (see reconcile_counters)
+        """
+        Task.objects.filter(pk=self.id).update(images_count=F('images_count') + images_count,
+                                               size=F('size') + size_bytes / 1024 / 1024)
+        self.refresh_from_db(fields=['images_count', 'size'])
+
+    def last_files_change(self):
+        """
+        :return: timestamp of the most recent change to the files
+            of the task directory, or None if it does not exist
+        """
+        tp = self.task_path()
         try:
-            total_bytes = 0
-            for dirpath, _, filenames in os.walk(self.task_path()):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if not os.path.islink(fp):
+            mtime = os.stat(tp).st_mtime
+            for e in os.scandir(tp):
+                if e.is_file(follow_symlinks=False):
+                    mtime = max(mtime, e.stat(follow_symlinks=False).st_mtime)
+            return mtime
+        except OSError:
+            return None
+
+    def reconcile_counters(self, idle_time=0):
+        """
+        Set the images count and size of the task from the files on disk
+        :param idle_time: skip the task if its files changed in the last idle_time seconds,
+            since an upload that wrote its files might not have added them to the counters yet
+        :return: True if the counters were set
+        """
+        if idle_time > 0:
+            last_change = self.last_files_change()
+            if last_change is not None and time.time() - last_change < idle_time:
+                return False
+
+        self.images_count = len(self.scan_images())
+        self.compute_size()
+        Task.objects.filter(pk=self.id).update(images_count=self.images_count, size=self.size)
+        return True
+
+    def compute_size(self):
+        """
+        Updates the size field with the size (in MB) of the files of this task
+        without saving the model or clearing the quota cache
+        """
+        total_bytes = 0
+        task_path = self.task_path()
+
+        # Images in the image store are shared with other tasks
+        manifest = image_store.read_manifest(task_path)
+
+        for dirpath, _, filenames in os.walk(task_path):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                if not os.path.islink(fp):
+                    if dirpath == task_path and f in manifest:
+                        total_bytes += image_store.shared_size(fp, manifest[f])
+                    else:
                         total_bytes += os.path.getsize(fp)
-            self.size = (total_bytes / 1024 / 1024)
+        self.size = (total_bytes / 1024 / 1024)
+
+    def update_size(self, commit=False):
+        try:
+            self.compute_size()
             if commit: self.save()
 
             self.project.owner.profile.clear_used_quota_cache()
@@ -1613,4 +2273,24 @@ class Task(models.Model):
                 redis_client.delete(lock_id)
             except redis.exceptions.RedisError:
                 # Ignore errors, the lock will expire at some point
-                pass
\ No newline at end of file
+                pass
+
+
+@receiver(signals.post_save, sender=Task, dispatch_uid="task_post_save")
+def task_post_save(sender, instance, created, **kwargs):
+    """
+    Schedule tasks for processing as soon as they need it
+    (new tasks, pending actions), instead of waiting for the next
+    process_pending_tasks iteration
+    """
+    if not settings.TASK_SCHEDULE_ON_SAVE or getattr(instance, '_processing', False) or instance.partial:
+        return
+
+    needs_processing = instance.pending_action is not None or \
+                       (instance.processing_node_id is None and instance.auto_processing_node) or \
+                       (instance.processing_node_id is not None and not instance.uuid and instance.status is None)
+
+    if needs_processing:
+        from worker.tasks import schedule_task
+        task_id = instance.id
+        transaction.on_commit(lambda: schedule_task(task_id))
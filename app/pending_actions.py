@@ -4,3 +4,4 @@ RESTART = 3
 RESIZE = 4
 IMPORT = 5
 COMPACT = 6
+DUPLICATE = 7
@@ -1,6 +1,7 @@
 import inspect
 from worker.celery import app
 from webodm import settings
+from app.classes.progress import ProgressTracker
 
 task = app.task
 
@@ -27,8 +28,14 @@ def eval_async(self, source, funcname, *args, **kwargs):
     eval(code, ns, ns)
 
     if kwargs.get("with_progress"):
-        def progress_callback(status, perc):
-            self.update_state(state="PROGRESS", meta={"status": status, "progress": perc})
+        progress = ProgressTracker(lambda status, perc, **meta: self.update_state(state="PROGRESS", meta={"status": status, "progress": perc, **meta}),
+                                   interval=0)
+        def progress_callback(status, perc, **counters):
+            stage = counters.pop('stage', None)
+            if stage is not None and stage != progress.stage:
+                progress.start_stage(stage)
+            progress.set(perc)
+            progress.update(status, **counters)
         kwargs['progress_callback'] = progress_callback
         del kwargs['with_progress']
 
@@ -1,38 +1,91 @@
 import logging
+import math
 import os
 import subprocess
 import json
+import time
+import tempfile
+import struct
+import shutil
 import rasterio
+import numpy as np
+from functools import lru_cache
 from app.geoutils import geom_transform_wkt_bbox
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, LineString
 from app.security import double_quote
 from osgeo import osr
+from app.classes.progress import ProgressTracker
+from app.classes.las import LASHeader, LASHeaderError
+from webodm import settings
 
 logger = logging.getLogger('app.logger')
 
-def export_pointcloud(input, output, **opts):
+def export_pointcloud(input, output, progress_callback=None, **opts):
+    progress = ProgressTracker(progress_callback)
+    progress.start_stage("prepare")
+    progress.update("Preparing", force=True)
+
     epsg = opts.get('epsg')
     proj = opts.get('proj')
     export_format = opts.get('format')
     resample = float(opts.get('resample', 0))
     crop_wkt = opts.get('crop')
     crop_reference = opts.get('crop_reference')
+    streaming = opts.get('streaming', settings.POINTCLOUD_EXPORT_STREAMING)
 
-    resample_args = []
-    reprojection_args = []
-    extra_args = []
-    crop_args = []
+    out_srs = None
+    cutline = None
 
     if epsg:
-        reprojection_args = ["reprojection",
-                            "--filters.reprojection.out_srs=%s" % double_quote("EPSG:" + str(epsg))]
+        out_srs = "EPSG:" + str(epsg)
     elif proj:
         srs = osr.SpatialReference()
         if srs.ImportFromProj4(proj) != 0:
             raise Exception(f"Invalid PROJ string: {proj}")
+        out_srs = proj
+
+    if crop_wkt is not None and crop_reference is not None:
+        with rasterio.open(crop_reference) as ds:
+            crop = GEOSGeometry(crop_wkt)
+            crop.srid = 4326
+            cutline, bounds = geom_transform_wkt_bbox(crop, ds, wkt_crs="projected")
+
+    now = time.time()
+    progress.start_stage("translate")
+    progress.update("Translating point cloud", 5, force=True)
+
+    if streaming:
+        pipeline = build_pointcloud_pipeline(input, output, export_format=export_format, resample=resample, out_srs=out_srs, cutline=cutline)
+        input_size = os.path.getsize(input)
+
+        def pipeline_progress(bytes_read):
+            # Reading the input is the bulk of the work
+            progress.set(5 + 90 * min(1.0, bytes_read / input_size) if input_size > 0 else 5)
+            progress.update("Translating point cloud")
+
+        run_pdal_pipeline(pipeline, stream=is_pipeline_streamable(pipeline), progress_callback=pipeline_progress)
+    else:
+        run_pdal_translate(input, output, export_format=export_format, resample=resample, out_srs=out_srs, cutline=cutline)
+
+    logger.info("Exported {} in {}s ({})".format(output, round(time.time() - now, 2), "streaming pipeline" if streaming else "pdal translate"))
+
+    progress.end_stage()
+    progress.set(100)
+    progress.update("Done", force=True,
+                    bytes_read=os.path.getsize(input),
+                    bytes_written=os.path.getsize(output) if os.path.isfile(output) else 0)
+
+
+def run_pdal_translate(input, output, export_format=None, resample=0, out_srs=None, cutline=None):
+    resample_args = []
+    reprojection_args = []
+    extra_args = []
+    crop_args = []
+
+    if out_srs is not None:
         reprojection_args = ["reprojection",
-                            "--filters.reprojection.out_srs=%s" % proj]
-        
+                            "--filters.reprojection.out_srs=%s" % (double_quote(out_srs) if out_srs.startswith("EPSG:") else out_srs)]
+
     if export_format == "ply":
         extra_args = ['--writers.ply.dims', 'X,Y,Z,Red,Green,Blue',
                       '--writers.ply.sized_types', 'false',
@@ -40,25 +93,370 @@ def export_pointcloud(input, output, **opts):
 
     if resample > 0:
         resample_args = ['sample', '--filters.sample.radius=%s' % resample]
-    
-    if crop_wkt is not None and crop_reference is not None:
-        with rasterio.open(crop_reference) as ds:
-            crop = GEOSGeometry(crop_wkt)
-            crop.srid = 4326
-            cutline, bounds = geom_transform_wkt_bbox(crop, ds, wkt_crs="projected")
 
+    if cutline is not None:
         crop_args =  ['crop', "--filters.crop.polygon=%s" % cutline]
 
     subprocess.check_output(["pdal", "translate", input, output] + resample_args + reprojection_args + crop_args + extra_args)
 
 
-def is_pointcloud_georeferenced(laz_path):
+# Stages that cannot process points in fixed-size chunks
+NON_STREAMABLE_STAGES = ["filters.sample", "writers.ply"]
+
+def build_pointcloud_pipeline(input, output, export_format=None, resample=0, out_srs=None, cutline=None):
+    """
+    Build a PDAL pipeline (list of stages) equivalent to the
+    pdal translate invocation used for exports
+    """
+    pipeline = [{"type": "readers.las", "filename": input}]
+
+    if resample > 0:
+        pipeline.append({"type": "filters.sample", "radius": resample})
+
+    if out_srs is not None:
+        pipeline.append({"type": "filters.reprojection", "out_srs": out_srs})
+
+    if cutline is not None:
+        pipeline.append({"type": "filters.crop", "polygon": cutline})
+
+    if export_format == "ply":
+        pipeline.append({"type": "writers.ply",
+                         "filename": output,
+                         "dims": "X,Y,Z,Red,Green,Blue",
+                         "sized_types": False,
+                         "storage_mode": "little endian"})
+    else:
+        # Writer is inferred from the extension
+        pipeline.append({"filename": output})
+
+    return pipeline
+
+
+def is_pipeline_streamable(pipeline):
+    return not any([stage.get("type") in NON_STREAMABLE_STAGES for stage in pipeline])
+
+
+def get_process_bytes_read(pid):
+    """
+    :return: number of bytes read so far by a process (Linux only) or None
+    """
+    try:
+        with open("/proc/{}/io".format(pid), "r") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split(":")[1])
+    except (IOError, ValueError):
+        pass
+
+    return None
+
+
+def run_pdal_pipeline(pipeline, stream=True, progress_callback=None, poll_interval=0.5, timeout=None):
+    """
+    Execute a PDAL pipeline. In stream mode points are processed
+    in fixed-size chunks, so memory usage stays constant regardless of
+    the size of the point cloud.
+    :param pipeline: list of PDAL stages
+    :param stream: run in stream mode (all stages must be streamable)
+    :param progress_callback: optional function(bytes_read) called periodically
+    :param timeout: optional number of seconds after which PDAL is terminated
+        (raising subprocess.TimeoutExpired)
+    """
+    params = ["pdal", "pipeline", "--stdin"]
+    if stream:
+        params.append("--stream")
+
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(params, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err)
+        proc.stdin.write(json.dumps({"pipeline": pipeline}).encode("utf-8"))
+        proc.stdin.close()
+        start = time.time()
+
+        while True:
+            try:
+                proc.wait(timeout=poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                if timeout is not None and time.time() - start > timeout:
+                    proc.kill()
+                    proc.wait()
+                    raise subprocess.TimeoutExpired(params, timeout)
+
+                if progress_callback is not None:
+                    bytes_read = get_process_bytes_read(proc.pid)
+                    if bytes_read is not None:
+                        progress_callback(bytes_read)
+
+        if proc.returncode != 0:
+            err.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, params, stderr=err.read())
+
+
+@lru_cache(maxsize=None)
+def get_pdal_drivers():
+    """
+    :return: set of stage names supported by the installed PDAL
+    """
+    try:
+        drivers = json.loads(subprocess.check_output(["pdal", "--drivers", "--showjson"], stderr=subprocess.DEVNULL))
+        return set([d.get('name') for d in drivers if isinstance(d, dict)])
+    except Exception as e:
+        logger.warning("Cannot list PDAL drivers: %s" % str(e))
+        return set()
+
+
+def has_pdal_driver(name):
+    return name in get_pdal_drivers()
+
+
+def build_copc(input, output, threads=1):
+    """
+    Convert a LAS/LAZ point cloud to a single-file Cloud Optimized Point Cloud (COPC).
+    The output is written to a temporary file first, so a partial file
+    is never left in place of the result.
+    :param threads: number of threads used by writers.copc
+    :return: True on success
+    """
+    if not has_pdal_driver("writers.copc"):
+        logger.warning("Cannot create COPC, writers.copc is not available in this version of PDAL")
+        return False
+
+    tmp_output = output + ".part"
+    pipeline = [{"type": "readers.las", "filename": input},
+                {"type": "writers.copc", "filename": tmp_output, "threads": max(1, threads)}]
+    try:
+        run_pdal_pipeline(pipeline, stream=False)
+        shutil.move(tmp_output, output)
+        return True
+    finally:
+        if os.path.isfile(tmp_output):
+            os.remove(tmp_output)
+
+
+def get_pointcloud_reader(path):
+    """
+    :return: PDAL reader for a point cloud file
+    """
+    if path.endswith("ept.json"):
+        return "readers.ept"
+    elif path.endswith(".copc.laz"):
+        return "readers.copc"
+    else:
+        return "readers.las"
+
+
+def is_indexed_pointcloud(input):
+    """
+    :return: True if the point cloud can be read by area (EPT or COPC)
+    """
+    return get_pointcloud_reader(input) in ["readers.ept", "readers.copc"]
+
+
+class CrossSectionTooLargeError(Exception):
+    pass
+
+
+def cross_section_resolution(area, pointcloud_info, max_points, resolution=None):
+    """
+    Estimate the point spacing needed to extract at most max_points
+    from an area, assuming that points are evenly distributed
+    within the bounds of the point cloud
+    :param area: area of the corridor (in point cloud units)
+    :param pointcloud_info: dictionary with "points" and "bounds" keys (see read_pointcloud_info)
+    :param resolution: requested point spacing (or None for all points)
+    :return: point spacing to use (resolution, or a coarser one)
+    """
+    points = pointcloud_info.get('points')
+    bounds = pointcloud_info.get('bounds')
+    if not points or not bounds or area <= 0:
+        return resolution
+
+    minx, miny, _, maxx, maxy, _ = bounds
+    extent_area = max(maxx - minx, 0) * max(maxy - miny, 0)
+    if extent_area <= 0:
+        return resolution
+
+    expected = points * min(1.0, area / extent_area)
+    if resolution:
+        expected = min(expected, area / (resolution ** 2))
+
+    if expected <= max_points:
+        return resolution
+    return math.sqrt(area / max_points)
+
+
+def build_cross_section_pipeline(input, corridor_wkt, output, resolution=None):
+    """
+    Build a PDAL pipeline that extracts the points within a polygon.
+    With EPT and COPC inputs the reader only visits the octree nodes
+    intersecting the polygon, down to the depth needed for the requested resolution.
+    :param input: path to a ept.json, .copc.laz or .las/.laz file
+    :param corridor_wkt: polygon (in the coordinate system of the point cloud)
+    :param output: .las or .laz file to write
+    :param resolution: optional point spacing (in point cloud units)
+    """
+    reader = {"type": get_pointcloud_reader(input), "filename": input}
+
+    if is_indexed_pointcloud(input):
+        reader["polygon"] = corridor_wkt
+        if resolution:
+            reader["resolution"] = resolution
+        pipeline = [reader]
+    else:
+        # No index, every point needs to be read
+        pipeline = [reader, {"type": "filters.crop", "polygon": corridor_wkt}]
+        if resolution:
+            pipeline.append({"type": "filters.sample", "radius": resolution})
+
+    # Compression is inferred from the extension
+    pipeline.append({"type": "writers.las", "filename": output})
+    return pipeline
+
+
+def read_las_xyz(path):
+    """
+    Read the coordinates of an uncompressed LAS file
+    :return: (N, 3) float64 array
+    """
+    header = LASHeader(path)
+    if header.compressed:
+        raise LASHeaderError("%s is compressed" % path)
+
+    dtype = np.dtype({'names': ['X', 'Y', 'Z'],
+                      'formats': ['<i4', '<i4', '<i4'],
+                      'offsets': [0, 4, 8],
+                      'itemsize': header.point_record_length})
+    records = np.fromfile(path, dtype=dtype, count=header.point_count, offset=header.point_data_offset)
+
+    xyz = np.empty((len(records), 3), dtype=np.float64)
+    for i, d in enumerate(['X', 'Y', 'Z']):
+        xyz[:, i] = records[d] * header.scale[i] + header.offset[i]
+    return xyz
+
+
+def compute_stations(xy, line):
+    """
+    Project points onto a polyline
+    :param xy: (N, 2) array of point coordinates
+    :param line: list of (x, y) vertices
+    :return: (N, ) array with the distance along the polyline of each point's projection
+    """
+    line = np.asarray(line, dtype=np.float64)
+    stations = np.zeros(len(xy), dtype=np.float64)
+    best = np.full(len(xy), np.inf)
+    start_station = 0.0
+
+    for a, b in zip(line[:-1], line[1:]):
+        seg = b - a
+        seg_len_sq = seg.dot(seg)
+        seg_len = np.sqrt(seg_len_sq)
+        if seg_len_sq == 0:
+            continue
+
+        t = np.clip(((xy - a) @ seg) / seg_len_sq, 0, 1)
+        dist_sq = ((a + t[:, np.newaxis] * seg - xy) ** 2).sum(axis=1)
+        closer = dist_sq < best
+        best[closer] = dist_sq[closer]
+        stations[closer] = start_station + t[closer] * seg_len
+        start_station += seg_len
+
+    return stations
+
+
+def extract_cross_section(input, line, width, resolution=None, export_format="binary", tmp_dir=None,
+                          max_points=None, pointcloud_info=None, timeout=None):
+    """
+    Extract the points within a corridor around a polyline
+    :param input: path to a ept.json, .copc.laz or .las/.laz file
+    :param line: list of (x, y) vertices, in the coordinate system of the point cloud
+    :param width: width of the corridor (in point cloud units)
+    :param resolution: optional point spacing (in point cloud units)
+    :param export_format: "binary" or "laz"
+    :param tmp_dir: directory to store intermediate files
+    :param max_points: optional maximum number of points to extract. The point spacing
+        is coarsened (based on pointcloud_info) so that the section stays below it
+    :param pointcloud_info: point count and bounds of the point cloud (see read_pointcloud_info)
+    :param timeout: optional number of seconds after which the extraction is aborted
+    :return: (bytes, point count, origin, resolution) where for "binary" bytes contains
+        little endian float32 (x, y, z, station) tuples, with x, y, z relative to origin
+        and resolution is the point spacing that was used
+    :raise CrossSectionTooLargeError: if the section has more than max_points
+    :raise subprocess.TimeoutExpired: if the extraction took longer than timeout
+    """
+    corridor = LineString([(float(x), float(y)) for x, y in line]).buffer(width / 2.0)
+    ext = "laz" if export_format == "laz" else "las"
+
+    if max_points is not None and pointcloud_info is not None:
+        resolution = cross_section_resolution(corridor.area, pointcloud_info, max_points, resolution)
+
+    tmp_dir = tempfile.mkdtemp('_section', dir=tmp_dir)
+    try:
+        output = os.path.join(tmp_dir, "section.%s" % ext)
+        pipeline = build_cross_section_pipeline(input, corridor.wkt, output, resolution=resolution)
+        run_pdal_pipeline(pipeline, stream=is_pipeline_streamable(pipeline), timeout=timeout)
+
+        # Points are not evenly distributed, the estimate can be off
+        header = LASHeader(output)
+        if max_points is not None and header.point_count > max_points:
+            raise CrossSectionTooLargeError("The section has %s points (maximum %s)" % (header.point_count, max_points))
+
+        if export_format == "laz":
+            with open(output, "rb") as f:
+                return f.read(), header.point_count, None, resolution
+
+        xyz = read_las_xyz(output)
+        if len(xyz) > 0:
+            origin = xyz.min(axis=0)
+        else:
+            origin = np.zeros(3)
+
+        data = np.empty((len(xyz), 4), dtype='<f4')
+        data[:, 0:3] = xyz - origin
+        data[:, 3] = compute_stations(xyz[:, 0:2], line)
+        return data.tobytes(), len(xyz), origin.tolist(), resolution
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_pointcloud_info(laz_path):
+    """
+    Read point count, bounds and spatial reference information
+    from the LAS/LAZ header (without reading any points)
+    :return: dict, with a "georeferenced" key that is None
+        if the header alone is not enough to decide
+    """
+    st = os.stat(laz_path)
+    try:
+        info = LASHeader(laz_path).to_dict()
+    except (LASHeaderError, IOError, struct.error) as e:
+        logger.warning("Cannot read LAS header of %s: %s" % (laz_path, str(e)))
+        info = {'georeferenced': None}
+
+    info['size'] = st.st_size
+    info['mtime'] = st.st_mtime
+    return info
+
+
+def is_pointcloud_georeferenced(laz_path, info=None):
+    """
+    :param info: optional point cloud information (see read_pointcloud_info).
+        If the header is ambiguous, the result of PDAL is stored in it
+        (under the "georeferenced" key) so that PDAL runs only once
+    """
     if not os.path.isfile(laz_path):
         return False
 
+    if info is None:
+        info = read_pointcloud_info(laz_path)
+
+    if info.get('georeferenced') is not None:
+        return info['georeferenced']
+
+    # Ambiguous, ask PDAL
     try:
         j = json.loads(subprocess.check_output(["pdal", "info", "--summary", laz_path]))
-        return 'summary' in j and 'srs' in j['summary']
+        info['georeferenced'] = 'summary' in j and 'srs' in j['summary']
+        return info['georeferenced']
     except Exception as e:
         logger.warning(e)
-        return True # Assume georeferenced
+        return True # Assume georeferenced (and try again next time)
@@ -15,6 +15,8 @@ from rio_tiler.colormap import cmap as colormap, apply_cmap
 from rio_tiler.errors import InvalidColorMapName
 from app.api.hsvblend import hsv_blend
 from app.api.hillshade import LightSource
+from app.kmz import write_kmz
+from app.classes.progress import ProgressTracker
 from rio_tiler.io import COGReader
 from webodm import settings
 
@@ -91,20 +93,10 @@ def padded_window(w, pad):
 def export_raster(input, output, progress_callback=None, **opts):
     now = time.time()
 
-    current_progress = 0
-    last_update = 0
+    progress = ProgressTracker(progress_callback)
 
-    def p(text, perc=0):
-        nonlocal current_progress
-        nonlocal last_update
-
-        t = time.time()
-        current_progress += perc
-
-        if t - last_update >= 1:
-            if progress_callback is not None:
-                progress_callback(text, current_progress)
-            last_update = t
+    def p(text, perc=0, **counters):
+        progress.update(text, perc, **counters)
 
     epsg = opts.get('epsg')
     proj = opts.get('proj')
@@ -124,6 +116,7 @@ def export_raster(input, output, progress_callback=None, **opts):
         resampling = 'bilinear'
 
     if crop_wkt is not None:
+        progress.start_stage("crop")
         crop = GEOSGeometry(crop_wkt)
 
         crop_geojson = os.path.join(path_base, "crop.geojson")
@@ -158,8 +151,8 @@ def export_raster(input, output, progress_callback=None, **opts):
         jpg_background = 255 # white
         reproject = src.crs is not None and ((epsg is not None and src.crs.to_epsg() != epsg) or proj is not None)
 
-        # KMZ is special, we just export it as GeoTIFF
-        # and then call GDAL to tile/package it
+        # KMZ is special, we stage it as a RGB GeoTIFF
+        # and then tile/package it in-process
         kmz = export_format == "kmz"
         if kmz:
             export_format = "gtiff-rgb"
@@ -222,6 +215,7 @@ def export_raster(input, output, progress_callback=None, **opts):
             nodata = None
             if asset_type == 'orthophoto':
                 nodata = 0
+            progress.start_stage("statistics")
             md = ds_src.metadata(pmin=2.0, pmax=98.0, hist_options={"bins": 255}, nodata=nodata)
             rescale = [md['statistics']['1']['min'], md['statistics']['1']['max']]
 
@@ -303,6 +297,15 @@ def export_raster(input, output, progress_callback=None, **opts):
         num_wins = len(subwins)
         progress_per_win = (100 - post_perc) / num_wins if num_wins > 0 else 0
 
+        def pw(idx, w):
+            # Uncompressed pixel bytes read from the source and written to the output
+            pixels = int(w.width) * int(w.height)
+            p(f"Processing tile {idx}/{num_wins}", progress_per_win, windows=1,
+              bytes_read=pixels * len(indexes) * np.dtype(src.dtypes[0]).itemsize,
+              bytes_written=pixels * profile['count'] * np.dtype(profile['dtype']).itemsize)
+
+        progress.start_stage("windows")
+
         if expression is not None:
             # Apply band math
             if rgb:
@@ -319,7 +322,7 @@ def export_raster(input, output, progress_callback=None, **opts):
 
             with rasterio.open(output_raster, 'w', **profile) as dst:
                 for idx, (w, dst_w) in enumerate(subwins):
-                    p(f"Processing tile {idx}/{num_wins}", progress_per_win)
+                    pw(idx, w)
 
                     data = src.read(indexes=indexes, window=w, out_dtype=np.float32)
                     arr = dict(zip(bands_names, data))
@@ -360,7 +363,7 @@ def export_raster(input, output, progress_callback=None, **opts):
                     dst.units = units
 
                 for idx, (w, dst_w) in enumerate(subwins):
-                    p(f"Processing tile {idx}/{num_wins}", progress_per_win)
+                    pw(idx, w)
 
                     # Apply colormap?
                     if rgb and cmap is not None:
@@ -412,7 +415,7 @@ def export_raster(input, output, progress_callback=None, **opts):
             # Copy bands as-is
             with rasterio.open(output_raster, 'w', **profile) as dst:
                 for idx, (w, dst_w) in enumerate(subwins):
-                    p(f"Processing tile {idx}/{num_wins}", progress_per_win)
+                    pw(idx, w)
 
                     arr = src.read(indexes=indexes, window=w)
                     dst.write(process(arr, drop_last_band=not with_alpha), window=dst_w)
@@ -424,12 +427,23 @@ def export_raster(input, output, progress_callback=None, **opts):
                 dst.colorinterp = new_ci
         
         if kmz:
-            subprocess.check_output(["gdal_translate", "-of", "KMLSUPEROVERLAY", 
-                                        "-co", "Name={}".format(name),
-                                        "-co", "FORMAT=AUTO", output_raster, output])
-            p("Finalizing", post_perc)
+            progress.start_stage("packaging")
+            kmz_perc = 0
+            def kmz_progress(done, total):
+                nonlocal kmz_perc
+                perc = post_perc * done / total
+                p(f"Packaging tile {done}/{total}", perc - kmz_perc)
+                kmz_perc = perc
+
+            write_kmz(output_raster, output, name=name, resampling=resampling, progress_callback=kmz_progress)
+
+            if os.path.isfile(output_raster):
+                os.unlink(output_raster)
+
+            p("Finalizing", post_perc - kmz_perc, bytes_written=os.path.getsize(output))
 
         elif reproject:
+            progress.start_stage("reprojection")
             output_vrt = path_base + ".vrt"
 
             if epsg is not None:
@@ -462,7 +476,9 @@ def export_raster(input, output, progress_callback=None, **opts):
             if os.path.isfile(output_raster):
                 os.unlink(output_raster)
 
-            p("Finalizing", post_perc)
-            
-        logger.info(f"Exported {output} in {round(time.time() - now, 2)}s")
+            p("Finalizing", post_perc, bytes_written=os.path.getsize(output))
+
+        progress.end_stage()
+        p("Done", force=True)
+        logger.info(f"Exported {output} in {round(time.time() - now, 2)}s ({progress.meta()['stages']})")
         
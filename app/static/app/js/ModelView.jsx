@@ -251,6 +251,13 @@ class ModelView extends React.Component {
   }
 
   pointCloudFilePath = (cb) => {
+    // Prefer a single-file COPC point cloud (fetched via range requests)
+    // if this build of Potree can read it
+    if (this.props.task.available_assets.indexOf('georeferenced_model.copc.laz') !== -1 && Potree.CopcLoader !== undefined){
+      cb(this.assetsPath() + '/odm_georeferencing/odm_georeferenced_model.copc.laz');
+      return;
+    }
+
     // Check if entwine point cloud exists, 
     // otherwise fallback to potree point cloud binary format path
     const entwinePointCloud = this.assetsPath() + '/entwine_pointcloud/ept.json';
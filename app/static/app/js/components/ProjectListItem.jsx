@@ -150,6 +150,24 @@ class ProjectListItem extends React.Component {
           chunkSize: 8000000, // 8MB,
           retryChunks: true,
           retryChunksLimit: 20,
+          parallelChunkUploads: true,
+          chunksUploaded: (file, done) => {
+            // Chunks are uploaded in parallel, so the response
+            // of the chunk that completed the file is not necessarily the last one
+            for (let i = 0; i < file.upload.chunks.length; i++){
+              const xhr = file.upload.chunks[i].xhr;
+              try{
+                const res = JSON.parse(xhr.response);
+                if (Object.keys(res.uploaded || {}).length > 0){
+                  file.xhr = xhr;
+                  break;
+                }
+              }catch(e){
+                // Skip
+              }
+            }
+            done();
+          },
           
           headers: {
             [csrf.header]: csrf.token
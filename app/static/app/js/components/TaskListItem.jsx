@@ -74,6 +74,9 @@ class TaskListItem extends React.Component {
   shouldRefresh(){
     if (this.state.task.pending_action !== null) return true;
 
+    // Point cloud viewer data is built after completion
+    if (this.state.task.ept_state === "building") return true;
+
     // If a task is completed, or failed, etc. we don't expect it to change
     if ([statusCodes.COMPLETED, statusCodes.FAILED, statusCodes.CANCELED].indexOf(this.state.task.status) !== -1) return false;
 
@@ -501,14 +504,16 @@ class TaskListItem extends React.Component {
                     ([pendingActions.CANCEL,
                       pendingActions.REMOVE,
                       pendingActions.COMPACT,
+                      pendingActions.DUPLICATE,
                       pendingActions.RESTART].indexOf(task.pending_action) !== -1);
     const editable = this.props.hasPermission("change") && [statusCodes.FAILED, statusCodes.COMPLETED, statusCodes.CANCELED].indexOf(task.status) !== -1;
     const actionLoading = this.state.actionLoading;
-    const showAssetButtons = task.status === statusCodes.COMPLETED;
+    const showAssetButtons = task.status === statusCodes.COMPLETED && task.pending_action !== pendingActions.DUPLICATE;
     
     let expanded = "";
     if (this.state.expanded){
       let showOrthophotoMissingWarning = false,
+          showEptWarning = false,
           showMemoryErrorWarning = this.state.memoryError && task.status == statusCodes.FAILED && window.location.hostname.indexOf("webodm.net") === -1,
           showTaskWarning = this.state.friendlyTaskError !== "" && task.status == statusCodes.FAILED,
           showExitedWithCodeOneHints = task.last_error === "Process exited with code 1" &&
@@ -534,11 +539,23 @@ class TaskListItem extends React.Component {
         }
 
         if (task.available_assets.indexOf("georeferenced_model.laz") !== -1 || 
+            task.available_assets.indexOf("georeferenced_model.copc.laz") !== -1 ||
             task.available_assets.indexOf("textured_model.glb") !== -1 ||
             task.available_assets.indexOf("textured_model.zip") !== -1){
-          addActionButton(" " + _("3D Model"), "btn-primary", "fa fa-cube fa-fw", () => {
-            location.href = `/3d/project/${task.project}/task/${task.id}/`;
-          });
+          // Point clouds (without a textured model) can be viewed once their EPT data is built
+          // (the viewer cannot load COPC files)
+          const pointCloudOnly = task.available_assets.indexOf("textured_model.glb") === -1 &&
+                                 task.available_assets.indexOf("textured_model.zip") === -1;
+
+          if (pointCloudOnly && task.ept_state === "building"){
+            addActionButton(" " + _("Building 3D Model..."), "btn-primary", "fa fa-circle-notch fa-spin fa-fw", () => {}, { disabled: true });
+          }else if (!pointCloudOnly || task.ept_state === "ready"){
+            addActionButton(" " + _("3D Model"), "btn-primary", "fa fa-cube fa-fw", () => {
+              location.href = `/3d/project/${task.project}/task/${task.id}/`;
+            });
+          }
+
+          if (task.ept_state === "failed") showEptWarning = true;
         }
 
         if (task.available_assets.indexOf("report.pdf") !== -1){ 
@@ -611,7 +628,7 @@ class TaskListItem extends React.Component {
               const subItems = button.options.subItems || [];
               const className = button.options.className || "";
 
-              let buttonHtml = (<button title={button.label} type="button" className={"btn btn-sm " + button.className} onClick={button.onClick} disabled={disabled}>
+              let buttonHtml = (<button title={button.label} type="button" className={"btn btn-sm " + button.className} onClick={button.onClick} disabled={disabled || button.options.disabled}>
                                 <i className={button.icon}></i>
                                 <span className="hidden-xs hidden-sm">{button.label}</span>
                             </button>);
@@ -732,6 +749,9 @@ class TaskListItem extends React.Component {
               {showOrthophotoMissingWarning ?
               <div className="task-warning"><i className="fa fa-exclamation-triangle"></i> <span>{_("An orthophoto could not be generated. To generate one, make sure GPS information is embedded in the EXIF tags of your images, or use a Ground Control Points (GCP) file.")}</span></div> : ""}
 
+              {showEptWarning ?
+              <div className="task-warning"><i className="fa fa-exclamation-triangle"></i> <span>{_("The point cloud could not be prepared for the 3D viewer. Check the server logs for details.")}</span></div> : ""}
+
               {showMemoryErrorWarning ?
               <div className="task-warning"><i className="fa fa-support"></i> <Trans params={{ memlink: `<a href="${memoryErrorLink}" target='_blank'>${_("enough RAM allocated")}</a>`, cloudlink: `<a href='https://webodm.net' target='_blank'>${_("cloud processing node")}</a>` }}>{_("It looks like your processing node ran out of memory. If you are using docker, make sure that your docker environment has %(memlink)s. Alternatively, make sure you have enough physical RAM, reduce the number of images, make your images smaller, or reduce the max-concurrency parameter from the task's options. You can also try to use a %(cloudlink)s.")}</Trans></div> : ""}
 
@@ -802,6 +822,9 @@ class TaskListItem extends React.Component {
 
       if (task.pending_action === pendingActions.RESIZE){
           progress = task.resize_progress * 100;
+      }else if (task.pending_action === pendingActions.DUPLICATE){
+          progress = task.running_progress * 100;
+          type = 'neutral';
       }else if (task.status === null){
           progress = task.upload_progress * 100;
       }else if (task.status === statusCodes.RUNNING){
@@ -812,7 +835,7 @@ class TaskListItem extends React.Component {
           type = 'neutral';
       }
 
-      if (task.pending_action === pendingActions.COMPACT){
+      if (task.pending_action === pendingActions.COMPACT || task.pending_action === pendingActions.DUPLICATE){
         statusIcon = 'fa fa-cog fa-spin fa-fw';
       }
 
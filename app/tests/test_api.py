@@ -180,6 +180,13 @@ class TestApi(BootTestCase):
         res = client.get('/api/projects/{}/tasks/{}/output/?line=0&limit=-2&f=raw'.format(project.id, task.id))
         self.assertEqual(res.content.decode("utf-8"), "line2\nline3")
 
+        # Trailing blank lines are left out
+        task.console += "\n\n  \n"
+        res = client.get('/api/projects/{}/tasks/{}/output/?line=0&limit=-2&f=json'.format(project.id, task.id))
+        j = res.json()
+        self.assertEqual(j['lines'], ["line2", "line3"])
+        self.assertEqual(j['count'], 3)
+
         # Cannot list task details for a task belonging to a project we don't have access to
         res = client.get('/api/projects/{}/tasks/{}/'.format(other_project.id, other_task.id))
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,93 @@
+import os
+import json
+import subprocess
+from unittest import mock
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from app.models import Project, Task
+from app.pointcloud_utils import CrossSectionTooLargeError
+from .classes import BootTestCase
+from .utils import clear_test_media_root
+from webodm import settings
+
+
+class TestApiPointcloud(BootTestCase):
+    def tearDown(self):
+        clear_test_media_root()
+
+    def write_asset(self, task, *path):
+        p = task.assets_path(*path)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, 'wb') as f:
+            f.write(b"test")
+
+    def test_cross_section(self):
+        client = APIClient()
+        project = Project.objects.get(name="User Test Project")
+        task = Task.objects.create(project=project, name="Test")
+        url = "/api/projects/{}/tasks/{}/3d/section".format(project.id, task.id)
+        line = [[0, 0], [10, 0]]
+
+        # Need to be logged in
+        res = client.post(url, {'line': line}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        client.login(username="testuser", password="test1234")
+
+        # No point cloud
+        res = client.post(url, {'line': line}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Point cloud, but no index yet
+        self.write_asset(task, task.ASSETS_MAP["georeferenced_model.laz"])
+        res = client.post(url, {'line': line}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.write_asset(task, task.EPT_FILE)
+
+        # Invalid parameters
+        for params in [{}, {'line': [[0, 0]]}, {'line': "abc"},
+                       {'line': line, 'width': 0},
+                       {'line': line, 'width': settings.POINTCLOUD_SECTION_MAX_WIDTH + 1},
+                       {'line': line, 'resolution': -1},
+                       {'line': line, 'format': 'ply'},
+                       {'line': [[0, 0], [settings.POINTCLOUD_SECTION_MAX_LENGTH + 1, 0]]}]:
+            res = client.post(url, params, format="json")
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+        with mock.patch('app.api.pointcloud.extract_cross_section', return_value=(b"data", 1, [1, 2, 3], 0.5)) as extract:
+            res = client.post(url, {'line': line, 'width': 2}, format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.content, b"data")
+            self.assertEqual(res['X-Point-Count'], "1")
+            self.assertEqual(json.loads(res['X-Origin']), [1, 2, 3])
+            self.assertEqual(json.loads(res['X-Resolution']), 0.5)
+
+            args, kwargs = extract.call_args
+            self.assertEqual(args[0], task.assets_path(task.EPT_FILE))
+            self.assertEqual(args[1], [(0, 0), (10, 0)])
+            self.assertEqual(args[2], 2)
+            self.assertEqual(kwargs['max_points'], settings.POINTCLOUD_SECTION_MAX_POINTS)
+            self.assertEqual(kwargs['timeout'], settings.POINTCLOUD_SECTION_TIMEOUT)
+
+            extract.return_value = (b"laz", 1, None, None)
+            res = client.post(url, {'line': line, 'format': 'laz'}, format="json")
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertTrue("section.laz" in res['Content-Disposition'])
+            self.assertEqual(json.loads(res['X-Resolution']), None)
+
+            # Too many points, timeouts and PDAL errors
+            for err in [CrossSectionTooLargeError("too large"),
+                        subprocess.TimeoutExpired(["pdal"], 60),
+                        subprocess.CalledProcessError(1, ["pdal"])]:
+                extract.side_effect = err
+                res = client.post(url, {'line': line}, format="json")
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Other users cannot extract sections
+        client.logout()
+        client.login(username="testuser2", password="test1234")
+        res = client.post(url, {'line': line}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -4,13 +4,17 @@ import shutil
 import subprocess
 
 import io
+import json
+import zipfile
 import requests
+from unittest import mock
 from django.contrib.auth.models import User
 from guardian.shortcuts import remove_perm, assign_perm
 from rest_framework import status
 from rest_framework.test import APIClient
 
 import worker
+from app import backup
 from app.cogeo import valid_cogeo
 from app.models import Project
 from app.models import Task
@@ -79,8 +83,23 @@ class TestApiTask(BootTransactionTestCase):
             res = client.get("/api/projects/{}/tasks/{}/assets/entwine_pointcloud/ept.json".format(project.id, task.id))
             self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
+            # Nothing is building it
+            res = client.get("/api/projects/{}/tasks/{}/".format(project.id, task.id))
+            self.assertIsNone(res.data['ept_state'])
+            self.assertTrue('georeferenced_model.laz' in res.data['available_assets'])
+            self.assertFalse('ept.json' in res.data['available_assets'])
+
+            # The viewer shows that it's being built once a build is queued
+            with mock.patch('worker.tasks.build_ept.delay') as build_ept:
+                self.assertTrue(task.schedule_ept())
+                self.assertEqual(build_ept.call_count, 1)
+            res = client.get("/api/projects/{}/tasks/{}/".format(project.id, task.id))
+            self.assertEqual(res.data['ept_state'], "building")
+
             # Rebuild it
-            self.assertTrue(task.check_ept())
+            worker.tasks.build_ept(task.id)
+            self.assertEqual(task.get_ept_state(), "ready")
+            self.assertFalse(os.path.isfile(task.data_path(task.EPT_QUEUED_FILE)))
 
             # EPT available again
             res = client.get("/api/projects/{}/tasks/{}/assets/entwine_pointcloud/ept.json".format(project.id, task.id))
@@ -136,9 +155,9 @@ class TestApiTask(BootTransactionTestCase):
             res = client.get("/api/projects/{}/tasks/{}/assets/odm_orthophoto/odm_orthophoto.tif".format(project.id, file_import_task.id))
             self.assertEqual(res.status_code, status.HTTP_200_OK)
 
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["orthophoto.tif"])))
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dsm.tif"])))
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dtm.tif"])))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["orthophoto.tif"]), full_check=True))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dsm.tif"]), full_check=True))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dtm.tif"]), full_check=True))
 
             # Set task public so we can download from it without auth
             file_import_task.public = True
@@ -299,8 +318,50 @@ class TestApiTask(BootTransactionTestCase):
 
             assets_path = os.path.join(settings.MEDIA_TMP, "backup.zip")
 
+            manifest_id = res['Backup-Manifest']
+            backup_archive = b''.join(res.streaming_content)
             with open(assets_path, 'wb') as f:
-                f.write(b''.join(res.streaming_content))
+                f.write(backup_archive)
+
+            # Backups can be resumed: a later request for the same task
+            # has the same ETag and the same content
+            etag = res.get('ETag')
+            manifests_dir = task.task_path(backup.MANIFESTS_DIR)
+            manifests = sorted(os.listdir(manifests_dir))
+            manifest_mtime = os.stat(os.path.join(manifests_dir, manifest_id + ".json")).st_mtime_ns
+            res = client.get("/api/projects/{}/tasks/{}/backup".format(project.id, task.id), HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=etag)
+            self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(res.get('ETag'), etag)
+            self.assertEqual(res.get('Content-Range'), "bytes 100-{}/{}".format(len(backup_archive) - 1, len(backup_archive)))
+            self.assertEqual(b''.join(res.streaming_content), backup_archive[100:])
+
+            # Resumed downloads don't save manifests
+            self.assertEqual(os.stat(os.path.join(manifests_dir, manifest_id + ".json")).st_mtime_ns, manifest_mtime)
+
+            # Unless the task has changed since
+            task.name = "Backup test (changed)"
+            task.save()
+            res = client.get("/api/projects/{}/tasks/{}/backup".format(project.id, task.id), HTTP_RANGE="bytes=100-", HTTP_IF_RANGE=etag)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(res.get('ETag'), etag)
+            b''.join(res.streaming_content)
+
+            # Full downloads do
+            self.assertEqual(sorted(os.listdir(manifests_dir)), sorted(manifests + [res['Backup-Manifest'] + ".json"]))
+
+            task.name = "Backup test"
+            task.save()
+
+            # Incremental backups include only the manifest when nothing changed
+            res = client.get("/api/projects/{}/tasks/{}/backup?since={}".format(project.id, task.id, manifest_id))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            with zipfile.ZipFile(io.BytesIO(b''.join(res.streaming_content))) as z:
+                self.assertEqual(z.namelist(), ["data/backup_manifest.json"])
+                self.assertEqual(json.loads(z.read("data/backup_manifest.json"))['base'], manifest_id)
+
+            # Unknown manifest
+            res = client.get("/api/projects/{}/tasks/{}/backup?since=0123456789abcdef".format(project.id, task.id))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
             assets_file = open(assets_path, 'rb')
 
@@ -334,9 +395,9 @@ class TestApiTask(BootTransactionTestCase):
             res = client.get("/api/projects/{}/tasks/{}/assets/odm_orthophoto/odm_orthophoto.tif".format(project.id, file_import_task.id))
             self.assertEqual(res.status_code, status.HTTP_200_OK)
 
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["orthophoto.tif"])))
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dsm.tif"])))
-            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dtm.tif"])))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["orthophoto.tif"]), full_check=True))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dsm.tif"]), full_check=True))
+            self.assertTrue(valid_cogeo(file_import_task.assets_path(task.ASSETS_MAP["dtm.tif"]), full_check=True))
 
     def test_entwine_bin(self):
         entwine = shutil.which("entwine")
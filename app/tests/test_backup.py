@@ -0,0 +1,117 @@
+import os
+import json
+import shutil
+import zipfile
+import tempfile
+
+from django.test import TestCase
+
+from app import backup
+
+
+class TestBackup(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.task_dir = os.path.join(self.tmpdir, "task")
+        self.write("images/1.jpg", b"image1")
+        self.write("images/2.jpg", b"image2")
+        self.write("assets/odm_orthophoto/odm_orthophoto.tif", b"ortho")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, rel_path, data):
+        path = os.path.join(self.task_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def make_backup(self, name, since=None):
+        files = backup.compute_files(self.task_dir)
+        base_files = backup.read_manifest(self.task_dir, since)['files'] if since is not None else {}
+        manifest = backup.create_manifest(self.task_dir, files, base=since)
+
+        zip_path = os.path.join(self.tmpdir, name)
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            for p in backup.changed_files(files, base_files):
+                z.write(os.path.join(self.task_dir, p), p)
+            z.writestr(backup.MANIFEST_FILE, json.dumps(manifest))
+        return zip_path, manifest
+
+    def test_compute_files(self):
+        files = backup.compute_files(self.task_dir)
+        self.assertEqual(sorted(files.keys()), ["assets/odm_orthophoto/odm_orthophoto.tif", "images/1.jpg", "images/2.jpg"])
+        self.assertEqual(files["images/1.jpg"]['size'], 6)
+        self.assertEqual(files["images/1.jpg"]['sha256'], backup.file_digest(os.path.join(self.task_dir, "images/1.jpg")))
+
+        # Cached digests are used for unchanged files
+        cache_file = os.path.join(self.task_dir, backup.HASH_CACHE_FILE)
+        cache = backup.read_json(cache_file, {})
+        cache["images/1.jpg"][2] = "cached"
+        backup.write_json(cache_file, cache)
+        self.assertEqual(backup.compute_files(self.task_dir)["images/1.jpg"]['sha256'], "cached")
+
+        # Known digests are used
+        files = backup.compute_files(self.task_dir, exclude=["images/2.jpg"], known_digests={"images/1.jpg": "known"})
+        self.assertEqual(files["images/1.jpg"]['sha256'], "known")
+        self.assertFalse("images/2.jpg" in files)
+
+        # Same files, same id
+        self.assertEqual(backup.manifest_id(backup.compute_files(self.task_dir)), backup.manifest_id(backup.compute_files(self.task_dir)))
+
+    def test_restore_chain(self):
+        base_zip, base = self.make_backup("base.zip")
+        self.assertIsNone(base['base'])
+        self.assertEqual(backup.read_manifest(self.task_dir, base['id']), base)
+
+        with self.assertRaises(FileNotFoundError):
+            backup.read_manifest(self.task_dir, "../../etc/passwd")
+
+        # Modify a file, remove one, add one
+        self.write("assets/odm_orthophoto/odm_orthophoto.tif", b"new ortho")
+        os.remove(os.path.join(self.task_dir, "images/2.jpg"))
+        self.write("assets/report.pdf", b"report")
+
+        delta_zip, delta = self.make_backup("delta.zip", since=base['id'])
+        self.assertEqual(delta['base'], base['id'])
+        with zipfile.ZipFile(delta_zip) as z:
+            self.assertEqual(sorted(z.namelist()), ["assets/odm_orthophoto/odm_orthophoto.tif", "assets/report.pdf", "data/backup_manifest.json"])
+
+        chain_zip = os.path.join(self.tmpdir, "chain.zip")
+        with zipfile.ZipFile(chain_zip, 'w') as z:
+            z.write(base_zip, "base.zip")
+            z.write(delta_zip, "delta.zip")
+        self.assertTrue(backup.is_chain(chain_zip))
+        self.assertFalse(backup.is_chain(base_zip))
+
+        # The chain can be in the destination directory
+        restored = os.path.join(self.tmpdir, "restored")
+        os.makedirs(restored)
+        shutil.move(chain_zip, os.path.join(restored, "all.zip"))
+        chain_zip = os.path.join(restored, "all.zip")
+        backup.restore_chain(chain_zip, restored, tmp_dir=self.tmpdir)
+        self.assertTrue(os.path.isfile(chain_zip))
+        os.remove(chain_zip)
+        self.assertEqual(sorted(backup.compute_files(restored).items()), sorted(delta['files'].items()))
+        self.assertFalse(os.path.exists(os.path.join(restored, "images/2.jpg")))
+
+        # Deltas must follow their base
+        chain_zip = os.path.join(self.tmpdir, "bad_chain.zip")
+        with zipfile.ZipFile(chain_zip, 'w') as z:
+            z.write(delta_zip, "delta.zip")
+            z.write(base_zip, "base.zip")
+        with self.assertRaises(backup.BackupError):
+            backup.restore_chain(chain_zip, os.path.join(self.tmpdir, "restored2"), tmp_dir=self.tmpdir)
+
+    def test_verify(self):
+        manifest = backup.make_manifest(backup.compute_files(self.task_dir))
+        backup.verify(self.task_dir, manifest)
+
+        # Same size, different content
+        self.write("images/1.jpg", b"image3")
+        with self.assertRaises(backup.BackupError):
+            backup.verify(self.task_dir, manifest)
+
+        os.remove(os.path.join(self.task_dir, "images/1.jpg"))
+        with self.assertRaises(backup.BackupError):
+            backup.verify(self.task_dir, manifest)
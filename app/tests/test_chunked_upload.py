@@ -0,0 +1,138 @@
+import os
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import TestCase
+
+from app.classes.chunked_upload import ChunkedUpload, ChunkedUploadError, cleanup_sessions, is_session_file
+
+
+class TestChunkedUpload(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.chunk_size = 1000
+        self.data = os.urandom(10500)
+        self.chunks = [self.data[i:i + self.chunk_size] for i in range(0, len(self.data), self.chunk_size)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def upload(self, uuid="abc"):
+        return ChunkedUpload(self.tmpdir, uuid, len(self.chunks), len(self.data), self.chunk_size)
+
+    def test_out_of_order(self):
+        order = list(range(len(self.chunks)))
+        random.shuffle(order)
+
+        def write(i):
+            return self.upload().write_chunk(i, i * self.chunk_size, [self.chunks[i]],
+                                             hashlib.sha256(self.chunks[i]).hexdigest())
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            completed = list(executor.map(write, order))
+
+        # Exactly one chunk completes the upload
+        self.assertEqual(completed.count(True), 1)
+
+        # Retried chunks don't complete it again
+        self.assertFalse(write(0))
+
+        dst = os.path.join(self.tmpdir, "out.bin")
+        self.upload().finalize(dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "abc.upload")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "abc.chunks")))
+
+    def test_bad_chunks(self):
+        upload = self.upload()
+
+        # Checksum mismatch
+        with self.assertRaises(ChunkedUploadError):
+            upload.write_chunk(1, self.chunk_size, [self.chunks[1]], "00" * 32)
+
+        # Truncated chunk
+        with self.assertRaises(ChunkedUploadError):
+            upload.write_chunk(2, 2 * self.chunk_size, [self.chunks[2][:10]])
+
+        # Invalid index
+        with self.assertRaises(ChunkedUploadError):
+            upload.write_chunk(len(self.chunks), 0, [self.chunks[0]])
+
+        # Bad chunks are not marked as received
+        for i in reversed(range(len(self.chunks))):
+            completed = upload.write_chunk(i, i * self.chunk_size, [self.chunks[i]])
+            self.assertEqual(completed, i == 0)
+
+    def test_restart(self):
+        upload = self.upload()
+        upload.write_chunk(0, 0, [self.chunks[0]])
+
+        # Same uuid, different file starts over
+        other = ChunkedUpload(self.tmpdir, "abc", 1, 5)
+        self.assertTrue(other.write_chunk(0, 0, [b"hello"]))
+
+        # Unknown total size (older clients)
+        upload = ChunkedUpload(self.tmpdir, "def", len(self.chunks))
+        for i in reversed(range(len(self.chunks))):
+            upload.write_chunk(i, i * self.chunk_size, [self.chunks[i]])
+        dst = os.path.join(self.tmpdir, "out.bin")
+        upload.finalize(dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_sessions(self):
+        self.assertIsNone(ChunkedUpload.load(self.tmpdir, "abc"))
+
+        upload = self.upload()
+        for i in [0, 1, 3, 10]:
+            upload.write_chunk(i, i * self.chunk_size, [self.chunks[i]])
+
+        # Sessions survive restarts
+        session = ChunkedUpload.load(self.tmpdir, "abc")
+        self.assertEqual(session.total_size, len(self.data))
+        self.assertEqual(session.chunk_size, self.chunk_size)
+        self.assertEqual(session.received_chunks(), [0, 1, 3, 10])
+        self.assertEqual(session.received_ranges(), [[0, 1999], [3000, 3999], [10000, 10499]])
+
+        self.assertTrue(is_session_file(self.tmpdir, "abc.upload"))
+        self.assertTrue(is_session_file(self.tmpdir, "abc.chunks"))
+        self.assertFalse(is_session_file(self.tmpdir, "tmpxyz.upload"))
+
+        # Active sessions are kept
+        self.assertEqual(cleanup_sessions(self.tmpdir, 3600), [])
+        self.assertIsNotNone(ChunkedUpload.load(self.tmpdir, "abc"))
+
+        # Expired sessions are removed
+        past = time.time() - 7200
+        os.utime(session.bitmap_path, (past, past))
+        self.assertEqual(cleanup_sessions(self.tmpdir, 3600), ["abc"])
+        self.assertIsNone(ChunkedUpload.load(self.tmpdir, "abc"))
+        self.assertFalse(os.path.exists(session.path))
+
+    def test_owner(self):
+        upload = ChunkedUpload(self.tmpdir, "abc", len(self.chunks), len(self.data), self.chunk_size, "task-1")
+        upload.write_chunk(0, 0, [self.chunks[0]])
+
+        # Sessions can only be loaded by their owner
+        self.assertIsNone(ChunkedUpload.load(self.tmpdir, "abc"))
+        self.assertIsNone(ChunkedUpload.load(self.tmpdir, "abc", "task-2"))
+        self.assertEqual(ChunkedUpload.load(self.tmpdir, "abc", "task-1").received_chunks(), [0])
+
+        # Other owners cannot write to them or start them over
+        other = ChunkedUpload(self.tmpdir, "abc", len(self.chunks), len(self.data), self.chunk_size, "task-2")
+        with self.assertRaises(ChunkedUploadError):
+            other.write_chunk(1, self.chunk_size, [self.chunks[1]])
+        with self.assertRaises(ChunkedUploadError):
+            ChunkedUpload(self.tmpdir, "abc", 1, 5, owner="task-2").write_chunk(0, 0, [b"hello"])
+        self.assertEqual(upload.received_chunks(), [0])
+
+        # Expired sessions are removed regardless of their owner
+        past = time.time() - 7200
+        os.utime(upload.bitmap_path, (past, past))
+        self.assertEqual(cleanup_sessions(self.tmpdir, 3600), ["abc"])
+        self.assertFalse(os.path.exists(upload.path))
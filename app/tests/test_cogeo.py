@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from app import cogeo
+from .classes import BootTestCase
+
+
+class TestCogeo(BootTestCase):
+    def setUp(self):
+        cogeo.get_gdal_version.cache_clear()
+
+    def tearDown(self):
+        cogeo.get_gdal_version.cache_clear()
+
+    def test_gdal_version(self):
+        with mock.patch('app.cogeo.shutil.which', return_value="/usr/bin/gdal_translate"), \
+             mock.patch('app.cogeo.subprocess.check_output', return_value=b"GDAL 3.4.1, released 2021/12/27") as check_output:
+            self.assertEqual(cogeo.get_gdal_version(), (3, 4, 1))
+            self.assertEqual(cogeo.get_gdal_version(), (3, 4, 1))
+
+            # gdal_translate is only invoked once
+            self.assertEqual(check_output.call_count, 1)
+
+        cogeo.get_gdal_version.cache_clear()
+        with mock.patch('app.cogeo.shutil.which', return_value=None):
+            self.assertIsNone(cogeo.get_gdal_version())
+
+    def test_assure_cogeo_threads(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            src_path = os.path.join(tmpdir, "orthophoto.tif")
+            shutil.copy(os.path.join("app", "fixtures", "orthophoto.tif"), src_path)
+
+            with mock.patch('app.cogeo.valid_cogeo', return_value=False), \
+                 mock.patch('app.cogeo.get_gdal_version', return_value=(3, 4, 1)), \
+                 mock.patch('app.cogeo.subprocess.run') as run:
+                cogeo.assure_cogeo(src_path, threads=2)
+                args = run.call_args[0][0]
+                self.assertTrue("NUM_THREADS=2" in args)
+                self.assertEqual(args[args.index("GDAL_NUM_THREADS") + 1], "2")
+
+                cogeo.assure_cogeo(src_path)
+                args = run.call_args[0][0]
+                self.assertTrue("NUM_THREADS=ALL_CPUS" in args)
+                self.assertEqual(args[args.index("GDAL_NUM_THREADS") + 1], "ALL_CPUS")
+
+            # Nothing was converted, the file is left untouched
+            self.assertTrue(os.path.isfile(src_path))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def test_valid_cogeo_full_check(self):
+        src_path = os.path.join("app", "fixtures", "orthophoto.tif")
+
+        with mock.patch('app.vendor.validate_cloud_optimized_geotiff.validate', return_value=([], [], {})) as validate:
+            self.assertTrue(cogeo.valid_cogeo(src_path))
+            self.assertEqual(validate.call_args[1], {'full_check': False})
+
+            self.assertTrue(cogeo.valid_cogeo(src_path, full_check=True))
+            self.assertEqual(validate.call_args[1], {'full_check': True})
+
+            validate.return_value = ([], ["error"], {})
+            self.assertFalse(cogeo.valid_cogeo(src_path))
+            self.assertFalse(cogeo.valid_cogeo(src_path, full_check=True))
+
+        # A converted file passes both checks
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cog_path = os.path.join(tmpdir, "orthophoto.tif")
+            shutil.copy(src_path, cog_path)
+            cogeo.assure_cogeo(cog_path, threads=1)
+            self.assertTrue(cogeo.valid_cogeo(cog_path))
+            self.assertTrue(cogeo.valid_cogeo(cog_path, full_check=True))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
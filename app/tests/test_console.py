@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+
+from app.classes.console import Console
+
+
+class TestConsole(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, "data"))
+        self.console = Console(os.path.join(self.tmpdir, "data", "console_output.txt"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_line_index(self):
+        c = self.console
+        self.assertEqual(c.line_count(), 0)
+        self.assertEqual(c.lines(), [])
+
+        c += "hello\nworld\n"
+        self.assertEqual(c.line_count(), 2)
+        self.assertTrue(c.ends_with_newline())
+        self.assertTrue(os.path.isfile(c.index_file))
+
+        c += "partial"
+        self.assertEqual(c.line_count(), 3)
+        self.assertFalse(c.ends_with_newline())
+        self.assertEqual(c.lines(1), ["world", "partial"])
+
+        c += " line\nà é\n"
+        self.assertEqual(c.lines(), ["hello", "world", "partial line", "à é"])
+        self.assertEqual(c.lines(2, 3), ["partial line"])
+        self.assertEqual(c.lines(3, 100), ["à é"])
+        self.assertEqual(c.lines(10), [])
+        self.assertEqual(c.lines(), c.output().rstrip().split("\n"))
+
+        # Changes made outside of the console are picked up
+        with open(c.file, "a", encoding="utf-8") as f:
+            f.write("external\n")
+        self.assertEqual(c.line_count(), 5)
+        self.assertEqual(c.lines(4), ["external"])
+
+        c.reset("new")
+        self.assertEqual(c.lines(), ["new"])
+        c += "\nline\n"
+        self.assertEqual(c.lines(), ["new", "line"])
+        self.assertEqual(c.line_count() + 1, len(c.output().split("\n")))
+        self.assertEqual(c.split_line_count(), len(c.output().split("\n")))
+
+    def test_rstrip(self):
+        c = self.console
+        self.assertEqual(c.split_line_count(), 0)
+
+        # Same as output().rstrip().split("\n")
+        for text in ["", "\n\n", "  \n", "one", "one\n", "one  \n\n\n", "one\ntwo \n \n\n",
+                     "one\n\ntwo\n\n", "one\n" + "\n" * 70000]:
+            c.reset(text)
+            expected = c.output().rstrip().split("\n")
+            self.assertEqual(c.line_count(rstrip=True), len(expected), repr(text))
+            self.assertEqual(c.lines(rstrip=True), expected, repr(text))
+            for start in range(0, 4):
+                for end in [None, start, start + 1, start + 2]:
+                    self.assertEqual(c.lines(start, end, rstrip=True), expected[start:end], repr((text, start, end)))
@@ -0,0 +1,30 @@
+import multiprocessing
+
+from django.test import TestCase
+
+from app.cpu_utils import get_available_cores, get_threads_per_job, can_spawn_processes
+
+
+class TestCpuUtils(TestCase):
+    def test_threads_per_job(self):
+        self.assertTrue(get_available_cores() >= 1)
+
+        self.assertEqual(get_threads_per_job(1, budget=8), 8)
+        self.assertEqual(get_threads_per_job(3, budget=8), 2)
+        self.assertEqual(get_threads_per_job(16, budget=8), 1)
+        self.assertEqual(get_threads_per_job(0, budget=8), 8)
+        self.assertEqual(get_threads_per_job(1, budget=8, max_threads=4), 4)
+        self.assertEqual(get_threads_per_job(1, budget=8, max_threads=0), 1)
+
+    def test_can_spawn_processes(self):
+        self.assertTrue(can_spawn_processes())
+
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_report_can_spawn, args=(q, ), daemon=True)
+        p.start()
+        self.assertFalse(q.get(timeout=10))
+        p.join()
+
+
+def _report_can_spawn(q):
+    q.put(can_spawn_processes())
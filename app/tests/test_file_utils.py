@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from app.file_utils import clone_tree, clone_file, LINK, COPY
+
+
+class TestFileUtils(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, "src")
+        self.dst = os.path.join(self.tmpdir, "dst")
+        os.makedirs(os.path.join(self.src, "assets", "odm_orthophoto"))
+
+        for path, content in [("image.jpg", b"image"), ("gcp.txt", b"gcp"),
+                              (os.path.join("assets", "odm_orthophoto", "odm_orthophoto.tif"), b"ortho" * 1000)]:
+            with open(os.path.join(self.src, path), 'wb') as f:
+                f.write(content)
+        os.symlink("odm_orthophoto", os.path.join(self.src, "assets", "orthophoto"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_clone_tree(self):
+        progress = []
+        stats = clone_tree(self.src, self.dst, link={"image.jpg"}, progress_callback=lambda p: progress.append(p))
+
+        for path in ["image.jpg", "gcp.txt", os.path.join("assets", "odm_orthophoto", "odm_orthophoto.tif")]:
+            with open(os.path.join(self.src, path), 'rb') as f1, open(os.path.join(self.dst, path), 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+        # Only the files that can be linked are linked
+        self.assertTrue(os.path.samefile(os.path.join(self.src, "image.jpg"), os.path.join(self.dst, "image.jpg")))
+        self.assertFalse(os.path.samefile(os.path.join(self.src, "gcp.txt"), os.path.join(self.dst, "gcp.txt")))
+        self.assertEqual(os.readlink(os.path.join(self.dst, "assets", "orthophoto")), "odm_orthophoto")
+        self.assertEqual(stats[LINK], 2)
+        self.assertEqual(sum(stats.values()), 4)
+        self.assertEqual(progress[-1], 1.0)
+
+        # Copies can be modified in place
+        with open(os.path.join(self.dst, "gcp.txt"), 'wb') as f:
+            f.write(b"changed")
+        with open(os.path.join(self.src, "gcp.txt"), 'rb') as f:
+            self.assertEqual(f.read(), b"gcp")
+
+    def test_clone_file_fallback(self):
+        dst = os.path.join(self.tmpdir, "copy.txt")
+        methods = ["unsupported"]
+        self.assertEqual(clone_file(os.path.join(self.src, "gcp.txt"), dst, methods), COPY)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b"gcp")
@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from PIL import Image, JpegImagePlugin
+
+from app.classes.gcp import GCPFile
+from app.models import Project, Task
+from app.models.task import resize_image, TaskInterruptedException
+from nodeodm.models import ProcessingNode
+from pyodm.exceptions import NodeServerError, NodeConnectionError
+from .classes import BootTestCase
+from .utils import clear_test_media_root
+
+
+class TestImageResize(BootTestCase):
+    def tearDown(self):
+        clear_test_media_root()
+
+    def test_resize_image(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            image_path = os.path.join(tmpdir, "image.jpg")
+            shutil.copy(os.path.join("app", "fixtures", "tiny_drone_image.jpg"), image_path)
+            with Image.open(image_path) as im:
+                width, height = im.size
+                exif = im.info.get("exif")
+
+            # JPEGs are decoded at a reduced DCT scale
+            with mock.patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True,
+                                   side_effect=JpegImagePlugin.JpegImageFile.draft) as draft:
+                res = resize_image(image_path, width / 4)
+                self.assertEqual(draft.call_count, 1)
+                self.assertEqual(draft.call_args[0][2], (width // 4, height // 4))
+
+            self.assertEqual(res, {'path': image_path, 'resize_ratio': 0.25})
+            with Image.open(image_path) as im:
+                self.assertEqual(im.size, (width // 4, height // 4))
+                self.assertEqual(im.info.get("exif"), exif)
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "image.resized.jpg")))
+
+            # Images are never made bigger
+            res = resize_image(image_path, width * 2)
+            self.assertEqual(res, {'path': image_path, 'resize_ratio': 1})
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def test_resize_images_gcp(self):
+        project = Project.objects.get(name="User Test Project")
+        task = Task.objects.create(project=project, name="Test", resize_to=24)
+        task.create_task_directories()
+
+        for f in ["tiny_drone_image.jpg", "tiny_drone_image_2.jpg", "gcp.txt"]:
+            shutil.copy(os.path.join("app", "fixtures", f), task.task_path(f))
+
+        self.assertEqual(task.find_gcp_file(), task.task_path("gcp.txt"))
+
+        resized = task.resize_images()
+        self.assertEqual(sorted([os.path.basename(r['path']) for r in resized]), ["tiny_drone_image.jpg", "tiny_drone_image_2.jpg"])
+        self.assertTrue(all([r['resize_ratio'] == 0.5 for r in resized]))
+
+        for f in ["tiny_drone_image.jpg", "tiny_drone_image_2.jpg"]:
+            with Image.open(task.task_path(f)) as im:
+                self.assertEqual(im.size, (24, 18))
+
+        # Pixel coordinates of GCP entries are scaled (image names are case insensitive)
+        original = list(GCPFile(os.path.join("app", "fixtures", "gcp.txt")).iter_entries())
+        gcp = GCPFile(task.task_path("gcp.txt"))
+        self.assertEqual(gcp.raw_srs, "+proj=utm +zone=15 +ellps=WGS84 +datum=WGS84 +units=m +no_defs")
+
+        entries = list(gcp.iter_entries())
+        self.assertEqual(len(entries), len(original))
+        for a, b in zip(original, entries):
+            self.assertEqual((a.x, a.y, a.z, a.filename), (b.x, b.y, b.z, b.filename))
+            ratio = 1.0 if a.filename == "missing_image.jpg" else 0.5
+            self.assertAlmostEqual(b.px, a.px * ratio)
+            self.assertAlmostEqual(b.py, a.py * ratio)
+
+    def test_resize_and_upload_images(self):
+        project = Project.objects.get(name="User Test Project")
+        pnode = ProcessingNode.objects.create(hostname="invalid-host", port=11223)
+        task = Task.objects.create(project=project, name="Test", resize_to=24, processing_node=pnode, auto_processing_node=False)
+        task.create_task_directories()
+        for f in ["tiny_drone_image.jpg", "gcp.txt"]:
+            shutil.copy(os.path.join("app", "fixtures", f), task.task_path(f))
+
+        with mock.patch.object(ProcessingNode, 'is_online', return_value=True), \
+             mock.patch.object(ProcessingNode, 'api_client'), \
+             mock.patch.object(ProcessingNode, 'supports_staged_upload', return_value=True) as supports_staged_upload, \
+             mock.patch.object(ProcessingNode, 'init_task', return_value="node-uuid") as init_task, \
+             mock.patch.object(ProcessingNode, 'upload_task_file') as upload_task_file, \
+             mock.patch.object(ProcessingNode, 'commit_task', return_value="node-uuid") as commit_task, \
+             mock.patch.object(ProcessingNode, 'remove_task') as remove_task:
+
+            # Fallback (resize first, then upload) when disabled or not supported by the node
+            with mock.patch('webodm.settings.TASK_PIPELINED_UPLOAD', False):
+                self.assertFalse(task.resize_and_upload_images())
+
+            supports_staged_upload.return_value = False
+            self.assertFalse(task.resize_and_upload_images())
+            init_task.assert_not_called()
+            supports_staged_upload.return_value = True
+
+            # Canceled while resizing: the task is removed from the node
+            with mock.patch.object(Task, 'resize_images', side_effect=TaskInterruptedException()):
+                with self.assertRaises(TaskInterruptedException):
+                    task.resize_and_upload_images()
+            remove_task.assert_called_once_with("node-uuid")
+            commit_task.assert_not_called()
+
+            # Failures too (errors while removing the task are ignored)
+            remove_task.reset_mock()
+            remove_task.side_effect = NodeConnectionError("unreachable")
+            commit_task.side_effect = NodeConnectionError("timeout")
+            with self.assertRaises(NodeServerError):
+                task.resize_and_upload_images()
+            remove_task.assert_called_once_with("node-uuid")
+            remove_task.side_effect = None
+            commit_task.side_effect = None
+
+            task.refresh_from_db()
+            self.assertEqual(task.uuid, '')
+
+            # All files are uploaded, then the task is committed
+            upload_task_file.reset_mock()
+            remove_task.reset_mock()
+            self.assertTrue(task.resize_and_upload_images())
+            self.assertEqual(sorted([os.path.basename(c[0][1]) for c in upload_task_file.call_args_list]), ["gcp.txt", "tiny_drone_image.jpg"])
+            remove_task.assert_not_called()
+
+            task.refresh_from_db()
+            self.assertEqual(task.uuid, "node-uuid")
+            self.assertIsNone(task.pending_action)
+
+    def test_gcp_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            gcp = GCPFile(os.path.join("app", "fixtures", "gcp.txt"))
+            gcp.resize_image_entries("TINY_DRONE_IMAGE_2.JPG", 0.5)
+
+            out = gcp.write(os.path.join(tmpdir, "gcp.txt"))
+            with open(out, 'r') as f:
+                lines = f.read().split('\n')
+            self.assertEqual(lines[0], gcp.raw_srs)
+            self.assertEqual(lines[3], "576529.22 5188003.22 0.0 2.0 3.0 tiny_drone_image_2.jpg")
+            self.assertEqual(lines[1], "576529.22 5188003.22 0.0 4.0 6.0 tiny_drone_image.JPG")
+            self.assertEqual(lines[-1], "")
+
+            # Malformed files are detected before anything is written
+            malformed = GCPFile(os.path.join("app", "fixtures", "gcp_malformed.txt"))
+            with self.assertRaises(ValueError):
+                list(malformed.iter_entries())
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
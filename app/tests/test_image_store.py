@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from app import image_store
+
+
+class TestImageStore(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmpdir, "store")
+        self.task1 = os.path.join(self.tmpdir, "task1")
+        self.task2 = os.path.join(self.tmpdir, "task2")
+        os.makedirs(self.task1)
+        os.makedirs(self.task2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_store(self):
+        img1 = os.path.join(self.task1, "DJI_0001.JPG")
+        img2 = os.path.join(self.task2, "copy.jpg")
+        self.write(img1, b"image" * 1000)
+        self.write(img2, b"image" * 1000)
+
+        d1 = image_store.add_file(img1, self.store)
+        d2 = image_store.add_file(img2, self.store)
+
+        # Identical content is stored once
+        self.assertEqual(d1, d2)
+        self.assertTrue(os.path.samefile(img1, img2))
+        self.assertTrue(image_store.is_linked(img1, d1, self.store))
+        self.assertEqual(os.stat(image_store.blob_path(d1, self.store)).st_nlink, 3)
+        with open(img2, 'rb') as f:
+            self.assertEqual(f.read(), b"image" * 1000)
+
+        # Size is shared between the tasks referencing the blob
+        self.assertEqual(image_store.shared_size(img1, d1, self.store), 2500)
+
+        # Blobs are released only once they are no longer referenced
+        os.unlink(img1)
+        self.assertEqual(image_store.release([d1], self.store), 0)
+        self.assertEqual(image_store.shared_size(img2, d1, self.store), 5000)
+        os.unlink(img2)
+        self.assertEqual(image_store.collect_garbage(self.store), 1)
+        self.assertFalse(os.path.exists(image_store.blob_path(d1, self.store)))
+
+    def test_manifest(self):
+        self.assertEqual(image_store.read_manifest(self.task1), {})
+        image_store.update_manifest(self.task1, {"a.jpg": "aa", "b.jpg": "bb"})
+        image_store.update_manifest(self.task1, {"c.jpg": "cc"}, remove=["a.jpg"])
+        self.assertEqual(image_store.read_manifest(self.task1), {"b.jpg": "bb", "c.jpg": "cc"})
+        image_store.update_manifest(self.task1, remove=True)
+        self.assertEqual(image_store.read_manifest(self.task1), {})
+        self.assertEqual(os.listdir(os.path.join(self.task1, "data")), [image_store.MANIFEST_FILE])
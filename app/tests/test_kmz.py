@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from django.test import TestCase
+
+from app.kmz import write_kmz, downsample_tile, encode_tile
+
+
+class TestKmz(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_downsample_tile(self):
+        arr = np.zeros((4, 3, 5), dtype=np.uint8)
+        arr[0, :, :] = 200
+        arr[3, :, :2] = 255
+
+        out = downsample_tile(arr)
+        self.assertEqual(out.shape, (4, 2, 3))
+
+        # Fully opaque block keeps its color
+        self.assertEqual(out[0, 0, 0], 200)
+        self.assertEqual(out[3, 0, 0], 255)
+
+        # Fully transparent block stays transparent
+        self.assertEqual(out[3, 0, 2], 0)
+        self.assertEqual(out[0, 0, 2], 0)
+
+    def test_encode_tile(self):
+        arr = np.full((4, 16, 16), 255, dtype=np.uint8)
+        data, ext = encode_tile(arr)
+        self.assertEqual(ext, 'jpg')
+        self.assertTrue(len(data) > 0)
+
+        arr[3, 0, 0] = 0
+        _, ext = encode_tile(arr)
+        self.assertEqual(ext, 'png')
+
+        arr[3, :, :] = 0
+        self.assertEqual(encode_tile(arr), (None, None))
+
+    def write_raster(self, width=700, height=300):
+        src = os.path.join(self.tmpdir, "rgba.tif")
+        data = np.random.randint(0, 255, (4, height, width), dtype=np.uint8)
+        data[3, :, :] = 255
+        data[3, :, :50] = 0
+
+        with rasterio.open(src, 'w', driver='GTiff', width=width, height=height, count=4, dtype='uint8',
+                           crs='EPSG:32615', transform=from_origin(576000, 5188000, 0.1, 0.1)) as dst:
+            dst.write(data)
+        return src
+
+    def assert_links_valid(self, z):
+        names = z.namelist()
+
+        # Every linked child tile exists in the archive
+        for n in names:
+            if n.endswith(".kml") and n != "doc.kml":
+                kml = z.read(n).decode("utf-8")
+                z_, x_, _ = n.split("/")
+                for href in [l.strip()[6:-7] for l in kml.split("\n") if l.strip().startswith("<href>")]:
+                    path = os.path.normpath(os.path.join(z_, x_, href))
+                    self.assertTrue(path in names, path)
+
+    def test_write_kmz(self):
+        src = self.write_raster()
+        kmz = os.path.join(self.tmpdir, "out.kmz")
+
+        progress = []
+        write_kmz(src, kmz, name="test & co", progress_callback=lambda d, t: progress.append((d, t)), max_workers=2)
+
+        self.assertTrue(os.path.isfile(kmz))
+        self.assertTrue(len(progress) > 0)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+
+        with zipfile.ZipFile(kmz) as z:
+            names = z.namelist()
+            self.assertEqual(names[0], "doc.kml")
+            self.assertTrue("0/0/0.kml" in names)
+            self.assertTrue(any(n.startswith("0/0/0.") and not n.endswith(".kml") for n in names))
+            self.assertTrue("test &amp; co" in z.read("doc.kml").decode("utf-8"))
+            self.assert_links_valid(z)
+
+    def test_write_kmz_transparent_parents(self):
+        src = self.write_raster()
+        kmz = os.path.join(self.tmpdir, "out.kmz")
+
+        # Sparse pixels can have an alpha that rounds to 0 once downsampled
+        def transparent(arr):
+            _, h, w = arr.shape
+            return np.zeros((4, (h + 1) // 2, (w + 1) // 2), dtype=np.uint8)
+
+        with mock.patch('app.kmz.downsample_tile', side_effect=transparent):
+            write_kmz(src, kmz, max_workers=2)
+
+        with zipfile.ZipFile(kmz) as z:
+            names = z.namelist()
+
+            # Parents are still written (without an image) and link to their children
+            self.assertTrue("0/0/0.kml" in names)
+            self.assertFalse(any(n.startswith("0/0/0.") and not n.endswith(".kml") for n in names))
+            self.assertTrue("<NetworkLink>" in z.read("0/0/0.kml").decode("utf-8"))
+            self.assertTrue(any(n.startswith("2/") and not n.endswith(".kml") for n in names))
+            self.assert_links_valid(z)
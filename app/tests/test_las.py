@@ -0,0 +1,93 @@
+import os
+import struct
+import tempfile
+import shutil
+from django.test import TestCase
+
+from app.classes.las import LASHeader, LASHeaderError
+
+
+def write_las(path, version=(1, 2), vlrs=[], evlrs=[], point_count=42, point_format=3, compressed=False):
+    """Write a LAS header (with no points) for testing"""
+    header_size = 375 if version >= (1, 4) else 227
+    vlrs_size = sum([54 + len(data) for _, _, data in vlrs])
+    point_data_offset = header_size + vlrs_size
+
+    h = bytearray(header_size)
+    h[0:4] = b'LASF'
+    struct.pack_into('<BB', h, 24, *version)
+    struct.pack_into('<HIIBHI', h, 94, header_size, point_data_offset, len(vlrs),
+                     point_format | (0x80 if compressed else 0), 34, 0 if version >= (1, 4) else point_count)
+    struct.pack_into('<3d', h, 131, 0.01, 0.01, 0.01)
+    struct.pack_into('<6d', h, 179, 10, 1, 20, 2, 30, 3)
+    if version >= (1, 4):
+        struct.pack_into('<QIQ', h, 235, point_data_offset if evlrs else 0, len(evlrs), point_count)
+
+    with open(path, 'wb') as f:
+        f.write(h)
+        for user_id, record_id, data in vlrs:
+            f.write(struct.pack('<H16sHH32s', 0, user_id, record_id, len(data), b''))
+            f.write(data)
+        for user_id, record_id, data in evlrs:
+            f.write(struct.pack('<H16sHQ32s', 0, user_id, record_id, len(data), b''))
+            f.write(data)
+
+
+def geokeys(*keys):
+    data = struct.pack('<4H', 1, 1, 0, len(keys))
+    for key_id, value in keys:
+        data += struct.pack('<4H', key_id, 0, 1, value)
+    return data
+
+
+class TestLas(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_header(self):
+        p = os.path.join(self.tmpdir, "test.laz")
+        wkt = b'PROJCS["WGS 84 / UTM zone 16N"]\x00'
+        write_las(p, vlrs=[(b'laszip encoded', 22204, b'\x00' * 34), (b'LASF_Projection', 2112, wkt)], compressed=True)
+
+        h = LASHeader(p)
+        self.assertEqual(h.version, (1, 2))
+        self.assertEqual(h.point_count, 42)
+        self.assertEqual(h.point_format, 3)
+        self.assertTrue(h.compressed)
+        self.assertEqual(h.bounds, [1, 2, 3, 10, 20, 30])
+        self.assertEqual(h.wkt, 'PROJCS["WGS 84 / UTM zone 16N"]')
+        self.assertTrue(h.is_georeferenced())
+        self.assertEqual(h.to_dict()['points'], 42)
+
+    def test_georeferencing(self):
+        p = os.path.join(self.tmpdir, "test.las")
+
+        # No projection records
+        write_las(p)
+        self.assertFalse(LASHeader(p).is_georeferenced())
+
+        # GeoTIFF keys with an EPSG code
+        write_las(p, vlrs=[(b'LASF_Projection', 34735, geokeys((1024, 1), (3072, 32616)))])
+        h = LASHeader(p)
+        self.assertEqual(h.epsg(), 32616)
+        self.assertTrue(h.is_georeferenced())
+
+        # User defined keys, can't decide
+        write_las(p, vlrs=[(b'LASF_Projection', 34735, geokeys((3072, 32767)))])
+        self.assertIsNone(LASHeader(p).is_georeferenced())
+
+        # LAS 1.4 with WKT in an extended VLR
+        write_las(p, version=(1, 4), point_count=2**33, evlrs=[(b'LASF_Projection', 2112, b'GEOGCS["WGS 84"]')])
+        h = LASHeader(p)
+        self.assertEqual(h.point_count, 2**33)
+        self.assertEqual(h.wkt, 'GEOGCS["WGS 84"]')
+        self.assertTrue(h.is_georeferenced())
+
+    def test_invalid(self):
+        p = os.path.join(self.tmpdir, "invalid.las")
+        with open(p, 'wb') as f:
+            f.write(b'not a las file')
+        self.assertRaises(LASHeaderError, LASHeader, p)
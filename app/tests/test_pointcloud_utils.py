@@ -0,0 +1,128 @@
+import os
+import struct
+import tempfile
+import numpy as np
+from unittest import mock
+from django.test import TestCase
+
+from app.pointcloud_utils import build_pointcloud_pipeline, is_pipeline_streamable, get_process_bytes_read, \
+    build_cross_section_pipeline, compute_stations, read_las_xyz, is_indexed_pointcloud, cross_section_resolution, \
+    is_pointcloud_georeferenced
+
+
+class TestPointcloudUtils(TestCase):
+    def test_build_pipeline(self):
+        p = build_pointcloud_pipeline("in.laz", "out.laz")
+        self.assertEqual(p, [{"type": "readers.las", "filename": "in.laz"}, {"filename": "out.laz"}])
+        self.assertTrue(is_pipeline_streamable(p))
+
+        p = build_pointcloud_pipeline("in.laz", "out.las", out_srs="EPSG:4326", cutline="POLYGON((0 0,1 0,1 1,0 0))")
+        self.assertEqual([s.get("type") for s in p], ["readers.las", "filters.reprojection", "filters.crop", None])
+        self.assertEqual(p[1]["out_srs"], "EPSG:4326")
+        self.assertTrue(is_pipeline_streamable(p))
+
+        # Sampling and PLY output need all points in memory
+        p = build_pointcloud_pipeline("in.laz", "out.laz", resample=2.5)
+        self.assertEqual(p[1], {"type": "filters.sample", "radius": 2.5})
+        self.assertFalse(is_pipeline_streamable(p))
+
+        p = build_pointcloud_pipeline("in.laz", "out.ply", export_format="ply")
+        self.assertEqual(p[-1]["type"], "writers.ply")
+        self.assertFalse(is_pipeline_streamable(p))
+
+    def test_process_bytes_read(self):
+        if os.path.isdir("/proc/self"):
+            self.assertTrue(get_process_bytes_read(os.getpid()) > 0)
+        self.assertIsNone(get_process_bytes_read(-1))
+
+    def test_cross_section_pipeline(self):
+        polygon = "POLYGON((0 0,1 0,1 1,0 0))"
+
+        # Indexed point clouds are filtered by the reader
+        p = build_cross_section_pipeline("entwine_pointcloud/ept.json", polygon, "out.las", resolution=0.5)
+        self.assertEqual(p[0], {"type": "readers.ept", "filename": "entwine_pointcloud/ept.json", "polygon": polygon, "resolution": 0.5})
+        self.assertEqual(len(p), 2)
+        self.assertTrue(is_pipeline_streamable(p))
+
+        p = build_cross_section_pipeline("model.copc.laz", polygon, "out.laz")
+        self.assertEqual(p[0], {"type": "readers.copc", "filename": "model.copc.laz", "polygon": polygon})
+        self.assertEqual(len(p), 2)
+        self.assertTrue(is_indexed_pointcloud("model.copc.laz"))
+        self.assertFalse(is_indexed_pointcloud("model.laz"))
+
+        # Others need a crop filter
+        p = build_cross_section_pipeline("model.laz", polygon, "out.las", resolution=0.5)
+        self.assertEqual([s.get("type") for s in p], ["readers.las", "filters.crop", "filters.sample", "writers.las"])
+
+    def test_cross_section_resolution(self):
+        # 1M points over 100x100 units (100 points / unit^2)
+        info = {'points': 1000000, 'bounds': [0, 0, 0, 100, 100, 10]}
+
+        # 10 unit^2 corridor, ~1000 points
+        self.assertIsNone(cross_section_resolution(10, info, 2000))
+        self.assertEqual(cross_section_resolution(10, info, 2000, 0.5), 0.5)
+
+        # Spacing is coarsened to stay within the limit
+        self.assertAlmostEqual(cross_section_resolution(10, info, 500), 0.1414, places=3)
+        self.assertAlmostEqual(cross_section_resolution(10, info, 500, 0.1), 0.1414, places=3)
+
+        # A coarse enough resolution is kept
+        self.assertEqual(cross_section_resolution(10, info, 500, 0.5), 0.5)
+
+        # No estimate without bounds
+        self.assertEqual(cross_section_resolution(10, {'points': 1000000}, 500, 0.1), 0.1)
+        self.assertIsNone(cross_section_resolution(10, {}, 500))
+
+    def test_georeferenced_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), "model.laz")
+        with open(path, 'wb') as f:
+            f.write(b"test")
+
+        # The header decides when it can
+        with mock.patch('app.pointcloud_utils.subprocess.check_output') as check_output:
+            self.assertFalse(is_pointcloud_georeferenced(path, {'georeferenced': False}))
+            check_output.assert_not_called()
+
+        # Otherwise PDAL is asked once, and its result stored in the info
+        info = {'georeferenced': None}
+        with mock.patch('app.pointcloud_utils.subprocess.check_output', return_value=b'{"summary": {"srs": {}}}') as check_output:
+            self.assertTrue(is_pointcloud_georeferenced(path, info))
+            self.assertTrue(is_pointcloud_georeferenced(path, info))
+            self.assertEqual(check_output.call_count, 1)
+        self.assertEqual(info['georeferenced'], True)
+
+        info = {'georeferenced': None}
+        with mock.patch('app.pointcloud_utils.subprocess.check_output', return_value=b'{"summary": {}}'):
+            self.assertFalse(is_pointcloud_georeferenced(path, info))
+        self.assertEqual(info['georeferenced'], False)
+
+        # Errors are not cached
+        info = {'georeferenced': None}
+        with mock.patch('app.pointcloud_utils.subprocess.check_output', side_effect=OSError("pdal not found")):
+            self.assertTrue(is_pointcloud_georeferenced(path, info))
+        self.assertIsNone(info['georeferenced'])
+
+    def test_compute_stations(self):
+        line = [(0, 0), (10, 0), (10, 10)]
+        xy = np.array([[0, 1], [5, -1], [11, 5], [20, 20], [-3, 0]], dtype=np.float64)
+        np.testing.assert_allclose(compute_stations(xy, line), [0, 5, 15, 20, 0])
+
+    def test_read_las_xyz(self):
+        path = os.path.join(tempfile.mkdtemp(), "points.las")
+        points = [(100, 200, 300), (-50, 0, 25)]
+        record_length = 20
+
+        h = bytearray(227)
+        h[0:4] = b'LASF'
+        struct.pack_into('<BB', h, 24, 1, 2)
+        struct.pack_into('<HIIBHI', h, 94, 227, 227, 0, 0, record_length, len(points))
+        struct.pack_into('<3d', h, 131, 0.01, 0.01, 0.1)
+        struct.pack_into('<3d', h, 155, 1000, 2000, 0)
+
+        with open(path, 'wb') as f:
+            f.write(h)
+            for x, y, z in points:
+                f.write(struct.pack('<3i', x, y, z) + bytes(record_length - 12))
+
+        np.testing.assert_allclose(read_las_xyz(path), [[1001, 2002, 30], [999.5, 2000, 2.5]])
+        os.remove(path)
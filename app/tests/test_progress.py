@@ -0,0 +1,46 @@
+import time
+from django.test import TestCase
+
+from app.classes.progress import ProgressTracker
+
+
+class TestProgress(TestCase):
+    def test_progress_tracker(self):
+        calls = []
+        def callback(status, perc, **meta):
+            calls.append((status, perc, meta))
+
+        progress = ProgressTracker(callback, interval=0)
+        self.assertIsNone(progress.eta())
+
+        progress.start_stage("statistics")
+        time.sleep(0.05)
+        progress.start_stage("windows")
+        progress.update("Processing tile 0/2", 50, windows=1, bytes_read=100, bytes_written=50)
+
+        status, perc, meta = calls[-1]
+        self.assertEqual(status, "Processing tile 0/2")
+        self.assertEqual(perc, 50)
+        self.assertEqual(meta['stage'], "windows")
+        self.assertEqual(meta['bytes_read'], 100)
+        self.assertEqual(meta['bytes_written'], 50)
+        self.assertEqual(meta['windows'], 1)
+        self.assertTrue(meta['windows_per_sec'] > 0)
+        self.assertTrue(meta['eta'] is not None and meta['eta'] >= 0)
+        self.assertTrue(meta['stages']['statistics'] >= 0.05)
+        self.assertTrue('windows' in meta['stages'])
+
+        # Progress never goes above 100
+        progress.update("Done", 80)
+        self.assertEqual(calls[-1][1], 100)
+        self.assertEqual(calls[-1][2]['eta'], 0)
+
+    def test_throttling(self):
+        calls = []
+        progress = ProgressTracker(lambda status, perc, **meta: calls.append(perc), interval=60)
+        progress.update("a", 10)
+        progress.update("b", 10)
+        self.assertEqual(len(calls), 1)
+
+        progress.update("c", 10, force=True)
+        self.assertEqual(calls, [10, 30])
@@ -0,0 +1,156 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.test import TestCase
+
+from app.classes.remote_zip import RemoteZipExtractor, RemoteZipError, safe_arcname
+
+
+class TestRemoteZip(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr("odm_orthophoto/", "")
+            z.writestr("odm_orthophoto/odm_orthophoto.tif", os.urandom(200000), compress_type=zipfile.ZIP_STORED)
+            z.writestr("odm_georeferencing/odm_georeferenced_model.laz", b"points" * 50000, compress_type=zipfile.ZIP_DEFLATED)
+            z.writestr("../evil.txt", b"evil")
+        self.data = buf.getvalue()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def fetch(self, start, end, chunk_size=4096):
+        for i in range(start, end + 1, chunk_size):
+            yield self.data[i:min(i + chunk_size, end + 1)]
+
+    def test_extract(self):
+        progress = []
+        ex = RemoteZipExtractor(self.fetch, len(self.data), self.tmpdir, max_workers=2,
+                                progress_callback=lambda p: progress.append(p))
+        ex.extract()
+
+        with zipfile.ZipFile(io.BytesIO(self.data)) as z:
+            for name in ["odm_orthophoto/odm_orthophoto.tif", "odm_georeferencing/odm_georeferenced_model.laz"]:
+                with open(os.path.join(self.tmpdir, name), 'rb') as f:
+                    self.assertEqual(f.read(), z.read(name))
+
+        # Path traversal is prevented
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, "evil.txt")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "..", "evil.txt")))
+        self.assertEqual(progress[-1], 100.0)
+
+        # No leftover partial files
+        for root, dirs, files in os.walk(self.tmpdir):
+            self.assertFalse(any(f.endswith(".part") for f in files))
+
+    def test_corrupted_entry(self):
+        with zipfile.ZipFile(io.BytesIO(self.data)) as z:
+            info = z.getinfo("odm_georeferencing/odm_georeferenced_model.laz")
+
+        requests = []
+        corrupt = [True]
+
+        def fetch(start, end):
+            requests.append((start, end))
+            for chunk in self.fetch(start, end):
+                # Flip a byte in the compressed data the first time the entry is downloaded
+                if corrupt[0] and start == info.header_offset:
+                    corrupt[0] = False
+                    chunk = bytearray(chunk)
+                    chunk[100] ^= 0xFF
+                    chunk = bytes(chunk)
+                yield chunk
+
+        RemoteZipExtractor(fetch, len(self.data), self.tmpdir, max_workers=1).extract()
+
+        # Only the corrupted entry was downloaded twice
+        self.assertEqual(len([r for r in requests if r[0] == info.header_offset]), 2)
+        self.assertEqual(len(set(requests)), len(requests) - 1)
+
+        with open(os.path.join(self.tmpdir, info.filename), 'rb') as f:
+            self.assertEqual(f.read(), b"points" * 50000)
+
+        # Persistent corruption fails
+        def bad_fetch(start, end):
+            for chunk in self.fetch(start, end):
+                if start == info.header_offset:
+                    chunk = b"\x00" * len(chunk)
+                yield chunk
+
+        with self.assertRaises(zipfile.BadZipFile):
+            RemoteZipExtractor(bad_fetch, len(self.data), self.tmpdir, retries=1).extract()
+
+    def test_unsupported(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr("a.txt", b"aaaa" * 1000, compress_type=zipfile.ZIP_BZIP2)
+        data = buf.getvalue()
+
+        ex = RemoteZipExtractor(lambda s, e: [data[s:e + 1]], len(data), self.tmpdir)
+        with self.assertRaises(RemoteZipError):
+            ex.extract()
+
+    def test_safe_arcname(self):
+        self.assertEqual(safe_arcname("a/b/c.txt"), os.path.join("a", "b", "c.txt"))
+        self.assertEqual(safe_arcname("/../../etc/passwd"), os.path.join("etc", "passwd"))
+        self.assertEqual(safe_arcname("./"), "")
+
+    def test_resume(self):
+        with zipfile.ZipFile(io.BytesIO(self.data)) as z:
+            stored = z.getinfo("odm_orthophoto/odm_orthophoto.tif")
+            deflated = z.getinfo("odm_georeferencing/odm_georeferenced_model.laz")
+            stored_data = z.read(stored.filename)
+
+        state_file = os.path.join(self.tmpdir, ".download.json")
+        requests = []
+
+        class Interrupted(Exception):
+            pass
+
+        def interrupted_fetch(start, end):
+            requests.append((start, end))
+            sent = 0
+            for chunk in self.fetch(start, end):
+                # Connection drops halfway through the stored entry
+                if start == stored.header_offset and sent > stored.compress_size // 2:
+                    raise Interrupted()
+                sent += len(chunk)
+                yield chunk
+
+        with self.assertRaises(Interrupted):
+            RemoteZipExtractor(interrupted_fetch, len(self.data), self.tmpdir, max_workers=1,
+                               state_file=state_file, key="uuid").extract()
+
+        # The deflated entry has been extracted, the stored one is partial
+        self.assertTrue(os.path.isfile(state_file))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, deflated.filename)))
+        part = os.path.join(self.tmpdir, stored.filename + ".part")
+        self.assertTrue(0 < os.path.getsize(part) < stored.file_size)
+
+        # A different archive does not resume
+        ex = RemoteZipExtractor(self.fetch, len(self.data), self.tmpdir, state_file=state_file, key="other")
+        self.assertEqual(ex.load_state(ex.read_entries()), set())
+
+        requests.clear()
+
+        def fetch(start, end):
+            requests.append((start, end))
+            return self.fetch(start, end)
+
+        RemoteZipExtractor(fetch, len(self.data), self.tmpdir, max_workers=1,
+                           state_file=state_file, key="uuid").extract()
+
+        # Extracted entries are not downloaded again, the partial one continues
+        self.assertFalse(any(r[0] == deflated.header_offset for r in requests))
+        self.assertTrue(any(stored.header_offset + stored.compress_size // 2 < r[0] < stored.header_offset + stored.compress_size for r in requests))
+        self.assertFalse(any(r[0] == stored.header_offset and r[1] > stored.header_offset + 100 for r in requests))
+
+        with open(os.path.join(self.tmpdir, stored.filename), 'rb') as f:
+            self.assertEqual(f.read(), stored_data)
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(state_file))
@@ -0,0 +1,85 @@
+import io
+import os
+import json
+import shutil
+import zipfile
+import tempfile
+
+from django.test import TestCase
+
+from app.classes.seekable_zip import SeekableZip, write_archive
+
+
+class TestSeekableZip(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.crc_cache = os.path.join(self.tmpdir, "crc.json")
+        self.files = {}
+        for name, data in [("tiles/0/0/0.png", os.urandom(20000)),
+                           ("tiles/0/0/1.png", os.urandom(5000)),
+                           ("model.obj", b"v 0 0 0\n" * 1000),
+                           ("empty.txt", b"")]:
+            path = os.path.join(self.tmpdir, "src", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.files[name] = data
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_zip(self):
+        zs = SeekableZip(crc_cache=self.crc_cache, comment="Generated by WebODM")
+        for name in sorted(self.files):
+            zs.add_path(os.path.join(self.tmpdir, "src", name), name)
+        zs.add(b'{"ok": true}', "data/info.json")
+        return zs
+
+    def test_ranges(self):
+        zs = self.make_zip()
+        archive = b"".join(zs)
+        self.assertEqual(len(archive), len(zs))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.comment, b"Generated by WebODM")
+            for name, data in self.files.items():
+                self.assertEqual(z.read(name), data)
+            self.assertEqual(json.loads(z.read("data/info.json")), {"ok": True})
+
+        # CRCs are cached while streaming
+        with open(self.crc_cache, 'r') as f:
+            self.assertEqual(len(json.loads(f.read())), len(self.files))
+
+        # Any byte range can be generated
+        for start, end in [(0, 0), (10, 20100), (5000, len(archive) - 1), (len(archive) - 30, len(archive) - 1)]:
+            self.assertEqual(b"".join(self.make_zip().iter_range(start, end)), archive[start:end + 1])
+
+        # Without a cache too
+        os.remove(self.crc_cache)
+        self.assertEqual(b"".join(self.make_zip().iter_range(25000, len(archive) - 1)), archive[25000:])
+
+        # Same files, same ETag
+        self.assertEqual(self.make_zip().etag(), self.make_zip().etag())
+
+        # In-memory entries with a fixed modification time generate the same archive
+        def make_data_zip(mtime):
+            zs = SeekableZip()
+            zs.add(b'{"ok": true}', "data/info.json", mtime=mtime)
+            return zs
+
+        self.assertEqual(b"".join(make_data_zip(1500000000)), b"".join(make_data_zip(1500000000)))
+        self.assertEqual(make_data_zip(1500000000).etag(), make_data_zip(1500000000).etag())
+        self.assertNotEqual(make_data_zip(1500000000).etag(), make_data_zip(1600000000).etag())
+
+    def test_write_archive(self):
+        archive_path = os.path.join(self.tmpdir, "archive.zip")
+        write_archive(os.path.join(self.tmpdir, "src"), archive_path)
+
+        with zipfile.ZipFile(archive_path) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.getinfo("tiles/0/0/0.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(z.getinfo("model.obj").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(sorted(z.namelist()), sorted(self.files.keys()))
+
+        self.assertEqual([f for f in os.listdir(self.tmpdir) if f.endswith(".tmp")], [])
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from app.classes.stages import StageRunner
+
+
+class TestStages(TestCase):
+    def test_dependencies(self):
+        order = []
+        lock = threading.Lock()
+
+        def stage(name, delay=0):
+            def run():
+                time.sleep(delay)
+                with lock:
+                    order.append(name)
+            return run
+
+        changes = []
+        runner = StageRunner(max_workers=4, on_change=lambda r: changes.append(r.progress()))
+        a = runner.add("a", stage("a", 0.1))
+        b = runner.add("b", stage("b"))
+        c = runner.add("c", stage("c"), deps=[a, b])
+        runner.add("d", stage("d"), deps=[b])
+
+        result = runner.run()
+
+        # Independent stages run concurrently, dependencies are respected
+        self.assertTrue(order.index("b") < order.index("a"))
+        self.assertTrue(order.index("d") < order.index("a"))
+        self.assertEqual(order[-1], "c")
+        self.assertTrue(all(s['status'] == 'done' and s['attempts'] == 1 for s in result.values()))
+        self.assertTrue(runner.is_done("a", "b", "c", "d"))
+        self.assertEqual(changes[-1], 1.0)
+
+        with self.assertRaises(ValueError):
+            runner.add("e", stage("e"), deps=["missing"])
+
+    def test_failures(self):
+        attempts = [0]
+
+        def flaky():
+            attempts[0] += 1
+            if attempts[0] < 2:
+                raise IOError("flaky")
+
+        def broken():
+            raise IOError("broken")
+
+        runner = StageRunner()
+        runner.add("flaky", flaky, retries=1)
+        runner.add("optional", broken, required=False)
+        runner.add("after_optional", lambda: None, deps=["optional"])
+        runner.add("after_flaky", lambda: None, deps=["flaky"])
+
+        result = runner.run()
+        self.assertEqual(result['flaky']['status'], 'done')
+        self.assertEqual(result['flaky']['attempts'], 2)
+        self.assertEqual(result['optional']['status'], 'failed')
+        self.assertEqual(result['optional']['error'], 'broken')
+        self.assertEqual(result['after_optional']['status'], 'skipped')
+        self.assertEqual(result['after_flaky']['status'], 'done')
+
+        runner = StageRunner()
+        runner.add("required", broken)
+        runner.add("other", lambda: None)
+        with self.assertRaises(IOError):
+            runner.run()
+        self.assertTrue(runner.is_done("other"))
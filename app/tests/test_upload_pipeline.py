@@ -0,0 +1,65 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from app.classes.upload_pipeline import UploadPipeline
+
+
+class TestUploadPipeline(TestCase):
+    def test_upload(self):
+        uploaded = []
+        attempts = {}
+        lock = threading.Lock()
+
+        def upload(path):
+            with lock:
+                attempts[path] = attempts.get(path, 0) + 1
+                if path == "flaky.jpg" and attempts[path] < 3:
+                    raise IOError("connection reset")
+                uploaded.append(path)
+            time.sleep(0.01)
+
+        pipeline = UploadPipeline(upload, parallel_uploads=3, queue_size=2, retry_timeout=0, retry_on=(IOError, )).start()
+        files = ["%s.jpg" % i for i in range(20)] + ["flaky.jpg"]
+        for f in files:
+            pipeline.put(f)
+
+        callbacks = []
+        pipeline.finish(lambda: callbacks.append(pipeline.progress()), interval=0)
+
+        self.assertEqual(sorted(uploaded), sorted(files))
+        self.assertEqual(attempts["flaky.jpg"], 3)
+        self.assertEqual(pipeline.progress(), 1.0)
+        self.assertEqual(pipeline.threads, [])
+
+    def test_errors(self):
+        def upload(path):
+            if path == "bad.jpg":
+                raise ValueError("rejected")
+
+        pipeline = UploadPipeline(upload, parallel_uploads=2, queue_size=1).start()
+        pipeline.put("bad.jpg")
+
+        # The error stops the pipeline
+        with self.assertRaises(ValueError):
+            for i in range(100):
+                pipeline.put("%s.jpg" % i)
+                time.sleep(0.01)
+        with self.assertRaises(ValueError):
+            pipeline.finish()
+        self.assertEqual(pipeline.threads, [])
+
+        # Interrupted while waiting (e.g. the task was canceled)
+        event = threading.Event()
+        pipeline = UploadPipeline(lambda p: event.wait(5), parallel_uploads=1).start()
+        pipeline.put("a.jpg")
+        pipeline.put("b.jpg")
+
+        def cancel():
+            event.set()
+            raise InterruptedError()
+
+        with self.assertRaises(InterruptedError):
+            pipeline.finish(cancel, interval=0)
+        self.assertTrue(pipeline.uploaded < 2)
@@ -1,7 +1,10 @@
 import os
+import time
 from stat import ST_ATIME, ST_MTIME
+from datetime import timedelta
 
 import json
+from unittest import mock
 
 import worker
 from app.models import Project
@@ -9,10 +12,14 @@ from app.models import Task
 from nodeodm.models import ProcessingNode
 from webodm import settings
 from .classes import BootTestCase
-from .utils import start_processing_node
+from .utils import start_processing_node, catch_signal
 from worker.tasks import redis_client
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.utils import timezone
+from django.db.models.signals import post_save
+from nodeodm import status_codes
+from app import pending_actions
 
 class TestWorker(BootTestCase):
     def setUp(self):
@@ -33,7 +40,11 @@ class TestWorker(BootTestCase):
         self.assertTrue(pnode.api_version is None)
 
         with start_processing_node():
-            worker.tasks.update_nodes_info()
+            # post_save receivers are notified of the updates
+            with catch_signal(post_save) as handler:
+                worker.tasks.update_nodes_info()
+            self.assertTrue(any(c[1]['sender'] == ProcessingNode and c[1]['instance'].id == pnode.id
+                                for c in handler.call_args_list))
 
             pnode.refresh_from_db()
             self.assertTrue(pnode.api_version is not None)
@@ -121,6 +132,125 @@ class TestWorker(BootTestCase):
         worker.tasks.cleanup_tmp_directory()
         self.assertFalse(os.path.exists(tmpdir))
 
+    @mock.patch('webodm.settings.TASK_POLL_MIN_INTERVAL', 5)
+    @mock.patch('webodm.settings.TASK_POLL_MAX_INTERVAL', 20)
+    def test_pending_tasks(self):
+        project = Project.objects.get(name="User Test Project")
+        pnode = ProcessingNode.objects.create(hostname="localhost", port=11223)
+        task = Task.objects.create(project=project, processing_node=pnode, uuid="11111111-1111-1111-1111-111111111111",
+                                   status=status_codes.RUNNING)
+
+        # Tasks are due for a status check when they've never been checked
+        self.assertTrue(worker.tasks.get_pending_tasks().filter(pk=task.id).exists())
+
+        # Or their next check time has passed
+        task.next_check_at = timezone.now() + timedelta(minutes=1)
+        task.save()
+        self.assertFalse(worker.tasks.get_pending_tasks().filter(pk=task.id).exists())
+
+        task.next_check_at = timezone.now() - timedelta(seconds=1)
+        task.save()
+        self.assertTrue(worker.tasks.get_pending_tasks().filter(pk=task.id).exists())
+
+        # Pending actions are always due
+        task.next_check_at = timezone.now() + timedelta(minutes=1)
+        task.pending_action = 1
+        task.save()
+        self.assertTrue(worker.tasks.get_pending_tasks().filter(pk=task.id).exists())
+
+        # Copies being duplicated are due for their pending action only,
+        # their status is not checked (they share the UUID of the original)
+        task.pending_action = None
+        task.next_check_at = None
+        task.save()
+        copy = Task.objects.create(project=project, processing_node=pnode, uuid=task.uuid,
+                                   status=status_codes.RUNNING, pending_action=pending_actions.DUPLICATE,
+                                   next_check_at=timezone.now() + timedelta(minutes=1))
+        self.assertTrue(worker.tasks.get_pending_tasks().filter(pk=copy.id).exists())
+
+        with mock.patch.object(ProcessingNode, 'get_tasks_info', return_value={}) as get_tasks_info:
+            self.assertEqual(worker.tasks.poll_running_tasks(Task.objects.filter(pk=copy.id)), set())
+            get_tasks_info.assert_not_called()
+
+            worker.tasks.poll_running_tasks(Task.objects.filter(pk__in=[task.id, copy.id]))
+            self.assertEqual(list(get_tasks_info.call_args[0][0].keys()), [task.uuid])
+        copy.delete()
+
+        # Status checks back off while nothing changes
+        redis_client.delete('task_poll_interval_{}'.format(task.id))
+        intervals = []
+        for changed in [False, False, False, False, True]:
+            task.schedule_next_check(changed=changed)
+            intervals.append(round((task.next_check_at - timezone.now()).total_seconds()))
+        self.assertEqual(intervals, [5, 10, 20, 20, 5])
+
+        task.status = status_codes.COMPLETED
+        task.schedule_next_check()
+        self.assertIsNone(task.next_check_at)
+
+    def test_locks(self):
+        redis_client.delete('test_lock')
+
+        lock = worker.tasks.acquire_lock('test_lock', 30)
+        self.assertIsNotNone(lock)
+        self.assertIsNone(worker.tasks.acquire_lock('test_lock', 30))
+        self.assertTrue(0 < redis_client.ttl('test_lock') <= 30)
+
+        # Locks are not released by someone else
+        worker.tasks.release_lock('test_lock', "stale")
+        self.assertIsNotNone(redis_client.get('test_lock'))
+        worker.tasks.release_lock('test_lock', lock)
+        self.assertIsNone(redis_client.get('test_lock'))
+
+        # Tasks locked by process_task
+        redis_client.set('task_lock_998', time.time() - 60)
+        redis_client.set('task_lock_999', time.time())
+        redis_client.delete('task_lock_1000')
+        self.assertEqual(worker.tasks.get_locked_tasks([998, 999, 1000]), {999})
+        redis_client.delete('task_lock_998', 'task_lock_999')
+
+        # The poll lock lasts as long as polling can take
+        with mock.patch.multiple('webodm.settings', NODE_POLL_MAX_CONNECTIONS=8, NODE_HTTP_CONNECT_TIMEOUT=5,
+                                 NODE_HTTP_TIMEOUT=30, NODE_HTTP_RETRIES=2):
+            self.assertEqual(worker.tasks.poll_timeout(1), 2 * 35 * 3)
+            self.assertEqual(worker.tasks.poll_timeout(9), 3 * 35 * 3)
+
+    def test_reconcile_task_counters(self):
+        project = Project.objects.get(name="User Test Project")
+        task = Task.objects.create(project=project, partial=True)
+        task.create_task_directories()
+
+        with open(task.task_path("a.jpg"), 'wb') as f:
+            f.write(b"a" * 1024 * 1024)
+
+        # Counters are updated incrementally
+        task.add_to_counters(2, 2 * 1024 * 1024)
+        self.assertEqual(task.images_count, 2)
+        self.assertAlmostEqual(task.size, 2.0)
+
+        # Tasks with recent upload activity are left alone
+        # (an upload might not have added its files to the counters yet)
+        with mock.patch('webodm.settings.TASK_RECONCILE_IDLE_TIME', 120):
+            worker.tasks.reconcile_task_counters()
+        task.refresh_from_db()
+        self.assertEqual(task.images_count, 2)
+
+        # Otherwise they are fixed by the reconciliation job
+        past = time.time() - 300
+        os.utime(task.task_path("a.jpg"), (past, past))
+        os.utime(task.task_path(), (past, past))
+        with mock.patch('webodm.settings.TASK_RECONCILE_IDLE_TIME', 120):
+            worker.tasks.reconcile_task_counters()
+        task.refresh_from_db()
+        self.assertEqual(task.images_count, 1)
+        self.assertAlmostEqual(task.size, 1.0, places=2)
+
+        # Only for tasks that have not been processed yet
+        Task.objects.filter(pk=task.id).update(partial=False, status=status_codes.COMPLETED, images_count=5)
+        worker.tasks.reconcile_task_counters()
+        task.refresh_from_db()
+        self.assertEqual(task.images_count, 5)
+
     def test_workers_api(self):
         client = APIClient()
 
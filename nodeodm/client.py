@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pyodm import Node
+from pyodm.exceptions import NodeConnectionError, NodeResponseError, NodeServerError
+
+from webodm import settings
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _retry_policy(retries):
+    kwargs = dict(total=retries,
+                  connect=retries,
+                  read=0,
+                  backoff_factor=settings.NODE_HTTP_RETRY_BACKOFF,
+                  status_forcelist=[502, 503, 504],
+                  raise_on_status=False)
+    try:
+        # Only retry idempotent requests
+        return Retry(allowed_methods=frozenset(['GET', 'HEAD']), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(['GET', 'HEAD']), **kwargs)
+
+
+def get_session(host, port, retries=None):
+    """
+    :param retries: number of retries of failed requests (defaults to NODE_HTTP_RETRIES)
+    :return: a requests.Session with a bounded pool of keep-alive connections
+        to a processing node, shared by all clients in this process
+        that use the same number of retries
+    """
+    if retries is None:
+        retries = settings.NODE_HTTP_RETRIES
+
+    key = (os.getpid(), host, port, retries)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=settings.NODE_HTTP_POOL_SIZE,
+                                      max_retries=_retry_policy(retries))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class PooledNode(Node):
+    """
+    pyodm Node that sends its API requests through a pooled keep-alive session.
+    This includes asset downloads (pyodm's Task.download_zip calls get with stream=True):
+    a streamed response holds its connection until the body has been read or closed.
+    Parallel downloads beyond NODE_HTTP_POOL_SIZE use extra connections that are
+    discarded once released, and bodies are never retried (read=0)
+    """
+
+    def __init__(self, host, port, token="", timeout=30, retries=None):
+        super().__init__(host, port, token, timeout)
+        self.session = get_session(host, port, retries)
+
+    def request_timeout(self):
+        return (min(settings.NODE_HTTP_CONNECT_TIMEOUT, self.timeout), self.timeout)
+
+    def handle_response(self, res, ok_codes):
+        if res.status_code == 401:
+            raise NodeResponseError("Unauthorized. Do you need to set a token?")
+        elif not res.status_code in ok_codes:
+            raise NodeServerError("Unexpected status code: %s" % res.status_code)
+
+        if "Content-Type" in res.headers and "application/json" in res.headers['Content-Type']:
+            result = res.json()
+            if 'error' in result:
+                raise NodeResponseError(result['error'])
+            return result
+        else:
+            return res
+
+    def get(self, url, query={}, **kwargs):
+        try:
+            res = self.session.get(self.url(url, query), timeout=self.request_timeout(), **kwargs)
+            return self.handle_response(res, [200, 403, 206])
+        except json.decoder.JSONDecodeError as e:
+            raise NodeServerError(str(e))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            raise NodeConnectionError(str(e))
+
+    def post(self, url, data=None, headers={}):
+        try:
+            res = self.session.post(self.url(url), data=data, headers=headers, timeout=self.request_timeout())
+            return self.handle_response(res, [200, 403])
+        except json.decoder.JSONDecodeError as e:
+            raise NodeServerError(str(e))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            raise NodeConnectionError(str(e))
@@ -11,9 +11,15 @@ from django.utils.translation import gettext_lazy as _
 
 from webodm import settings
 
+import os
 import json
+import mimetypes
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from pyodm import Node
 from pyodm import exceptions
+from pyodm.utils import MultipartEncoder, options_to_json
+from .client import PooledNode
 from django.db.models import signals
 from datetime import timedelta
 import logging
@@ -66,17 +72,27 @@ class ProcessingNode(models.Model):
         return self.last_refreshed is not None and \
                self.last_refreshed >= timezone.now() - timedelta(minutes=settings.NODE_OFFLINE_MINUTES)
 
-    def update_node_info(self):
+    # Fields written by update_node_info
+    NODE_INFO_FIELDS = ['api_version', 'queue_count', 'max_images', 'engine_version', 'engine', 'available_options', 'last_refreshed']
+
+    def update_node_info(self, commit=True):
         """
         Retrieves information and options from the node API
-        and saves it into the database.
+        and saves it into the database. Options are only retrieved
+        when the node's engine or API version changes, since they
+        depend on the version and are large.
 
+        :param commit: when True also saves the model, otherwise the caller should save the NODE_INFO_FIELDS
         :returns: True if information could be updated, False otherwise
         """
-        api_client = self.api_client(timeout=5)
+        # Don't retry, so that an offline node costs a single timeout
+        api_client = self.api_client(timeout=settings.NODE_INFO_TIMEOUT, retries=0)
         try:
             info = api_client.info()
 
+            options_changed = not self.available_options or \
+                              (self.engine, self.engine_version, self.api_version) != (info.engine, info.engine_version, info.version)
+
             self.api_version = info.version
             self.queue_count = info.task_queue_count
 
@@ -87,16 +103,19 @@ class ProcessingNode(models.Model):
             self.engine_version = info.engine_version
             self.engine = info.engine
 
-            options = list(map(lambda o: o.__dict__, api_client.options()))
-            self.available_options = options
+            if options_changed:
+                options = list(map(lambda o: o.__dict__, api_client.options()))
+                self.available_options = options
             self.last_refreshed = timezone.now()
-            self.save()
+            if commit: self.save()
             return True
         except exceptions.OdmError:
             return False
 
-    def api_client(self, timeout=30):
-        return Node(self.hostname, self.port, self.token, timeout)
+    def api_client(self, timeout=None, retries=None):
+        if timeout is None:
+            timeout = settings.NODE_HTTP_TIMEOUT
+        return PooledNode(self.hostname, self.port, self.token, timeout, retries)
 
     def get_available_options_json(self, pretty=False):
         """
@@ -140,22 +159,134 @@ class ProcessingNode(models.Model):
         task = api_client.create_task(images, opts, name, progress_callback)
         return task.uuid
 
-    def get_task_info(self, uuid, with_output=None):
+    def supports_staged_upload(self, api_client=None):
+        """
+        :return: True if the node can create tasks in stages
+            (init, upload of each file, commit)
+        """
+        if self.api_version:
+            return Node.compare_version(self.api_version, "1.4.0") >= 0
+        else:
+            if api_client is None:
+                api_client = self.api_client()
+            return api_client.version_greater_or_equal_than("1.4.0")
+
+    def init_task(self, name=None, options=[], api_client=None):
+        """
+        Creates a new task that will receive its files one at a time
+        (see upload_task_file and commit_task). Requires API version >= 1.4.0
+        :param name: name of the task
+        :param options: options to be used for processing ([{'name': optionName, 'value': optionValue}, ...])
+        :returns UUID of the new task
+        """
+        if api_client is None:
+            api_client = self.api_client()
+
+        e = MultipartEncoder(fields={
+            'name': name,
+            'options': options_to_json(self.options_list_to_dict(options)),
+        })
+        result = api_client.post('/task/new/init', data=e, headers={'Content-Type': e.content_type})
+        if isinstance(result, dict) and 'uuid' in result:
+            return result['uuid']
+        else:
+            raise exceptions.NodeServerError("Invalid response from /task/new/init: %s" % result)
+
+    def upload_task_file(self, uuid, file_path, api_client=None):
+        """
+        Uploads a file (image, GCP file, etc.) to a task created with init_task
+        """
+        if api_client is None:
+            api_client = self.api_client()
+
+        with open(file_path, 'rb') as f:
+            e = MultipartEncoder(fields={
+                'images': [(os.path.basename(file_path), f.read(), (mimetypes.guess_type(file_path)[0] or "image/jpg"))]
+            })
+        result = api_client.post('/task/new/upload/{}'.format(uuid), data=e, headers={'Content-Type': e.content_type})
+
+        if not (isinstance(result, dict) and result.get('success')):
+            raise exceptions.NodeServerError("Failed upload with unexpected result: %s" % str(result))
+
+    def commit_task(self, uuid, api_client=None):
+        """
+        Starts processing a task created with init_task once all of its files have been uploaded
+        :returns UUID of the task
+        """
+        if api_client is None:
+            api_client = self.api_client()
+
+        result = api_client.post('/task/new/commit/{}'.format(uuid))
+        if isinstance(result, dict) and 'uuid' in result:
+            return result['uuid']
+        else:
+            raise exceptions.NodeServerError("Invalid response from /task/new/commit: %s" % result)
+
+    def supports_output_in_info(self, api_client):
+        """
+        :return: True if the node can return console output along with task info
+            (uses the stored API version to avoid a request when possible)
+        """
+        if self.api_version:
+            return Node.compare_version(self.api_version, "1.5.1") >= 0
+        else:
+            return api_client.version_greater_or_equal_than("1.5.1")
+
+    def get_task_info(self, uuid, with_output=None, api_client=None):
         """
         Gets information about this task, such as name, creation date, 
         processing time, status, command line options and number of 
         images being processed.
+        :param api_client: optional client to reuse
         """
-        api_client = self.api_client()
+        if api_client is None:
+            api_client = self.api_client()
         task = api_client.get_task(uuid)
         task_info = task.info(with_output)
 
         # Output support for older clients
-        if not api_client.version_greater_or_equal_than("1.5.1") and with_output:
-            task_info.output = self.get_task_console_output(uuid, with_output)
+        if with_output and not self.supports_output_in_info(api_client):
+            task_info.output = task.output(with_output)
 
         return task_info
 
+    def get_tasks_info(self, tasks, max_workers=None):
+        """
+        Gets information about many tasks of this node in a single pass,
+        reusing the same client for all requests.
+        :param tasks: dictionary of UUID --> number of console lines already retrieved
+        :param max_workers: maximum number of concurrent requests
+        :return: dictionary of UUID --> TaskInfo, or the OdmError raised while
+            retrieving it (tasks no longer on the node get a NodeResponseError)
+        :raises NodeConnectionError: if the node cannot be reached
+        """
+        if len(tasks) == 0:
+            return {}
+
+        api_client = self.api_client()
+
+        # One request to find out which tasks the node still knows about
+        try:
+            listed = set([t['uuid'] for t in api_client.get('/task/list')])
+        except exceptions.NodeConnectionError:
+            raise
+        except exceptions.OdmError:
+            listed = None
+
+        def fetch(uuid, with_output):
+            if listed is not None and uuid not in listed:
+                return uuid, exceptions.NodeResponseError("Task {} not found".format(uuid))
+            try:
+                return uuid, self.get_task_info(uuid, with_output, api_client=api_client)
+            except exceptions.OdmError as e:
+                return uuid, e
+
+        if max_workers is None:
+            max_workers = settings.NODE_POLL_MAX_CONNECTIONS
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+            return dict(executor.map(lambda t: fetch(*t), tasks.items()))
+
     def get_task_console_output(self, uuid, line):
         """
         Retrieves the console output of the OpenDroneMap's process.
@@ -189,6 +320,49 @@ class ProcessingNode(models.Model):
         task = api_client.get_task(uuid)
         return task.download_zip(destination, progress_callback, parallel_downloads=parallel_downloads)
 
+    def get_task_assets_size(self, uuid, api_client=None):
+        """
+        :return: size in bytes of a task's assets archive,
+            or None if the node cannot serve it with range requests
+        """
+        if api_client is None:
+            api_client = self.api_client()
+        res = api_client.get('/task/{}/download/all.zip'.format(uuid), stream=True, headers={'Range': 'bytes=0-0'})
+        if isinstance(res, dict):
+            raise exceptions.NodeResponseError(res.get('error', "Unexpected response: {}".format(json.dumps(res))))
+        res.close()
+
+        content_range = res.headers.get('content-range', '')
+        if res.status_code != 206 or not '/' in content_range:
+            return None
+        try:
+            return int(content_range.split('/')[-1])
+        except ValueError:
+            return None
+
+    def fetch_task_assets_range(self, uuid, start, end, api_client=None):
+        """
+        Downloads a byte range of a task's assets archive
+        :param start: first byte
+        :param end: last byte (inclusive)
+        :return: iterator over the downloaded data
+        """
+        if api_client is None:
+            api_client = self.api_client()
+        res = api_client.get('/task/{}/download/all.zip'.format(uuid), stream=True, headers={'Range': 'bytes={}-{}'.format(start, end)})
+        if isinstance(res, dict):
+            raise exceptions.NodeResponseError(res.get('error', "Unexpected response: {}".format(json.dumps(res))))
+
+        try:
+            if res.status_code != 206:
+                raise exceptions.RangeNotAvailableError()
+            for chunk in res.iter_content(1024 * 64):
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            raise exceptions.NodeConnectionError(str(e))
+        finally:
+            res.close()
+
     def restart_task(self, uuid, options = None):
         """
         Restarts a task that was previously canceled or that had failed to process
@@ -5,6 +5,7 @@ import requests
 from django.test import TestCase
 from django.utils import six
 import time
+from unittest import mock
 from django.utils import timezone
 from os import path
 
@@ -70,11 +71,44 @@ class TestClientApi(TestCase):
             self.assertTrue(isinstance(online_node.get_available_options_json(), six.string_types), "Available options json works")
             self.assertTrue(isinstance(online_node.get_available_options_json(pretty=True), six.string_types), "Available options json works with pretty")
 
+            # Options are only retrieved again when the engine version changes
+            online_node.available_options = [{'name': 'cached'}]
+            self.assertTrue(online_node.update_node_info())
+            online_node.refresh_from_db()
+            self.assertEqual(online_node.available_options, [{'name': 'cached'}])
+
+            online_node.engine_version = "0.0.0"
+            self.assertTrue(online_node.update_node_info(commit=False))
+            self.assertTrue(len(online_node.available_options) > 1)
+            online_node.refresh_from_db()
+            self.assertEqual(online_node.available_options, [{'name': 'cached'}])
+
+
+    def test_pooled_api_client(self):
+        online_node = ProcessingNode.objects.get(pk=1)
+        token_node = ProcessingNode.objects.get(pk=3)
+        offline_node = ProcessingNode.objects.get(pk=2)
+
+        # Clients for the same host share connections
+        client = online_node.api_client()
+        self.assertTrue(client.session is online_node.api_client(timeout=5).session)
+        self.assertTrue(client.session is token_node.api_client().session)
+        self.assertFalse(client.session is offline_node.api_client().session)
+
+        self.assertEqual(online_node.api_client(timeout=60).request_timeout(), (settings.NODE_HTTP_CONNECT_TIMEOUT, 60))
+        self.assertEqual(online_node.api_client(timeout=2).request_timeout(), (2, 2))
+
+        with start_processing_node():
+            # Connections are reused across requests
+            self.assertTrue(isinstance(client.info().version, six.string_types))
+            self.assertTrue(len(client.options()) > 0)
+            self.assertEqual(token_node.api_client().info().version, client.info().version)
 
     def test_offline_processing_node(self):
         offline_node = ProcessingNode.objects.get(pk=2)
         self.assertFalse(offline_node.update_node_info(), "Could not update info (offline)")
         self.assertTrue(offline_node.api_version == "", "API version is not set")
+        self.assertRaises(NodeConnectionError, offline_node.get_tasks_info, {"uuid": 0})
 
     def test_auto_update_node_info(self):
         with start_processing_node():
@@ -121,6 +155,13 @@ class TestClientApi(TestCase):
             self.assertTrue(isinstance(task_info.date_created, datetime))
             self.assertTrue(isinstance(task_info.uuid, str))
 
+            # Can get info about many tasks at once
+            infos = online_node.get_tasks_info({uuid: 0, "wrong-uuid": 0})
+            self.assertEqual(infos[uuid].uuid, uuid)
+            self.assertTrue(isinstance(infos[uuid].output, list))
+            self.assertTrue(isinstance(infos["wrong-uuid"], NodeResponseError))
+            self.assertEqual(online_node.get_tasks_info({}), {})
+
             # Can download assets?
             # Here we are waiting for the task to be completed
             wait_for_status(api, uuid, status_codes.COMPLETED, 10, "Could not download assets")
@@ -164,6 +205,13 @@ class TestClientApi(TestCase):
 
             # Task has been deleted
             self.assertRaises(NodeResponseError, online_node.get_task_info, uuid)
+            self.assertRaises(NodeResponseError, online_node.get_task_assets_size, uuid)
+
+            # JSON responses to asset downloads are errors
+            json_client = mock.Mock()
+            json_client.get.return_value = {'status': 'unexpected'}
+            self.assertRaises(NodeResponseError, online_node.get_task_assets_size, uuid, api_client=json_client)
+            self.assertRaises(NodeResponseError, lambda: list(online_node.fetch_task_assets_range(uuid, 0, 10, api_client=json_client)))
 
             # Test URL building for HTTPS
             sslApi = Node("localhost", 443, 'abc')
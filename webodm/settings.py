@@ -265,6 +265,7 @@ if TESTING:
     MEDIA_ROOT = os.path.join(BASE_DIR, 'app', 'media_test')
 MEDIA_TMP = os.path.join(MEDIA_ROOT, 'tmp')
 MEDIA_CACHE = os.path.join(MEDIA_ROOT, 'CACHE')
+IMAGE_STORE_DIR = os.path.join(MEDIA_ROOT, 'image_store')
 
 FILE_UPLOAD_TEMP_DIR = MEDIA_TMP
 
@@ -387,12 +388,117 @@ CLEANUP_PARTIAL_TASKS = 72
 # are removed for users that have zero quotas
 CLEANUP_EMPTY_PROJECTS = None
 
+# Interval (in seconds) between status checks of tasks running on processing nodes.
+# The interval doubles up to the maximum while a task's status doesn't change
+TASK_POLL_MIN_INTERVAL = 5
+TASK_POLL_MAX_INTERVAL = 60
+
+# HTTP settings for requests to processing nodes. Connections to each node
+# are kept alive and shared within a process (up to NODE_HTTP_POOL_SIZE).
+# Failed connections and 502/503/504 replies to GET requests are retried
+# NODE_HTTP_RETRIES times, waiting NODE_HTTP_RETRY_BACKOFF * 2^n seconds
+NODE_HTTP_TIMEOUT = 30
+NODE_HTTP_CONNECT_TIMEOUT = 5
+NODE_HTTP_POOL_SIZE = 16
+NODE_HTTP_RETRIES = 2
+NODE_HTTP_RETRY_BACKOFF = 0.5
+
+# Timeout (in seconds) and maximum number of nodes queried concurrently
+# when refreshing processing node information
+NODE_INFO_TIMEOUT = 5
+NODE_INFO_MAX_WORKERS = 8
+
+# Maximum number of concurrent requests used to check
+# the status of the tasks running on a processing node
+NODE_POLL_MAX_CONNECTIONS = 8
+
+# Queue tasks for processing as soon as they are saved with a pending action
+# (or need to be sent to a processing node), rather than at the next scheduler tick
+TASK_SCHEDULE_ON_SAVE = True
+
+# Number of seconds after which a queued task can be queued again
+# (in case the worker that was going to process it was lost)
+TASK_SCHEDULE_DEDUP_TIMEOUT = 120
+
+# Number of seconds a task directory must go without changes before
+# the images count and size of the task are recomputed from disk
+# (uploads add to the counters after writing their files)
+TASK_RECONCILE_IDLE_TIME = 120
+
+# Extract the results of tasks while they download from processing nodes
+# (with range requests, one archive entry at a time) instead of downloading
+# all.zip first. Up to TASK_STREAMING_EXTRACT_MAX_WORKERS entries are downloaded at the same time
+TASK_STREAMING_EXTRACT = True
+TASK_STREAMING_EXTRACT_MAX_WORKERS = 8
+
+# Maximum number of post-processing stages (COG conversions, extents,
+# georeferencing checks, etc.) run concurrently once the results of a task have been extracted
+TASK_STAGES_MAX_WORKERS = 4
+
 # Maximum number of threads that a worker should use for processing
 WORKERS_MAX_THREADS = 2
 
+# Upload images to processing nodes while they are being resized
+# (for processing nodes with API version >= 1.4.0)
+TASK_PIPELINED_UPLOAD = True
+
+# Number of files uploaded at the same time to a processing node
+TASK_PARALLEL_UPLOADS = 4
+
+# Number of seconds after which a chunked upload that is not receiving chunks
+# expires. Until then clients can query the chunks received and resume the upload
+UPLOAD_SESSION_TTL = 60 * 60 * 24 * 3
+
+# Number of backup manifests kept for each task. Incremental backups
+# can only be made against one of the last TASK_BACKUP_MANIFESTS backups
+TASK_BACKUP_MANIFESTS = 30
+
+# Store uploaded images once in a content-addressed store (IMAGE_STORE_DIR)
+# and hard link them from task directories, so that tasks created from the same images
+# share them on disk (and in quota usage). Requires IMAGE_STORE_DIR and the task directories
+# to be on the same filesystem
+IMAGE_STORE = False
+
+# Maximum number of images resized at the same time
+# (None to use all available cores)
+IMAGE_RESIZE_MAX_WORKERS = None
+
 # Maximum number of seconds a worker task should take before being terminated
 WORKERS_MAX_TIME_LIMIT = None
 
+# Celery queue used for building EPT point clouds
+# A separate worker pool consumes from this queue (see worker.sh, WO_EPT_CONCURRENCY)
+EPT_QUEUE = os.environ.get('WO_EPT_QUEUE', 'ept')
+
+# Maximum number of threads used by a single EPT build
+# (None to use all available cores)
+EPT_MAX_THREADS = None
+
+# Maximum number of seconds an EPT build should take before being terminated
+EPT_TIME_LIMIT = 12 * 60 * 60
+CELERY_TASK_ROUTES = {
+    'worker.tasks.build_ept': {'queue': EPT_QUEUE},
+}
+
+# Also generate a single-file Cloud Optimized Point Cloud (COPC)
+# for each task with a point cloud (requires PDAL with writers.copc)
+POINTCLOUD_COPC = False
+
+# Maximum corridor width (in point cloud units) of point cloud cross sections
+POINTCLOUD_SECTION_MAX_WIDTH = 100
+
+# Maximum line length (in point cloud units) and maximum number of points
+# of point cloud cross sections (extracted while serving the request)
+POINTCLOUD_SECTION_MAX_LENGTH = 10000
+POINTCLOUD_SECTION_MAX_POINTS = 2000000
+
+# Maximum number of seconds spent extracting a point cloud cross section
+POINTCLOUD_SECTION_TIMEOUT = 60
+
+# Export point clouds by running a PDAL pipeline in stream mode
+# (constant memory usage) instead of pdal translate
+POINTCLOUD_EXPORT_STREAMING = True
+
 # Username to log-in automatically if the user is anonymous
 # (e.g. for a demo or read-only site)
 AUTO_LOGIN_USER = None
@@ -412,6 +518,9 @@ DASHBOARD_ONBOARDING = True
 
 if TESTING or FLUSHING:
     CELERY_TASK_ALWAYS_EAGER = True
+    TASK_POLL_MIN_INTERVAL = 0
+    TASK_POLL_MAX_INTERVAL = 0
+    TASK_SCHEDULE_ON_SAVE = False
     EXTERNAL_AUTH_ENDPOINT = 'http://0.0.0.0:5555/auth'
 
 try:
@@ -58,7 +58,11 @@ start(){
 	action=$1
 
 	echo "Starting worker using broker at $WO_BROKER"
-	celery -A worker worker --autoscale $WEB_CONCURRENCY,2 --max-tasks-per-child 1000 --loglevel=warn > /dev/null
+
+	# EPT builds run in their own pool, so that they cannot hold up task processing
+	celery -A worker worker -Q ${WO_EPT_QUEUE:-ept} -n ept@%h --concurrency ${WO_EPT_CONCURRENCY:-1} --max-tasks-per-child 1000 --loglevel=warn > /dev/null &
+
+	celery -A worker worker -Q celery --autoscale $WEB_CONCURRENCY,2 --max-tasks-per-child 1000 --loglevel=warn > /dev/null
 }
 
 start_scheduler(){
@@ -52,6 +52,22 @@ app.conf.beat_schedule = {
             'retry': False
         }
     },
+    'cleanup-image-store': {
+        'task': 'worker.tasks.cleanup_image_store',
+        'schedule': 21600,
+        'options': {
+            'expires': 10799,
+            'retry': False
+        }
+    },
+    'reconcile-task-counters': {
+        'task': 'worker.tasks.reconcile_task_counters',
+        'schedule': 600,
+        'options': {
+            'expires': 299,
+            'retry': False
+        }
+    },
     'process-pending-tasks': {
         'task': 'worker.tasks.process_pending_tasks',
         'schedule': 5,
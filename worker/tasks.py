@@ -1,4 +1,5 @@
 import os
+import math
 import shutil
 import tempfile
 import traceback
@@ -8,21 +9,27 @@ import requests
 
 import time
 from threading import Event, Thread
+from concurrent.futures import ThreadPoolExecutor
 from celery.utils.log import get_task_logger
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Count
 from django.db.models import Q
+from django.db import transaction
 from app.models import Profile
 
 from app.models import Project
 from app.models import Task
 from nodeodm import status_codes
 from nodeodm.models import ProcessingNode
+from pyodm.exceptions import NodeConnectionError
 from webodm import settings
 import worker
 from .celery import app
 from app.raster_utils import export_raster as export_raster_sync, extension_for_export_format
 from app.pointcloud_utils import export_pointcloud as export_pointcloud_sync
+from app import image_store
+from app import pending_actions
+from app.classes.chunked_upload import cleanup_sessions, is_session_file
 from django.utils import timezone
 from datetime import timedelta
 import redis
@@ -38,9 +45,12 @@ def update_nodes_info():
     if settings.NODE_OPTIMISTIC_MODE:
         return
     
-    processing_nodes = ProcessingNode.objects.all()
-    for processing_node in processing_nodes:
-        processing_node.update_node_info()
+    processing_nodes = list(ProcessingNode.objects.all())
+    if len(processing_nodes) == 0:
+        return
+
+    def update_node(processing_node):
+        updated = processing_node.update_node_info(commit=False)
 
         # Workaround for mysterious "webodm_node-odm-1" or "webodm-node-odm-1" hostname switcharoo on Mac
         # Technically we already check for the correct hostname during setup, 
@@ -52,12 +62,23 @@ def update_nodes_info():
             except:
                 # Hostname was invalid, try renaming
                 processing_node.hostname = 'webodm-node-odm-1'
-                processing_node.update_node_info()
+                updated = processing_node.update_node_info(commit=False)
                 if processing_node.is_online():
                     logger.info("Found and fixed webodm_node-odm-1 hostname switcharoo")
                 else:
                     processing_node.hostname = check_hostname
-                processing_node.save()
+
+        return updated
+
+    # Offline nodes only cost one timeout, in parallel
+    with ThreadPoolExecutor(max_workers=min(len(processing_nodes), settings.NODE_INFO_MAX_WORKERS)) as executor:
+        updated = list(executor.map(update_node, processing_nodes))
+
+    # Saved one at a time (not with bulk_update) so that post_save receivers
+    # (including those of plugins) are notified of the changes
+    for processing_node, u in zip(processing_nodes, updated):
+        if u:
+            processing_node.save(update_fields=ProcessingNode.NODE_INFO_FIELDS + ['hostname'])
 
 @app.task(ignore_result=True)
 def cleanup_projects():
@@ -100,7 +121,14 @@ def cleanup_tmp_directory():
     tmpdir = settings.MEDIA_TMP
     time_limit = 60 * 60 * 24
 
+    # Chunked uploads expire after UPLOAD_SESSION_TTL seconds without activity
+    for uuid in cleanup_sessions(settings.FILE_UPLOAD_TEMP_DIR, settings.UPLOAD_SESSION_TTL):
+        logger.info('Expired upload session: %s' % uuid)
+
     for f in os.listdir(tmpdir):
+        if is_session_file(tmpdir, f):
+            continue
+
         now = time.time()
         filepath = os.path.join(tmpdir, f)
         modified = os.stat(filepath).st_mtime
@@ -132,6 +160,31 @@ def cleanup_cache_directory():
 
                 logger.info('Cleaned up: %s (%s)' % (filepath, modified))
 
+@app.task(ignore_result=True)
+def cleanup_image_store():
+    # Delete images that are no longer referenced by any task
+    removed = image_store.collect_garbage()
+    if removed > 0:
+        logger.info("Removed %s unreferenced images from the image store" % removed)
+
+@app.task(ignore_result=True)
+def reconcile_task_counters():
+    # Images count and size of tasks are updated incrementally
+    # during uploads. Recompute them from disk for tasks that
+    # are receiving uploads or waiting to be processed
+    # (skipping those with recent upload activity)
+    tasks = Task.objects.filter(Q(partial=True) | Q(status__isnull=True) | Q(status=status_codes.QUEUED)).select_related('project__owner__profile')
+    for t in tasks:
+        try:
+            images_count, size = t.images_count, t.size
+            if not t.reconcile_counters(idle_time=settings.TASK_RECONCILE_IDLE_TIME):
+                continue
+            if images_count != t.images_count or abs(size - t.size) > 0.01:
+                logger.info("Reconciled counters for {}: {} images ({}), {:.2f} MB ({:.2f})".format(t, t.images_count, images_count, t.size, size))
+                t.project.owner.profile.clear_used_quota_cache()
+        except Exception as e:
+            logger.warning("Cannot reconcile counters for {}: {}".format(t, str(e)))
+
 # Based on https://stackoverflow.com/questions/22498038/improve-current-implementation-of-a-setinterval-python/22498708#22498708
 def setInterval(interval, func, *args):
     stopped = Event()
@@ -149,6 +202,9 @@ def process_task(taskId):
     cancel_monitor = None
     delete_lock = True
 
+    # Changes from now on can schedule the task again
+    redis_client.delete('task_scheduled_{}'.format(taskId))
+
     try:
         task_lock_last_update = redis_client.getset(lock_id, time.time())
         if task_lock_last_update is not None:
@@ -192,33 +248,231 @@ def process_task(taskId):
 
 
 
+@app.task(ignore_result=True)
+def build_ept(taskId, threads=None):
+    # Multiple EPT builds for the same task are wasteful, skip duplicates
+    lock_id = 'ept_lock_{}'.format(taskId)
+    if not redis_client.set(lock_id, time.time(), nx=True, ex=settings.EPT_TIME_LIMIT):
+        logger.info("EPT for task {} is already being built".format(taskId))
+        return
+
+    try:
+        try:
+            task = Task.objects.get(pk=taskId)
+        except ObjectDoesNotExist:
+            logger.info("Task {} has already been deleted.".format(taskId))
+            return
+
+        try:
+            built_ept = task.check_ept(threads=threads)
+            built_copc = task.check_copc(threads=threads)
+        finally:
+            task.set_ept_queued(False)
+
+        if built_ept or built_copc:
+            task.update_ept_fields()
+            task.update_backup_digests()
+            logger.info("Built {} for {}".format(", ".join([f for f, b in [("EPT", built_ept), ("COPC", built_copc)] if b]), task))
+    finally:
+        redis_client.delete(lock_id)
+
+@app.task(ignore_result=True)
+def update_backup_digests(taskId):
+    try:
+        task = Task.objects.get(pk=taskId)
+    except ObjectDoesNotExist:
+        logger.info("Task {} has already been deleted.".format(taskId))
+        return
+
+    try:
+        task.compute_backup_files()
+    except Exception as e:
+        logger.warning("Cannot compute backup digests for {}: {}".format(task, str(e)))
+
 def get_pending_tasks():
     # All tasks that have a processing node assigned
     # Or that need one assigned (via auto)
-    # or tasks that need a status update
+    # or tasks that are due for a status update
     # or tasks that have a pending action
-    # no partial tasks allowed
+    # no partial tasks allowed (unless they are being duplicated)
+    # (copies being duplicated inherit the status, node and UUID of the original
+    # and are not due for status checks until their files have been copied)
     return Task.objects.filter(Q(processing_node__isnull=True, auto_processing_node=True, partial=False) |
                                 Q(Q(status=None) | Q(status__in=[status_codes.QUEUED, status_codes.RUNNING]),
+                                  Q(next_check_at__isnull=True) | Q(next_check_at__lte=timezone.now()),
+                                  ~Q(pending_action=pending_actions.DUPLICATE),
                                   processing_node__isnull=False, partial=False) |
-                                Q(pending_action__isnull=False, partial=False))
+                                Q(pending_action__isnull=False, partial=False) |
+                                Q(pending_action=pending_actions.DUPLICATE))
+
+def schedule_task(taskId):
+    """
+    Queue a task for processing, unless it's already waiting in the queue
+    :return: True if the task was queued
+    """
+    try:
+        if not redis_client.set('task_scheduled_{}'.format(taskId), time.time(), nx=True, ex=settings.TASK_SCHEDULE_DEDUP_TIMEOUT):
+            return False
+    except redis.exceptions.RedisError as e:
+        logger.warning("Cannot check if task {} is already scheduled: {}".format(taskId, str(e)))
+
+    process_task.delay(taskId)
+    return True
+
+def acquire_lock(lock_id, timeout):
+    """
+    Take a lock that expires after timeout seconds
+    :return: lock value to pass to release_lock, or None if the lock is held
+    """
+    value = str(time.time())
+    try:
+        if redis_client.set(lock_id, value, nx=True, ex=max(1, int(math.ceil(timeout)))):
+            return value
+    except redis.exceptions.RedisError as e:
+        logger.warning("Cannot acquire lock {}: {}".format(lock_id, str(e)))
+    return None
+
+def release_lock(lock_id, value):
+    try:
+        # Don't release a lock that has expired and has been taken by someone else
+        current = redis_client.get(lock_id)
+        if current is not None and current.decode('utf-8') == value:
+            redis_client.delete(lock_id)
+    except redis.exceptions.RedisError:
+        # Ignore errors, the lock will expire at some point
+        pass
+
+def get_locked_tasks(task_ids):
+    """
+    :return: set of IDs of the tasks that process_task is currently processing
+    """
+    task_ids = list(task_ids)
+    if len(task_ids) == 0:
+        return set()
+
+    try:
+        values = redis_client.mget(['task_lock_{}'.format(task_id) for task_id in task_ids])
+    except redis.exceptions.RedisError as e:
+        logger.warning("Cannot check task locks: {}".format(str(e)))
+        return set(task_ids)
+
+    now = time.time()
+    return set([task_id for task_id, v in zip(task_ids, values) if v is not None and now - float(v) <= 30])
+
+def poll_timeout(tasks_count):
+    """
+    Upper bound of the time (in seconds) needed to check the status of
+    tasks_count tasks on a processing node: one task list request followed by
+    waves of NODE_POLL_MAX_CONNECTIONS concurrent requests, each of which can be retried
+    """
+    waves = 1 + int(math.ceil(tasks_count / max(1, settings.NODE_POLL_MAX_CONNECTIONS)))
+    request_timeout = settings.NODE_HTTP_CONNECT_TIMEOUT + settings.NODE_HTTP_TIMEOUT
+    return waves * request_timeout * (settings.NODE_HTTP_RETRIES + 1)
+
+POLL_LOCK_ID = 'poll_running_tasks_lock'
+
+def poll_running_tasks(tasks):
+    """
+    Check the status of queued/running tasks, with one batch of requests
+    per processing node, and store the results with a single bulk update.
+    Only one worker polls at a time (the batch lock expires after the
+    time needed to poll all nodes). Tasks that process_task is handling are skipped,
+    and results are only stored for tasks whose status has not changed
+    (on the node or in the database) in the meantime.
+    Tasks that changed status (or for which the node reported an error)
+    are left to process_task.
+    :param tasks: queryset of tasks with a processing node and UUID
+    :return: set of IDs of tasks that need no further processing
+    """
+    by_node = {}
+
+    # Copies being duplicated share the UUID of the original task
+    tasks = list(tasks.exclude(pending_action=pending_actions.DUPLICATE).select_related('processing_node', 'project'))
+    locked = get_locked_tasks([t.id for t in tasks])
+    handled = set(locked)
+
+    for task in tasks:
+        if task.id not in locked:
+            by_node.setdefault(task.processing_node_id, []).append(task)
+
+    timeout = sum([poll_timeout(len(node_tasks)) for node_tasks in by_node.values()])
+    lock = acquire_lock(POLL_LOCK_ID, timeout)
+    if lock is None:
+        # Another worker is polling these tasks
+        return set([t.id for t in tasks])
+
+    try:
+        updates = []
+
+        for node_tasks in by_node.values():
+            processing_node = node_tasks[0].processing_node
+            prev_status = {t.id: t.status for t in node_tasks}
+
+            try:
+                infos = processing_node.get_tasks_info({t.uuid: t.get_console_lines_count() for t in node_tasks})
+            except NodeConnectionError as e:
+                logger.warning("{} connection/timeout error: {}. We'll check its tasks again later.".format(processing_node, str(e)))
+                for t in node_tasks:
+                    t.schedule_next_check(changed=False)
+                    updates.append((t, prev_status[t.id], []))
+                continue
+
+            for t in node_tasks:
+                info = infos.get(t.uuid)
+                if info is None or isinstance(info, Exception):
+                    continue
+
+                t.update_from_task_info(info, append_output=False)
+                if t.status == prev_status[t.id]:
+                    updates.append((t, prev_status[t.id], info.output))
+
+        if len(updates) > 0:
+            with transaction.atomic():
+                # Skip tasks that were changed (e.g. canceled) while polling
+                current = dict(Task.objects.select_for_update()
+                                .filter(pk__in=[t.id for t, _, _ in updates], pending_action__isnull=True)
+                                .values_list('id', 'status'))
+                updates = [(t, status, output) for t, status, output in updates if t.id in current and current[t.id] == status]
+                Task.objects.bulk_update([t for t, _, _ in updates], ['processing_time', 'status', 'running_progress',
+                                                                      'last_error', 'next_check_at'])
+
+            for t, _, output in updates:
+                t.append_console_output(output)
+                handled.add(t.id)
+    finally:
+        release_lock(POLL_LOCK_ID, lock)
+
+    return handled
 
 @app.task(ignore_result=True)
 def process_pending_tasks():
-    task_ids = get_pending_tasks().values_list('id', flat=True)
-    for task_id in task_ids:
-        process_task.delay(task_id)
+    tasks = get_pending_tasks()
+
+    # Status checks are batched per processing node
+    polled = tasks.filter(pending_action__isnull=True, processing_node__isnull=False,
+                          status__in=[status_codes.QUEUED, status_codes.RUNNING]).exclude(uuid='')
+    handled = poll_running_tasks(polled)
+
+    for task_id in tasks.values_list('id', flat=True):
+        if task_id not in handled:
+            schedule_task(task_id)
+
 
+def progress_state_callback(celery_task):
+    """
+    Build a progress callback that stores progress, throughput and ETA
+    information in the Celery task state (see ProgressTracker)
+    """
+    def progress_callback(status, perc, **meta):
+        celery_task.update_state(state="PROGRESS", meta={"status": status, "progress": perc, **meta})
+    return progress_callback
 
 @app.task(bind=True, time_limit=settings.WORKERS_MAX_TIME_LIMIT)
 def export_raster(self, input, **opts):
     try:
         logger.info("Exporting raster {} with options: {}".format(input, json.dumps(opts)))
         tmpfile = tempfile.mktemp('_raster.{}'.format(extension_for_export_format(opts.get('format', 'gtiff'))), dir=settings.MEDIA_TMP)
-        def progress_callback(status, perc):
-            self.update_state(state="PROGRESS", meta={"status": status, "progress": perc})
-        
-        export_raster_sync(input, tmpfile, progress_callback=progress_callback, **opts)
+        export_raster_sync(input, tmpfile, progress_callback=progress_state_callback(self), **opts)
         result = {'file': tmpfile}
 
         if settings.TESTING:
@@ -235,7 +489,7 @@ def export_pointcloud(self, input, **opts):
     try:
         logger.info("Exporting point cloud {} with options: {}".format(input, json.dumps(opts)))
         tmpfile = tempfile.mktemp('_pointcloud.{}'.format(opts.get('format', 'laz')), dir=settings.MEDIA_TMP)
-        export_pointcloud_sync(input, tmpfile, **opts)
+        export_pointcloud_sync(input, tmpfile, progress_callback=progress_state_callback(self), **opts)
         result = {'file': tmpfile}
 
         if settings.TESTING: